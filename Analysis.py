@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 
 from ROOT import TFile, TH1F, TH2D, TH1I, TH2I, TMath
+from EventIndex import LoadIndex, CountEvents
+import Telemetry
 import numpy as np
 from datetime import datetime as date
  
@@ -63,10 +65,14 @@ def RunAnalysis(inputName, outputName="", source="", CT_StS=0.0, CT_StBP=0.0):
     if source == "athena":
         hitTree = rootFile.Get("SCT_RDOAnalysis").Get("SCT_RDOAna")
         nOfStrips = 1280 
-        nOfParts = 0
-        for event in hitTree:
-            if len(list(event.charge)) > 0:
-                nOfParts += 1 
+        index = LoadIndex(inputName)
+        if index is not None:    # events with charge counted from the index instead of the tree
+            nOfParts = CountEvents(index)
+        else:
+            nOfParts = 0
+            for event in hitTree:
+                if len(list(event.charge)) > 0:
+                    nOfParts += 1 
     elif source == "allpix":
         hitTree = rootFile.PixelCharge
         nOfStrips = int(str(rootFile.models.Get("atlas17_dut").Get("number_of_pixels")).split(" ")[1])
@@ -78,20 +84,27 @@ def RunAnalysis(inputName, outputName="", source="", CT_StS=0.0, CT_StBP=0.0):
     print("CONFIG: Source:", source, ",  Events:", nOfParts, ",  CT_StS:", CT_StS, ",  CT_StBP:", CT_StBP)
         
     # charge_sum = 0
-    for thr in np.arange(thrStartFC, thrEndFC, thrStepFC):
+    thrRange = np.arange(thrStartFC, thrEndFC, thrStepFC)
+    nOfEntries = hitTree.GetEntries()
+    progress = Telemetry.Progress("Threshold scan", len(thrRange) * nOfEntries, bytes_read=rootFile.GetBytesRead)
+    nDone = 0
+    for thr in thrRange:
         thrE = thr * 6242.2
-        print("Current threshold [fC]:", round(thr, 1), end="\r")
+        status = "threshold " + str(round(thr, 1)) + " fC"
                
         for event in hitTree:  # iterating over all events
             cluster = GetCluster(event, thrE, source, CT_StS, CT_StBP, nOfStrips)
             if cluster > 0:
                 effHist.Fill(thr)
                 clusHist.Fill(thr, cluster)
+            nDone += 1
+            Telemetry.Update(progress, nDone, status)
 
     effHist.Scale(1 / nOfParts)
     clusHistOrig = clusHist
     clusHist = clusHist.ProfileX()
-    print("Analysis done.                                         \n")
+    Telemetry.Finish(progress, nDone)
+    print("Analysis done.\n")
     rootFile.Close()
     writeFile.Write()
     writeFile.Close()
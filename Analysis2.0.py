@@ -2,6 +2,8 @@
 
 from ROOT import TFile, TEfficiency, TGraphErrors, TCanvas, TF1, TString, TDirectory, TLegend, gStyle
 import numpy as np
+from RootArrays import HistArrays, CountsToEfficiency, ArraysToGraph
+import Telemetry
 from math import sqrt
 
 def GetHitDict(input_name):
@@ -10,15 +12,15 @@ def GetHitDict(input_name):
     hit_tree = root_file.PixelCharge
     i = 0
     hit_dict = dict()
+    progress = Telemetry.Progress("Processing events", n_particles, bytes_read=root_file.GetBytesRead)
     for event in hit_tree:
-        if (i+2) % 10 == 1:
-            print("Processing events:", round((i+1)/n_particles*100,1),"%",  end="\r")
+        Telemetry.Update(progress, i)
         charges_dict = dict()
         for stripHit in event.dut:
             charges_dict[stripHit.getIndex().Y()] = stripHit.getCharge()
         hit_dict[i] = charges_dict
         i += 1
-    print()
+    Telemetry.Finish(progress, i)
     root_file.Close()
 
     return hit_dict
@@ -39,7 +41,8 @@ def IntegrateCharge(modules_file_name, q_low = 0, q_high = 50):
     bin_low = cluster_charge.FindBin(q_low)
     bin_high = cluster_charge.FindBin(q_high)
 
-    total_charge = sum([cluster_charge.GetBinContent(bin)*cluster_charge.GetBinCenter(bin) for bin in range(bin_low, bin_high+1)])
+    (centers, contents, errors) = HistArrays(cluster_charge, flow=True)
+    total_charge = np.sum(contents[bin_low:bin_high+1] * centers[bin_low:bin_high+1])
     
     print(modules_file_name, ": ", round(total_charge,2), "ke")
 
@@ -138,44 +141,34 @@ def RunAnalysis(input_name, output_name=""):
     # Get hit dictionary
     hit_dict = GetHitDict(input_name)
     
+    # Perform threshold scanning, cluster sizes of all events at every threshold
+    clusters = np.zeros((n_thr, len(hit_dict)), dtype=np.int64)
+    progress = Telemetry.Progress("Threshold scanning", n_thr, unit="thresholds")
+    for i in range(n_thr):
+        thrE = thr_range[i] * 6242.2
+        Telemetry.Update(progress, i)
+        clusters[i] = ScanThreshold(hit_dict, thrE)
+    Telemetry.Finish(progress, n_thr)
+
     # Open root file to write the results into
     write_file = TFile("data/" + output_name, "recreate") 
     write_file.cd()
 
-    # Initialize efficiency and cluster size objects
-    eff = TEfficiency("Efficiency", "Efficiency;Threshold [fC];Efficiency", n_thr, thr_start, thr_end)
-    clus_graph = TGraphErrors(n_thr)
-    clus_graph.SetNameTitle("Average_cluster_size", "Average_cluster_size")
+    # Efficiency from the passed and total counts of every threshold
+    passed = np.count_nonzero(clusters, axis=1)
+    eff = CountsToEfficiency(thr_range, passed, len(hit_dict), n_thr, thr_start, thr_end)
+
+    # Average cluster size of events with a cluster and its error
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cluster_size = np.sum(clusters, axis=1) / passed
+        cluster_std = np.sqrt(np.sum(np.where(clusters > 0, clusters - cluster_size[:, np.newaxis], 0)**2, axis=1) / passed)
+        err = cluster_std / np.sqrt(passed - 1)
+    # Thresholds with less than 2 clusters have no cluster size error and are skipped, as in Engine.BuildClusterGraph
+    valid = passed > 1
+    clus_graph = ArraysToGraph(thr_range[valid], cluster_size[valid], ey=err[valid], name="Average_cluster_size")
     clus_graph.GetXaxis().SetTitle("Threshold [fC]")
     clus_graph.GetYaxis().SetTitle("Average cluster size") 
 
-    # Perform threshold scanning
-    for thr in thr_range:
-        thrE = thr * 6242.2
-        print("Threshold scanning:", round(thr/thr_end*100, 1), "%", end="\r")
-
-        # Scan a threshold and obtain a list of clusters
-        cluster_list = ScanThreshold(hit_dict, thrE)
-        
-        # Analyze cluster list and fill TEfficiency object
-        for cluster in cluster_list:
-            eff.Fill(bool(cluster), thr)      
-
-        # Replace zeros with NaN to obtain proper average later
-        cluster_list = [np.nan if cluster == 0 else cluster for cluster in cluster_list]
-        
-        try:
-            # Calculate average cluster size and add points to clus_graph
-            cluster_size = np.nanmean(cluster_list)
-            N = np.count_nonzero(~np.isnan(cluster_list))
-            err = np.nanstd(cluster_list)/sqrt(N-1)
-            clus_graph.SetPoint(int(np.where(thr_range == thr)[0][0]), thr, cluster_size)  
-            clus_graph.SetPointError(int(np.where(thr_range == thr)[0][0]), ex=0, ey=err)
-        except RuntimeWarning:
-            pass        
-            
-    print("\nDone.")
-
     # Efficiency fit
     fit_form = "0.5*[0]*TMath::Erfc((x-[1])/(TMath::Sqrt(2)*[2])*(1-0.6*TMath::TanH([3]*(x-[1])/TMath::Sqrt(2)*[2])))"
     fit_func = TF1("Efficiency_fit", fit_form, 0, 8)
@@ -211,7 +204,7 @@ def RunAnalysis(input_name, output_name=""):
     info_dir.WriteObject(TString(n_events), "n_events")
     info_dir.WriteObject(TString(title), "title")
     info_dir.WriteObject(TString(vt50), "vt50")
-    info_dir.WriteObject(TString(vt50), "vt50_err")
+    info_dir.WriteObject(TString(vt50_err), "vt50_err")
     info_dir.WriteObject(TString(thr_range), "thr_range")
     write_file.Close()
 
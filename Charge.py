@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+
+from ROOT import TH1D, TF1, TF1Convolution, TGraphErrors, TCanvas, TLegend, gStyle, nullptr
+from EventIndex import RawPath
+import Engine
+import numpy as np
+import json
+import os
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+CACHE_PATH = "data/charges_cache.json"
+
+# Version of the summaries, part of the cache keys so that summaries of an older ChargeSummary are recomputed
+SUMMARY_VERSION = 2
+
+
+def EventCharges(events, CT_StS=0.0, CT_StBP=0.0):
+    """Total collected charge of every event with any charge, in fC."""
+    events = Engine.ApplyCrosstalk(events, CT_StS, CT_StBP)
+    charges = np.bincount(Engine.EventIds(events), weights=events["charges"], minlength=events["n_events"])
+    return charges[charges > 0] / Engine.E_PER_FC
+
+
+def MedianCharge(charges):
+    """Median charge and its error from the order statistics around the median (68% interval)."""
+    sorted_charges = np.sort(charges)
+    n = len(sorted_charges)
+    if n == 0:
+        return (np.nan, np.nan)
+    half_width = max(int(round(0.5 * np.sqrt(n))), 1)
+    low = sorted_charges[max(n//2 - half_width, 0)]
+    high = sorted_charges[min(n//2 + half_width, n-1)]
+    return (float(np.median(sorted_charges)), float(0.5 * (high - low)))
+
+
+def ConvolutionMPV(fit_func, q_low, q_high, fit_result):
+    """Most probable value of a fitted Landau-Gauss convolution and its error.
+
+    The error propagates the fit covariance of the Landau location and width and the Gaussian sigma,
+    with derivatives of the maximum position taken by central differences of one standard deviation.
+    """
+    mpv = fit_func.GetMaximumX(q_low, q_high)
+    free = [i for i in [1, 2, 4] if fit_func.GetParError(i) > 0]
+    gradient = np.zeros(len(free))
+    for (k, i) in enumerate(free):
+        (value, step) = (fit_func.GetParameter(i), fit_func.GetParError(i))
+        fit_func.SetParameter(i, value + step)
+        mpv_high = fit_func.GetMaximumX(q_low, q_high)
+        fit_func.SetParameter(i, value - step)
+        mpv_low = fit_func.GetMaximumX(q_low, q_high)
+        fit_func.SetParameter(i, value)
+        gradient[k] = (mpv_high - mpv_low) / (2 * step)
+    covariance = np.array([[fit_result.CovMatrix(i, j) for j in free] for i in free])
+    return (mpv, float(np.sqrt(max(gradient @ covariance @ gradient, 0.0))))
+
+
+def FitLandauGauss(charges, n_bins=200, q_low=None, q_high=None):
+    """Fits the charge distribution with a Landau convoluted with a Gaussian.
+
+    The fit range is the central 99% of the charges unless q_low and q_high in fC are given.
+
+    Returns
+    -------
+    dict
+        Most probable value of the convolution "mpv" and its error "mpv_err", Landau location "landau_mpv"
+        and its error "landau_mpv_err", Landau width "width", Gaussian sigma "sigma", "chi2" and "ndf"
+    """
+    charges = np.ascontiguousarray(charges, dtype=np.float64)
+    if len(charges) == 0:
+        return {key: np.nan for key in ["mpv", "mpv_err", "landau_mpv", "landau_mpv_err", "width", "sigma", "chi2", "ndf"]}
+    if q_low is None:
+        q_low = float(np.percentile(charges, 0.5))
+    if q_high is None:
+        q_high = float(np.percentile(charges, 99.5))
+    charge_hist = TH1D("charge_hist", "Charge;Charge [fC];Events", n_bins, q_low, q_high)
+    charge_hist.SetDirectory(0)
+    charge_hist.FillN(len(charges), charges, nullptr)
+
+    (median, median_err) = MedianCharge(charges)
+    # The convolution is computed on a wider range to avoid edge effects of the FFT
+    margin = 0.5 * (q_high - q_low)
+    conv = TF1Convolution("landau", "gaus", q_low - margin, q_high + margin, True)
+    conv.SetNofPointsFFT(1000)
+    fit_func = TF1("langaus", conv, q_low, q_high, conv.GetNpar())
+    fit_func.SetParameters(charge_hist.GetMaximum() * 5, median, 0.1 * median, 0, 0.1 * median)
+    fit_func.FixParameter(3, 0)
+    fit_func.SetParLimits(2, 0, median)
+    fit_func.SetParLimits(4, 0, median)
+    fit_result = charge_hist.Fit(fit_func, "QR0S")
+
+    # The MPV of the convolution is shifted with respect to the Landau location parameter
+    (mpv, mpv_err) = ConvolutionMPV(fit_func, q_low, q_high, fit_result)
+    return {
+        "mpv": mpv,
+        "mpv_err": mpv_err,
+        "landau_mpv": fit_func.GetParameter(1),
+        "landau_mpv_err": fit_func.GetParError(1),
+        "width": fit_func.GetParameter(2),
+        "sigma": fit_func.GetParameter(4),
+        "chi2": fit_func.GetChisquare(),
+        "ndf": fit_func.GetNDF(),
+    }
+
+
+def ChargeSummary(input_name, source="allpix", CT_StS=0.0, CT_StBP=0.0):
+    """Median charge and Landau-Gauss fit of one simulation output."""
+    charges = EventCharges(Engine.ReadEvents(input_name, source), CT_StS, CT_StBP)
+    (median, median_err) = MedianCharge(charges)
+    summary = FitLandauGauss(charges)
+    summary["median"] = median
+    summary["median_err"] = median_err
+    summary["n_events"] = len(charges)
+    return summary
+
+
+def CacheKey(input_name, source, CT_StS, CT_StBP):
+    """Cache key of a summary, changes whenever the input file is rewritten."""
+    stat = os.stat(RawPath(input_name))
+    return ":".join([input_name, source, str(float(CT_StS)), str(float(CT_StBP)), str(stat.st_mtime_ns), str(stat.st_size), "v" + str(SUMMARY_VERSION)])
+
+
+def _ChargeSummary(args):
+    return ChargeSummary(*args)
+
+
+def SweepCharges(input_names, source="allpix", CT_StS=0.0, CT_StBP=0.0, n_workers=None):
+    """Charge summaries of all files of a sweep, computed in parallel and cached in CACHE_PATH.
+
+    Only files which are new or changed since the last call are processed again.
+    """
+    cache = dict()
+    if os.path.exists(CACHE_PATH):
+        with open(CACHE_PATH) as cache_file:
+            cache = json.load(cache_file)
+
+    keys = [CacheKey(input_name, source, CT_StS, CT_StBP) for input_name in input_names]
+    missing = [input_names[i] for i in range(len(keys)) if keys[i] not in cache]
+    if missing:
+        print("Processing", len(missing), "of", len(input_names), "files.")
+        jobs = [(input_name, source, CT_StS, CT_StBP) for input_name in missing]
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+            for input_name, summary in zip(missing, executor.map(_ChargeSummary, jobs)):
+                cache[CacheKey(input_name, source, CT_StS, CT_StBP)] = summary
+        with open(CACHE_PATH, "w") as cache_file:
+            json.dump(cache, cache_file, indent=1)
+
+    return [cache[key] for key in keys]
+
+
+def PlotChargeTrend(sweeps, legendEntries, plotName, quantity="median"):
+    """Plots median charge (or "mpv") vs sensor thickness for a list of sweeps with linear fits.
+
+    Parameters
+    ----------
+    sweeps : list
+        List of (input_names, source, CT_StS, CT_StBP) tuples, one per plotted series
+    legendEntries : list
+        Legend entry of every series
+    plotName : str
+        Name of the produced file in results
+    quantity : str
+        "median" or "mpv"
+    """
+    canvas = TCanvas("c1", "c1", 800, 600)
+    gStyle.SetOptStat(0)
+    gStyle.SetOptTitle(0)
+    color = [1, 2, 4, 6, 9]
+    markerStyle = [21, 22, 23, 33, 34]
+
+    legend = TLegend(0.13, 0.88 - 0.08*len(sweeps), 0.4, 0.88)
+    legend.SetBorderSize(0)
+    graphs = []
+    functions = []
+    for i in range(len(sweeps)):
+        (input_names, source, CT_StS, CT_StBP) = sweeps[i]
+        summaries = SweepCharges(input_names, source, CT_StS, CT_StBP)
+        thick = np.array([Engine.Thickness(input_name) for input_name in input_names], dtype=np.float64)
+        values = np.array([summary[quantity] for summary in summaries], dtype=np.float64)
+        errors = np.array([summary[quantity + "_err"] for summary in summaries], dtype=np.float64)
+        order = np.argsort(thick)
+
+        graphs.append(TGraphErrors(len(thick), thick[order], values[order], np.zeros(len(thick)), errors[order]))
+        graphs[i].SetMarkerSize(1)
+        graphs[i].SetMarkerColor(color[i])
+        graphs[i].SetMarkerStyle(markerStyle[i])
+        if i == 0:
+            graphs[i].GetXaxis().SetTitle("Active sensor thickness [#mum]")
+            graphs[i].GetYaxis().SetTitle("Median charge [fC]" if quantity == "median" else "Most probable charge [fC]")
+            graphs[i].GetXaxis().SetLimits(0, 330)
+            graphs[i].GetHistogram().SetMinimum(0)
+            graphs[i].GetHistogram().SetMaximum(1.1 * max(values))
+            graphs[i].Draw("AP")
+        else:
+            graphs[i].Draw("sameP")
+
+        functions.append(TF1("trendFunc" + str(i), "[0]*x+[1]", 0, 330))
+        functions[i].SetLineStyle(2)
+        functions[i].SetLineColor(color[i])
+        graphs[i].Fit(functions[i], "Q")
+        legend.AddEntry(graphs[i], legendEntries[i], "p")
+
+    legend.Draw("same")
+    canvas.SaveAs("results/" + plotName + ".pdf")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ["allpix", "athena"]:
+        print("Invalid arguments.\nUsage: python3 Charge.py SOURCE INPUT_FILE [INPUT_FILE ...]")
+    else:
+        for input_name, summary in zip(args[1:], SweepCharges(args[1:], args[0])):
+            print(input_name, ": median", round(summary["median"], 3), "+-", round(summary["median_err"], 3),
+                  "fC, MPV", round(summary["mpv"], 3), "+-", round(summary["mpv_err"], 3), "fC")
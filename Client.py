@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+import json
+import os
+import sys
+import socket
+
+
+def DefaultSocketPath():
+    """Socket of the current user: in $XDG_RUNTIME_DIR if set, otherwise in /tmp with the user id in its name."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "allpix_analysis.sock")
+    return "/tmp/allpix_analysis-" + str(os.getuid()) + ".sock"
+
+
+SOCKET_PATH = os.environ.get("ALLPIX_ANALYSIS_SOCKET", "") or DefaultSocketPath()
+
+USAGE = """Usage: python3 Client.py [--socket PATH] COMMAND
+Commands:
+    script SCRIPT [ARGS...]                 run Plotting.py, Analysis.py, ... inside the server
+    analyse INPUT_FILE [--output OUTPUT_FILE] [--source allpix|athena] [--side CT_StS] [--back CT_StBP] [--in-strip]
+    status | clear | ping | shutdown"""
+
+
+def Submit(job, socket_path=SOCKET_PATH):
+    """Sends a job to the analysis server and returns its reply."""
+    job["cwd"] = os.getcwd()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    try:
+        client.sendall((json.dumps(job) + "\n").encode())
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            reply += chunk
+    finally:
+        client.close()
+    if not reply:
+        # The server answers every job, also shutdown, so no reply means it died while running the job
+        return {"ok": False, "result": None, "output": "No reply from the analysis server, it stopped while running the job.\n"}
+    return json.loads(reply.decode())
+
+
+def ParseJob(args):
+    """Turns command line arguments into a job for the server, returns None if they are invalid."""
+    if len(args) == 0:
+        return None
+    if args[0] in ["status", "clear", "ping", "shutdown"] and len(args) == 1:
+        return {"job": args[0]}
+    if args[0] == "script" and len(args) >= 2:
+        return {"job": "script", "script": args[1], "args": args[2:]}
+    if args[0] == "analyse" and len(args) >= 2:
+        job = {"job": "analyse", "input": args[1]}
+        if "--in-strip" in args:
+            job["in_strip"] = True
+            args = [arg for arg in args if arg != "--in-strip"]
+        if len(args) % 2 != 0:
+            return None
+        options = {"--output": "output", "--source": "source", "--side": "CT_StS", "--back": "CT_StBP"}
+        for i in range(2, len(args), 2):
+            if args[i] not in options:
+                return None
+            job[options[args[i]]] = args[i+1]
+        return job
+    return None
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    socket_path = SOCKET_PATH
+    if len(args) >= 2 and args[0] == "--socket":
+        socket_path = args[1]
+        args = args[2:]
+
+    job = ParseJob(args)
+    if job is None:
+        print("Invalid arguments.\n" + USAGE)
+        sys.exit(1)
+
+    try:
+        reply = Submit(job, socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("Analysis server not running, start it with: python3 Server.py")
+        sys.exit(1)
+
+    print(reply["output"], end="")
+    if reply["result"] is not None:
+        print(reply["result"])
+    sys.exit(0 if reply["ok"] else 1)
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+from ROOT import TCanvas, TLine, gStyle
+from RootArrays import ArraysToGraph
+from SharedEvents import ApplyConfig
+import Engine
+import numpy as np
+import sys
+
+
+def PairedDifference(values_a, values_b, weights_a, weights_b):
+    """Difference of the ratio means sum(values)/sum(weights) of two configurations evaluated on the same
+    events, with its paired and its independent-samples standard error, per column.
+
+    The paired error linearises both ratios per event, so events reacting the same way to both
+    configurations cancel in the difference.
+    """
+    n = values_a.shape[0]
+    sum_w_a = weights_a.sum(axis=0).astype(np.float64)
+    sum_w_b = weights_b.sum(axis=0).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_a = values_a.sum(axis=0) / sum_w_a
+        mean_b = values_b.sum(axis=0) / sum_w_b
+        # Per-event influence of every event on both ratios
+        influence_a = (values_a - mean_a * weights_a) / (sum_w_a / n)
+        influence_b = (values_b - mean_b * weights_b) / (sum_w_b / n)
+        paired_err = np.sqrt(np.var(influence_a - influence_b, axis=0, ddof=1) / n)
+        independent_err = np.sqrt((np.var(influence_a, axis=0, ddof=1) + np.var(influence_b, axis=0, ddof=1)) / n)
+    return (mean_a - mean_b, paired_err, independent_err)
+
+
+def BootstrapVt50(clusters_a, clusters_b, thr_range, starts, n_bootstrap, rng):
+    """Standard deviation of the fitted vt50 difference over Poisson bootstrap replicas of the events,
+    with the same replica weights for both configurations.
+
+    The replica fits start from the fits of the full sample (starts), so that they stay in the same minimum.
+    """
+    passed_a = (clusters_a > 0).astype(np.float64)
+    passed_b = (clusters_b > 0).astype(np.float64)
+    differences = []
+    for i in range(n_bootstrap):
+        weights = rng.poisson(1.0, clusters_a.shape[0]).astype(np.float64)
+        vt50 = []
+        for (passed, start) in zip([passed_a, passed_b], starts):
+            replica = {"thr_range": thr_range, "n_events": int(weights.sum()), "passed": np.rint(weights @ passed).astype(np.int64)}
+            eff = Engine.BuildEfficiency(replica, "Efficiency_bootstrap")
+            vt50.append(Engine.FitEfficiency(eff, option="QR0", start=start).GetParameter(1))
+        differences.append(vt50[0] - vt50[1])
+    return float(np.std(differences, ddof=1))
+
+
+def CompareConfigs(events, config_a, config_b, thr_range=None, n_bootstrap=0, seed=0):
+    """Efficiency, cluster size and vt50 differences of two configurations applied to the same decoded events.
+
+    Parameters
+    ----------
+    events : dict
+        Event store, see Engine.ReadEvents
+    config_a, config_b : dict
+        Settings of SharedEvents.ApplyConfig; configurations with the same noise also share their random numbers
+    thr_range : array
+        Thresholds in fC, Engine.ThresholdRange() by default
+    n_bootstrap : int
+        Paired bootstrap replicas for the error of the vt50 difference, none by default
+    seed : int
+        Seed of the emulated noise (see SharedEvents.ApplyConfig) and of the bootstrap
+
+    Returns
+    -------
+    dict
+        "d_eff", "d_clus" (a - b) per threshold with their paired errors "d_eff_err", "d_clus_err" and the errors
+        of independent samples "d_eff_err_indep", "d_clus_err_indep"; "d_vt50" with "d_vt50_err" if bootstrapped;
+        the threshold scan results "a" and "b" with their fits
+    """
+    if thr_range is None:
+        thr_range = Engine.ThresholdRange()
+    clusters_a = Engine.ClusterSizes(ApplyConfig(events, config_a, seed), thr_range)
+    clusters_b = Engine.ClusterSizes(ApplyConfig(events, config_b, seed), thr_range)
+    (passed_a, passed_b) = (clusters_a > 0, clusters_b > 0)
+    ones = np.ones((clusters_a.shape[0], 1))
+
+    comparison = {"thr_range": np.asarray(thr_range), "n_events": clusters_a.shape[0], "config_a": config_a, "config_b": config_b}
+    (comparison["d_eff"], comparison["d_eff_err"], comparison["d_eff_err_indep"]) = PairedDifference(passed_a, passed_b, ones, ones)
+    (comparison["d_clus"], comparison["d_clus_err"], comparison["d_clus_err_indep"]) = PairedDifference(clusters_a, clusters_b, passed_a, passed_b)
+    for (key, clusters) in [("a", clusters_a), ("b", clusters_b)]:
+        comparison[key] = Engine.SummariseClusters(clusters, thr_range)
+        Engine.StoreFit(comparison[key], Engine.FitEfficiency(Engine.BuildEfficiency(comparison[key], "Efficiency_" + key), option="QR0"))
+    comparison["d_vt50"] = comparison["a"]["vt50"] - comparison["b"]["vt50"]
+    comparison["d_vt50_err_indep"] = np.hypot(comparison["a"]["vt50_err"], comparison["b"]["vt50_err"])
+    if n_bootstrap > 1:
+        starts = [[value for (value, error) in comparison[key]["fit"]] for key in ["a", "b"]]
+        comparison["d_vt50_err"] = BootstrapVt50(clusters_a, clusters_b, thr_range, starts, n_bootstrap, np.random.default_rng(seed))
+    return comparison
+
+
+def DrawComparison(comparison, output_name):
+    """Plots the efficiency and cluster size differences with their paired errors to results/<output_name>_diff_eff.pdf
+    and _diff_clus.pdf."""
+    gStyle.SetOptStat(0)
+    objects = []
+    for (key, title) in [("eff", "#Delta efficiency"), ("clus", "#Delta average cluster size")]:
+        valid = np.isfinite(comparison["d_" + key]) & np.isfinite(comparison["d_" + key + "_err"])
+        graph = ArraysToGraph(comparison["thr_range"][valid], comparison["d_" + key][valid], ey=comparison["d_" + key + "_err"][valid],
+                              name="Difference_" + key, title=";Threshold [fC];" + title + " (a - b)")
+        canvas = TCanvas("canvas_" + key, "canvas_" + key, 800, 600)
+        graph.SetMarkerStyle(20)
+        graph.SetMarkerSize(0.6)
+        graph.Draw("AP")
+        zero = TLine(comparison["thr_range"][0], 0, comparison["thr_range"][-1], 0)
+        zero.SetLineStyle(2)
+        zero.Draw("same")
+        canvas.SaveAs("results/" + output_name + "_diff_" + key + ".pdf")
+        objects += [canvas, graph, zero]
+    return objects
+
+
+def ParseConfig(text):
+    """Configuration from "key=value,key=value", e.g. "CT_StS=0.0153,CT_StBP=0.0096,noise=864"."""
+    config = dict()
+    for item in filter(None, text.split(",")):
+        (key, value) = item.split("=")
+        config[key] = float(value)
+    return config
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--source": "allpix", "--a": "", "--b": "", "--bootstrap": "0", "--plot": "", "--seed": "0"}
+    for i in range(1, len(args)-1, 2):
+        options[args[i]] = args[i+1]
+
+    if len(args) % 2 != 1 or not (options["--a"] or options["--b"]):
+        print("Invalid arguments.\nUsage: python3 Compare.py INPUT_FILE --a KEY=VALUE,... --b KEY=VALUE,... [--source allpix|athena] [--bootstrap N] [--plot NAME] [--seed SEED]"
+              "\nKeys: CT_StS, CT_StBP, noise, thr_dispersion")
+    else:
+        events = Engine.ReadEvents(args[0], options["--source"])
+        comparison = CompareConfigs(events, ParseConfig(options["--a"]), ParseConfig(options["--b"]), n_bootstrap=int(options["--bootstrap"]), seed=int(options["--seed"]))
+        gain = np.nanmedian(comparison["d_eff_err_indep"] / np.where(comparison["d_eff_err"] > 0, comparison["d_eff_err"], np.nan))
+        print("Events:", comparison["n_events"], ",  median error reduction of the efficiency difference: x" + str(round(float(gain), 1)))
+        vt50_err = comparison.get("d_vt50_err", comparison["d_vt50_err_indep"])
+        print("vt50(a) - vt50(b) =", round(comparison["d_vt50"], 4), "+-", round(vt50_err, 4), "fC",
+              "(paired bootstrap)" if "d_vt50_err" in comparison else "(independent fit errors)")
+        for i in range(0, len(comparison["thr_range"]), 10):
+            print("thr", round(comparison["thr_range"][i], 1), "fC:  d_eff =", round(comparison["d_eff"][i], 5), "+-", round(comparison["d_eff_err"][i], 5),
+                  "(independent +-", str(round(comparison["d_eff_err_indep"][i], 5)) + "),  d_clus =", round(comparison["d_clus"][i], 4), "+-",
+                  round(comparison["d_clus_err"][i], 4))
+        if options["--plot"]:
+            DrawComparison(comparison, options["--plot"])
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+import ROOT
+from ROOT import TFile, RDataFrame, gInterpreter
+from RootArrays import HistContents
+from EventIndex import E_PER_FC, RawPath
+import numpy as np
+import threading
+import warnings
+
+# Per-event cluster sizes at all thresholds, following Engine.ApplyCrosstalk and Engine.ClusterSizes
+CLUSTER_CODE = """
+#include <algorithm>
+#include <numeric>
+#include <vector>
+#include "ROOT/RVec.hxx"
+
+namespace AllpixAnalysis {
+
+struct ScanSettings {
+   std::vector<double> thresholds;
+   int n_strips = 1280;
+   double ct_sts = 0.0;
+   double ct_stbp = 0.0;
+   bool inclusive = true;
+};
+
+// Strip charges after crosstalk, contributions to the same strip summed in the order of Engine.MergeHits
+ROOT::RVecD CrosstalkCharges(const ROOT::RVecI &strips, const ROOT::RVecD &charges, const ScanSettings &settings)
+{
+   if (settings.ct_sts == 0 && settings.ct_stbp == 0)
+      return charges;
+   const std::size_t n = strips.size();
+   ROOT::RVecI all_strips(3 * n);
+   ROOT::RVecD all_charges(3 * n);
+   for (std::size_t i = 0; i < n; ++i) {
+      all_strips[i] = strips[i];
+      all_charges[i] = charges[i] * (1 - 2 * settings.ct_sts - settings.ct_stbp);
+      all_strips[n + i] = strips[i] - 1;
+      all_charges[n + i] = charges[i] * settings.ct_sts;
+      all_strips[2 * n + i] = strips[i] + 1;
+      all_charges[2 * n + i] = charges[i] * settings.ct_sts;
+   }
+   std::vector<std::size_t> order(3 * n);
+   std::iota(order.begin(), order.end(), 0);
+   std::stable_sort(order.begin(), order.end(), [&](std::size_t a, std::size_t b) { return all_strips[a] < all_strips[b]; });
+
+   ROOT::RVecD merged;
+   int last_strip = -1;
+   for (std::size_t i : order) {
+      if (all_strips[i] < 0 || all_strips[i] >= settings.n_strips)
+         continue;
+      if (merged.empty() || all_strips[i] != last_strip) {
+         merged.push_back(all_charges[i]);
+         last_strip = all_strips[i];
+      } else {
+         merged.back() += all_charges[i];
+      }
+   }
+   return merged;
+}
+
+ROOT::RVecD ClusterSizes(const ROOT::RVecI &strips, const ROOT::RVecD &charges, const ScanSettings &settings)
+{
+   const std::size_t n_thr = settings.thresholds.size();
+   ROOT::RVecD clusters(n_thr, 0.0);
+   for (double charge : CrosstalkCharges(strips, charges, settings)) {
+      // Thresholds are ascending, a strip passes the first ones only
+      for (std::size_t j = 0; j < n_thr; ++j) {
+         if (settings.inclusive ? settings.thresholds[j] > charge : settings.thresholds[j] >= charge)
+            break;
+         clusters[j] += 1;
+      }
+   }
+   return clusters;
+}
+
+ROOT::RVecD ThresholdIndices(std::size_t n_thr)
+{
+   ROOT::RVecD indices(n_thr);
+   std::iota(indices.begin(), indices.end(), 0.0);
+   return indices;
+}
+
+} // namespace AllpixAnalysis
+"""
+
+# Tree and JIT-compiled strip and charge columns of every simulation source
+HIT_COLUMNS = {
+    "allpix": (
+        "PixelCharge",
+        "ROOT::RVecI strips(dut.size()); for (std::size_t i = 0; i < dut.size(); ++i) strips[i] = dut[i]->getIndex().Y(); return strips;",
+        "ROOT::RVecD charges(dut.size()); for (std::size_t i = 0; i < dut.size(); ++i) charges[i] = dut[i]->getCharge(); return charges;",
+    ),
+    "athena": (
+        "SCT_RDOAnalysis/SCT_RDOAna",
+        "ROOT::RVecI(strip_sdo.begin(), strip_sdo.end())",
+        "ROOT::RVecD(charge.begin(), charge.end())",
+    ),
+}
+
+_declared = [False]
+# Threads requested when this module enabled the implicit multithreading, shared by the whole process
+_implicit_mt = {"n_threads": None}
+_setup_lock = threading.Lock()
+
+
+def NumberOfStrips(input_name, source):
+    """Number of strips of the sensor, as in Engine.ReadEvents."""
+    if source == "athena":
+        return 1280
+    root_file = TFile(RawPath(input_name))
+    n_strips = int(str(root_file.models.Get("atlas17_dut").Get("number_of_pixels")).split(" ")[1])
+    root_file.Close()
+    return n_strips
+
+
+def ScanThresholds(input_name, thr_range, source="allpix", CT_StS=0.0, CT_StBP=0.0, inclusive=True, n_threads=0):
+    """Threshold scan of a simulation output as one RDataFrame event loop.
+
+    Reading, crosstalk and cluster counting run as JIT-compiled C++ columns, passed events and
+    cluster size sums are filled into histograms indexed by threshold.
+
+    Parameters
+    ----------
+    thr_range : array
+        Ascending thresholds in fC
+    n_threads : int
+        Threads of the implicit multithreading, 0 for all cores and 1 to run sequentially. The thread pool is
+        created by the first multithreaded scan of the process, later different values give a RuntimeWarning
+
+    Returns
+    -------
+    dict
+        Counts in the format of Engine.SummariseClusters
+    """
+    if source not in HIT_COLUMNS:
+        raise ValueError("Unknown source: " + str(source))
+    with _setup_lock:
+        if not _declared[0]:
+            gInterpreter.Declare(CLUSTER_CODE)
+            _declared[0] = True
+        if ROOT.IsImplicitMTEnabled():
+            # The thread pool is process wide and keeps the size it was created with
+            enabled = _implicit_mt["n_threads"] if _implicit_mt["n_threads"] is not None else ROOT.GetThreadPoolSize()
+            if n_threads != 0 and n_threads != enabled:
+                warnings.warn("Implicit multithreading is already enabled with n_threads=" + str(enabled) + ", n_threads="
+                              + str(n_threads) + " is ignored", RuntimeWarning, stacklevel=2)
+        elif n_threads != 1:
+            ROOT.EnableImplicitMT(n_threads)
+            _implicit_mt["n_threads"] = n_threads
+
+    thr_e = np.asarray(thr_range) * E_PER_FC
+    # The settings are a constant of the JIT-compiled column, so concurrent scans of one process do not share them
+    settings = "{{" + ", ".join(repr(float(thr)) for thr in thr_e) + "}, " + str(NumberOfStrips(input_name, source)) + ", " \
+               + repr(float(CT_StS)) + ", " + repr(float(CT_StBP)) + ", " + ("true" if inclusive else "false") + "}"
+    cluster_code = "static const AllpixAnalysis::ScanSettings settings" + settings + "; " \
+                   + "return AllpixAnalysis::ClusterSizes(hit_strips, hit_charges, settings);"
+
+    (tree_name, strips_code, charges_code) = HIT_COLUMNS[source]
+    df = RDataFrame(tree_name, RawPath(input_name))
+    if source == "athena":
+        # Athena events without charge are not counted as particles
+        df = df.Filter("charge.size() > 0")
+    df = (df.Define("hit_strips", strips_code)
+            .Define("hit_charges", charges_code)
+            .Define("clusters", cluster_code)
+            .Define("has_cluster", "ROOT::RVecD(clusters > 0)")
+            .Define("clusters2", "clusters * clusters")
+            .Define("thr_index", "AllpixAnalysis::ThresholdIndices(" + str(len(thr_e)) + ")"))
+
+    n_thr = len(thr_e)
+    hists = dict()
+    for column in ["has_cluster", "clusters", "clusters2"]:
+        model = ROOT.RDF.TH1DModel("rdf_" + column, "", n_thr, -0.5, n_thr - 0.5)
+        hists[column] = df.Histo1D(model, "thr_index", column)
+    n_events = df.Count()
+
+    # The first GetValue runs the event loop for all booked results
+    return {
+        "thr_range": np.asarray(thr_range),
+        "n_events": int(n_events.GetValue()),
+        "passed": np.rint(HistContents(hists["has_cluster"].GetPtr())).astype(np.int64),
+        "clus_sum": HistContents(hists["clusters"].GetPtr()).copy(),
+        "clus_sum2": HistContents(hists["clusters2"].GetPtr()).copy(),
+    }
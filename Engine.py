@@ -0,0 +1,833 @@
+#!/usr/bin/python3
+
+from ROOT import TFile, TEfficiency, TGraphErrors, TF1, TString, gEnv, EnableThreadSafety
+from RootArrays import CountsToEfficiency, CountsToEfficiency2D
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+import DataFrame
+import EventIndex
+import Telemetry
+import numpy as np
+import hashlib
+import multiprocessing
+
+# Conversion from fC to electrons
+E_PER_FC = 6242.2
+
+# Branches of the hit trees needed by ReadEvents
+HIT_BRANCHES = {"allpix": ["dut"], "athena": ["strip_sdo", "charge"]}
+
+# Upper limit of the TTreeCache size in bytes
+MAX_CACHE_SIZE = 64 * 1024**2
+
+# Inputs decoded ahead of the one being analysed by PrefetchEvents
+PREFETCH_DEPTH = 2
+
+# Fractions of the events analysed by the successive steps of PreviewAnalysis
+PREVIEW_FRACTIONS = [0.01, 0.04, 0.16, 0.64, 1.0]
+
+# Crosstalk of the "-CT" thesis files, see Analysis.py
+CT_FINAL = (0.0153, 0.0096)
+
+# Skewed complementary error function used for all efficiency fits
+FIT_FORM = "0.5*[0]*TMath::Erfc((x-[1])/(TMath::Sqrt(2)*[2])*(1-0.6*TMath::TanH([3]*(x-[1])/TMath::Sqrt(2)*[2])))"
+
+
+def StripsTag(strips):
+    """Short hash of a list of strips for file names, the same for any order of the strips."""
+    return hashlib.sha1(",".join(str(strip) for strip in sorted(set(int(strip) for strip in strips))).encode()).hexdigest()[:8]
+
+
+def SettingsTag(settings):
+    """File name part of the settings applied to decoded events, e.g. "-noise864e" or "-overlay2p5poisson", see NoiseLevel.
+
+    Crosstalk is included if any is applied, e.g. "-ct0p0153x0p0096", as well as a threshold dispersion
+    ("-disp300e") and the dead and noisy strips ("-dead" and "-noisy" with a hash of the strips, see StripsTag).
+    """
+    tag = ""
+    if settings.get("CT_StS", 0) or settings.get("CT_StBP", 0):
+        tag += "-ct" + (str(float(settings.get("CT_StS", 0))) + "x" + str(float(settings.get("CT_StBP", 0)))).replace(".", "p")
+    if "noise" in settings:
+        tag += "-noise" + str(int(settings["noise"])) + "e"
+    if settings.get("thr_dispersion", 0):
+        tag += "-disp" + str(int(settings["thr_dispersion"])) + "e"
+    if len(settings.get("dead_strips", [])) > 0:
+        tag += "-dead" + StripsTag(settings["dead_strips"])
+    if len(settings.get("noisy_strips", [])) > 0:
+        tag += "-noisy" + StripsTag(settings["noisy_strips"])
+    if "overlay" in settings:
+        tag += "-overlay" + str(settings["overlay"]).replace(".", "p") + ("poisson" if settings.get("overlay_poisson", 0) else "")
+    return tag
+
+
+def AnalysedName(input_name, CT_StS=0.0, CT_StBP=0.0, settings=None):
+    """Default name of the analysed file of an input, different for every crosstalk and settings, see SettingsTag."""
+    return input_name.split("_")[0] + SettingsTag(dict({"CT_StS": CT_StS, "CT_StBP": CT_StBP}, **(settings or {}))) + "_analysed.root"
+
+
+def NoiseLevel(input_name):
+    """Noise in electrons from a file name such as "0deg-280um-864e_output.root", nan if it has none.
+
+    Noise emulated on top of a simulation ("0deg-280um-0e-noise864e", see SettingsTag) adds in quadrature
+    to the simulated noise.
+    """
+    (simulated, emulated) = (np.nan, np.nan)
+    for part in input_name.split("_")[0].split("-"):
+        if part.startswith("noise") and part.endswith("e") and part[5:-1].isdigit():
+            emulated = float(part[5:-1])
+        elif part.endswith("e") and part[:-1].isdigit():
+            simulated = float(part[:-1])
+    if np.isnan(emulated):
+        return simulated
+    return float(np.hypot(np.nan_to_num(simulated), emulated))
+
+
+def Thickness(input_name):
+    """Sensor thickness in um from a file name such as "0deg-280um-864e_output.root", nan if it has none."""
+    for part in input_name.split("_")[0].split("-"):
+        if part.endswith("um") and part[:-2].isdigit():
+            return float(part[:-2])
+    return np.nan
+
+
+def ThresholdRange(thr_start=0.3, thr_end=8, thr_step=0.1):
+    """Threshold points in fC, the same as used by Analysis2.0.RunAnalysis."""
+    return np.arange(thr_start, thr_end+thr_step, thr_step)
+
+
+def ParseLength(value):
+    """Converts an Allpix length such as "74.5um" to mm, numbers without unit are already in mm."""
+    units = {"nm": 1e-6, "um": 1e-3, "mm": 1.0, "cm": 10.0}
+    for unit in units:
+        if value.endswith(unit):
+            return float(value[:-len(unit)]) * units[unit]
+    return float(value)
+
+
+def TrackPosition(particles):
+    """Local position across the strips (Y) of the primary particle, averaged over its path in the sensor."""
+    for particle in particles:
+        if not particle.getParent():
+            start = particle.getLocalStartPoint()
+            end = particle.getLocalEndPoint()
+            return 0.5 * (start.Y() + end.Y())
+    return np.nan
+
+
+def ConfigureReading(tree, branches, max_cache_size=MAX_CACHE_SIZE):
+    """Disables all branches of a tree except the given ones and sizes the TTreeCache to read them in one pass.
+
+    The cache holds the compressed baskets of the enabled branches, up to max_cache_size bytes.
+    """
+    tree.SetBranchStatus("*", 0)
+    zip_bytes = 0
+    for branch in branches:
+        tree.SetBranchStatus(branch, 1)
+        if tree.GetBranch(branch).GetListOfBranches().GetEntries() > 0:
+            tree.SetBranchStatus(branch + ".*", 1)
+        zip_bytes += tree.GetBranch(branch).GetZipBytes("*")
+    tree.SetCacheSize(int(min(max(zip_bytes, 1024**2), max_cache_size)))
+    for branch in branches:
+        tree.AddBranchToCache(branch, True)
+    # The access pattern is known, no need for the learning phase
+    tree.StopCacheLearningPhase()
+
+
+def OpenHitTree(input_name, source="allpix"):
+    """Opens a simulation output and returns (file, hit tree, number of strips)."""
+    root_file = TFile.Open(EventIndex.RawPath(input_name))
+    if not root_file or root_file.IsZombie():
+        raise OSError("Cannot open " + EventIndex.RawPath(input_name))
+    if source == "allpix":
+        hit_tree = root_file.PixelCharge
+        n_strips = int(str(root_file.models.Get("atlas17_dut").Get("number_of_pixels")).split(" ")[1])
+    elif source == "athena":
+        hit_tree = root_file.Get("SCT_RDOAnalysis").Get("SCT_RDOAna")
+        n_strips = 1280
+    else:
+        root_file.Close()
+        raise ValueError("Unknown source: " + str(source))
+    return (root_file, hit_tree, n_strips)
+
+
+def ReadEvents(input_name, source="allpix", truth=False, index=True, prefetch=False, entries=None):
+    """Decodes strip hits of all events of a simulation output into flat arrays.
+
+    Parameters
+    ----------
+    input_name : str
+        Name of the simulation output file in data/raw, or its absolute path
+    source : str
+        Simulation source, "allpix" or "athena"
+    truth : bool
+        Also read the MC-truth track position of every event (Allpix only)
+    index : bool
+        Store the per-event summary index next to the input, see EventIndex
+    prefetch : bool
+        Read the next baskets asynchronously while decoding, for inputs on network storage
+    entries : array
+        Tree entries to decode, preferably in increasing order, all entries by default. No index
+        is stored for a subset of entries
+
+    Returns
+    -------
+    dict
+        Event store; hits of event i are strips[offsets[i]:offsets[i+1]] with charges
+        charges[offsets[i]:offsets[i+1]] in electrons, "entry" holds the tree entry of every
+        event. With truth, "track_y" holds the track position in mm and "pitch" the strip pitch in mm.
+        "bytes_read" and "file_size" give the I/O of the decoding.
+    """
+    gEnv.SetValue("TFile.AsyncPrefetching", int(prefetch))
+    (root_file, hit_tree, n_strips) = OpenHitTree(input_name, source)
+    if truth:
+        if source != "allpix":
+            root_file.Close()
+            raise ValueError("MC truth is only available for Allpix outputs.")
+        mc_tree = root_file.MCParticle
+        pitch = ParseLength(str(root_file.models.Get("atlas17_dut").Get("pixel_size")).split(" ")[1])
+    ConfigureReading(hit_tree, HIT_BRANCHES[source])
+
+    n_hits = []
+    strips = []
+    charges = []
+    track_y = []
+    event_entries = []
+    progress = Telemetry.Progress("Decoding " + str(input_name), hit_tree.GetEntries() if entries is None else len(entries),
+                                  bytes_read=root_file.GetBytesRead)
+    for (i_read, i_event) in enumerate(range(hit_tree.GetEntries()) if entries is None else entries):
+        Telemetry.Update(progress, i_read)
+        i_event = int(i_event)
+        hit_tree.GetEntry(i_event)
+        event = hit_tree
+        if truth:
+            mc_tree.GetEntry(i_event)
+            track_y.append(TrackPosition(mc_tree.dut))
+        if source == "allpix":
+            event_strips = [strip_hit.getIndex().Y() for strip_hit in event.dut]
+            event_charges = [strip_hit.getCharge() for strip_hit in event.dut]
+        else:
+            event_strips = list(event.strip_sdo)
+            event_charges = list(event.charge)
+            # Athena events without charge are not counted as particles
+            if len(event_charges) == 0:
+                continue
+        n_hits.append(len(event_strips))
+        strips.extend(event_strips)
+        charges.extend(event_charges)
+        event_entries.append(i_event)
+    n_entries = hit_tree.GetEntries()
+    (bytes_read, file_size) = (root_file.GetBytesRead(), root_file.GetSize())
+    Telemetry.Finish(progress, progress["total"], str(round(100 * bytes_read / max(file_size, 1), 1)) + "% of the file")
+    root_file.Close()
+
+    events = MakeEvents(n_hits, strips, charges, n_strips, name=input_name, source=source)
+    events["entry"] = np.asarray(event_entries, dtype=np.int64)
+    events["n_entries"] = n_entries
+    events["bytes_read"] = bytes_read
+    events["file_size"] = file_size
+    if truth:
+        events["track_y"] = np.asarray(track_y, dtype=np.float64)
+        events["pitch"] = pitch
+    if index and entries is None:
+        try:
+            EventIndex.WriteIndex(input_name, EventIndex.BuildIndex(events))
+        except OSError as error:
+            print("Could not store the event index of", input_name + ":", error)
+    return events
+
+
+def PrefetchEvents(inputs, depth=PREFETCH_DEPTH, truth=False):
+    """Decodes a list of inputs in background threads while the caller analyses the previous ones.
+
+    At most depth inputs are decoded ahead of the one handed out, which bounds the memory to
+    depth + 1 event stores; depth 0 decodes every input only when it is needed.
+
+    Parameters
+    ----------
+    inputs : list
+        (input_name, source) pairs, see ReadEvents
+    depth : int
+        Number of inputs decoded ahead, each in its own thread
+    truth : bool
+        Also read the MC-truth track positions
+
+    Yields
+    ------
+    tuple
+        (input_name, source, events) in the order of inputs; a failed decoding raises when its input is reached
+    """
+    if depth < 1:
+        for (input_name, source) in inputs:
+            yield (input_name, source, ReadEvents(input_name, source, truth))
+        return
+    EnableThreadSafety()
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        try:
+            for (input_name, source) in inputs:
+                pending.append((input_name, source, executor.submit(ReadEvents, input_name, source, truth)))
+                if len(pending) > depth:
+                    (input_name, source, future) = pending.popleft()
+                    yield (input_name, source, future.result())
+            while pending:
+                (input_name, source, future) = pending.popleft()
+                yield (input_name, source, future.result())
+        finally:
+            # Inputs not started yet are dropped if the caller stops early
+            for (input_name, source, future) in pending:
+                future.cancel()
+
+
+def MakeEvents(n_hits, strips, charges, n_strips, name="", source="allpix"):
+    """Builds an event store from per-event hit multiplicities and flat strip and charge lists."""
+    offsets = np.zeros(len(n_hits)+1, dtype=np.int64)
+    np.cumsum(n_hits, out=offsets[1:])
+    return {
+        "name": name,
+        "source": source,
+        "n_strips": n_strips,
+        "n_events": len(n_hits),
+        "offsets": offsets,
+        "strips": np.asarray(strips, dtype=np.int32),
+        "charges": np.asarray(charges, dtype=np.float64),
+    }
+
+
+# Event store arrays with one value per event rather than per hit
+EVENT_ARRAYS = ["track_y", "entry"]
+
+
+def SelectEvents(events, event_indices):
+    """Event store with only the given events, in the given order."""
+    event_indices = np.asarray(event_indices, dtype=np.int64)
+    starts = events["offsets"][event_indices]
+    n_hits = events["offsets"][event_indices+1] - starts
+    offsets = np.zeros(len(event_indices)+1, dtype=np.int64)
+    np.cumsum(n_hits, out=offsets[1:])
+    hit_indices = np.repeat(starts - offsets[:-1], n_hits) + np.arange(offsets[-1])
+
+    selected = dict(events)
+    selected["n_events"] = len(event_indices)
+    selected["offsets"] = offsets
+    selected["strips"] = events["strips"][hit_indices]
+    selected["charges"] = events["charges"][hit_indices]
+    for key in EVENT_ARRAYS:
+        if key in events:
+            selected[key] = events[key][event_indices]
+    return selected
+
+
+def EventIds(events):
+    """Index of the event every hit of the event store belongs to."""
+    return np.repeat(np.arange(events["n_events"], dtype=np.int64), np.diff(events["offsets"]))
+
+
+def MergeHits(events, event_ids, strips, charges):
+    """Sums charges of hits on the same strip of the same event and returns a new event store.
+
+    Hits on strips outside of the sensor are dropped.
+    """
+    n_strips = events["n_strips"]
+    n_events = events["n_events"]
+    in_range = (strips >= 0) & (strips < n_strips)
+    keys = event_ids[in_range].astype(np.int64) * n_strips + strips[in_range]
+    keys, inverse = np.unique(keys, return_inverse=True)
+    merged_charges = np.bincount(inverse.ravel(), weights=charges[in_range], minlength=len(keys))
+
+    merged = dict(events)
+    merged["offsets"] = np.zeros(n_events+1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // n_strips, minlength=n_events), out=merged["offsets"][1:])
+    merged["strips"] = (keys % n_strips).astype(np.int32)
+    merged["charges"] = merged_charges
+    return merged
+
+
+def ApplyCrosstalk(events, CT_StS=0.0, CT_StBP=0.0):
+    """Returns the event store with strip-to-strip and strip-to-backplane crosstalk applied.
+
+    Every hit strip loses 2*CT_StS + CT_StBP of its charge and passes CT_StS of it to each neighbour,
+    as in Analysis.GetCluster, but charges shared into the same strip from both sides add up.
+    """
+    if CT_StS == 0 and CT_StBP == 0:
+        return events
+
+    event_ids = EventIds(events)
+    strips = events["strips"]
+    charges = events["charges"]
+    return MergeHits(
+        events,
+        np.concatenate([event_ids, event_ids, event_ids]),
+        np.concatenate([strips, strips - 1, strips + 1]),
+        np.concatenate([charges * (1 - 2*CT_StS - CT_StBP), charges * CT_StS, charges * CT_StS]),
+    )
+
+
+def ClusterSizes(events, thr_range, inclusive=True):
+    """Cluster size of every event at every threshold as an (n_events, n_thr) array.
+
+    Parameters
+    ----------
+    events : dict
+        Event store from ReadEvents
+    thr_range : array
+        Ascending thresholds in fC
+    inclusive : bool
+        Count strips with charge equal to the threshold as hit (Analysis2.0) or not (Analysis)
+    """
+    thr_e = np.asarray(thr_range) * E_PER_FC
+    n_thr = len(thr_e)
+    # Number of thresholds passed by every strip
+    n_passed = np.searchsorted(thr_e, events["charges"], side="right" if inclusive else "left")
+    counts = np.bincount(EventIds(events) * (n_thr+1) + n_passed, minlength=events["n_events"]*(n_thr+1))
+    counts = counts.reshape(events["n_events"], n_thr+1)
+    # A strip passing k thresholds contributes to the clusters at the first k of them
+    return np.cumsum(counts[:, :0:-1], axis=1)[:, ::-1]
+
+
+def AddResults(result, other):
+    """Sum of the threshold scan counts of two independent event samples, result may be None."""
+    if result is None:
+        return dict(other)
+    if not np.array_equal(result["thr_range"], other["thr_range"]):
+        raise ValueError("Threshold scans with different thresholds cannot be added.")
+    summed = dict(result)
+    for key in ["n_events", "passed", "clus_sum", "clus_sum2"]:
+        summed[key] = result[key] + other[key]
+    return summed
+
+
+def SummariseClusters(clusters, thr_range):
+    """Reduces cluster sizes to the per-threshold counts needed for efficiency and average cluster size.
+
+    The counts of independent event samples can be added together.
+    """
+    return {
+        "thr_range": np.asarray(thr_range),
+        "n_events": clusters.shape[0],
+        "passed": np.count_nonzero(clusters, axis=0),
+        "clus_sum": clusters.sum(axis=0).astype(np.float64),
+        "clus_sum2": (clusters.astype(np.float64)**2).sum(axis=0),
+    }
+
+
+def ScanThresholds(events, thr_range, inclusive=True):
+    """Performs the threshold scan of all events at once."""
+    return SummariseClusters(ClusterSizes(events, thr_range, inclusive), thr_range)
+
+
+def ClusterMeans(result):
+    """Average cluster size of events with a cluster and its error for every threshold.
+
+    The error is the standard deviation divided by sqrt(N-1), as in Analysis2.0.RunAnalysis.
+    """
+    n = result["passed"].astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        clus_mean = result["clus_sum"] / n
+        clus_std = np.sqrt(np.maximum(result["clus_sum2"] / n - clus_mean**2, 0))
+        clus_err = clus_std / np.sqrt(n - 1)
+    return (clus_mean, clus_err)
+
+
+def Efficiency(result):
+    """Fraction of events with a cluster for every threshold."""
+    return result["passed"] / max(result["n_events"], 1)
+
+
+def InStripPosition(events):
+    """Track position relative to the centre of the nearest strip in units of pitch, in [-0.5, 0.5).
+
+    Strip centres are at multiples of the pitch in the local coordinates of the sensor.
+    """
+    return np.mod(events["track_y"] / events["pitch"] + 0.5, 1.0) - 0.5
+
+
+def ScanInStrip(events, thr_range, n_pos_bins=20, inclusive=True):
+    """Threshold scan binned in the in-strip track position, filled in one pass over all events.
+
+    Returns a dict with (n_pos_bins, n_thr) arrays "passed", "clus_sum", "clus_sum2" and the
+    number of events "total" of every position bin. Events without MC truth are skipped.
+    """
+    clusters = ClusterSizes(events, thr_range, inclusive)
+    position = InStripPosition(events)
+    valid = ~np.isnan(position)
+    pos_bins = np.minimum(((position[valid] + 0.5) * n_pos_bins).astype(np.int64), n_pos_bins-1)
+    clusters = clusters[valid]
+
+    n_thr = len(thr_range)
+    cells = (pos_bins[:, np.newaxis] * n_thr + np.arange(n_thr)).ravel()
+    size = n_pos_bins * n_thr
+    clus_flat = clusters.ravel().astype(np.float64)
+    return {
+        "thr_range": np.asarray(thr_range),
+        "pos_edges": np.linspace(-0.5, 0.5, n_pos_bins+1),
+        "total": np.bincount(pos_bins, minlength=n_pos_bins),
+        "passed": np.bincount(cells, weights=(clus_flat > 0), minlength=size).reshape(n_pos_bins, n_thr),
+        "clus_sum": np.bincount(cells, weights=clus_flat, minlength=size).reshape(n_pos_bins, n_thr),
+        "clus_sum2": np.bincount(cells, weights=clus_flat**2, minlength=size).reshape(n_pos_bins, n_thr),
+    }
+
+
+def InStripRegion(in_strip, pos_low, pos_high):
+    """Threshold scan counts of events with |in-strip position| in [pos_low, pos_high), in units of pitch."""
+    centres = 0.5 * (in_strip["pos_edges"][:-1] + in_strip["pos_edges"][1:])
+    region = (np.abs(centres) >= pos_low) & (np.abs(centres) < pos_high)
+    return {
+        "thr_range": in_strip["thr_range"],
+        "n_events": int(in_strip["total"][region].sum()),
+        "passed": in_strip["passed"][region].sum(axis=0).astype(np.int64),
+        "clus_sum": in_strip["clus_sum"][region].sum(axis=0),
+        "clus_sum2": in_strip["clus_sum2"][region].sum(axis=0),
+    }
+
+
+def BuildInStripMap(in_strip, name="efficiency_vs_threshold_in_strip"):
+    """Creates a 2D TEfficiency of efficiency vs in-strip position and threshold."""
+    thr_range = in_strip["thr_range"]
+    title = name + ";In-strip position [pitch];Threshold [fC];Efficiency"
+    return CountsToEfficiency2D(in_strip["pos_edges"], thr_range, in_strip["passed"], in_strip["total"], len(thr_range),
+                                thr_range[0], thr_range[-1], name, title)
+
+
+def BuildEfficiency(result, name="Efficiency"):
+    """Creates a TEfficiency object from the threshold scan counts."""
+    thr_range = result["thr_range"]
+    return CountsToEfficiency(thr_range, result["passed"], result["n_events"], len(thr_range), thr_range[0], thr_range[-1],
+                              name, name + ";Threshold [fC];Efficiency")
+
+
+def BuildClusterGraph(result, name="Average_cluster_size"):
+    """Creates a TGraphErrors of the average cluster size, skipping thresholds with less than 2 clusters."""
+    (clus_mean, clus_err) = ClusterMeans(result)
+    valid = result["passed"] > 1
+    n_points = int(np.count_nonzero(valid))
+    x = np.ascontiguousarray(result["thr_range"][valid], dtype=np.float64)
+    y = np.ascontiguousarray(clus_mean[valid], dtype=np.float64)
+    ey = np.ascontiguousarray(clus_err[valid], dtype=np.float64)
+    clus_graph = TGraphErrors(n_points, x, y, np.zeros(n_points), ey)
+    clus_graph.SetNameTitle(name, name)
+    clus_graph.GetXaxis().SetTitle("Threshold [fC]")
+    clus_graph.GetYaxis().SetTitle("Average cluster size")
+    return clus_graph
+
+
+def FitFunction(name="Efficiency_fit"):
+    """Efficiency fit function with the parameter limits of all fits."""
+    fit_func = TF1(name, FIT_FORM, 0, 8)
+    fit_func.SetParLimits(1, 0, 5)
+    fit_func.SetParLimits(2, 0, 2)
+    fit_func.SetParLimits(3, 0, 2)
+    return fit_func
+
+
+def FitEfficiency(eff, name="Efficiency_fit", option="QR", start=(1, 4, 1, 1)):
+    """Fits an efficiency object with the skewed complementary error function, returns the TF1.
+
+    start gives the initial parameters, e.g. the fit of a similar sample.
+    """
+    fit_func = FitFunction(name)
+    fit_func.SetParameters(*start)
+    eff.Fit(fit_func, option)
+    return fit_func
+
+
+def StoreFit(result, fit_func):
+    """Copies fit parameters and their errors into the result."""
+    result["fit"] = [(fit_func.GetParameter(i), fit_func.GetParError(i)) for i in range(fit_func.GetNpar())]
+    result["chi2"] = fit_func.GetChisquare()
+    result["ndf"] = fit_func.GetNDF()
+    result["n_fit_points"] = fit_func.GetNumberFitPoints()
+    result["vt50"] = result["fit"][1][0]
+    result["vt50_err"] = result["fit"][1][1]
+    return result
+
+
+def FitBand(eff, fit_func, x, cl=0.683):
+    """Half-width of the confidence band of an efficiency fit at the points x.
+
+    The fit is repeated from its converged parameters to obtain their covariance.
+    """
+    fit_result = eff.Fit(fit_func, "QRSN")
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    band = np.zeros(len(x))
+    fit_result.GetConfidenceIntervals(len(x), 1, 1, x, band, cl, False)
+    return band
+
+
+def ResultObjects(result, name="Efficiency", clus_name="Average_cluster_size"):
+    """Efficiency with the stored fit attached and average cluster size graph of a result, in memory.
+
+    The fit function has the parameters, errors, chi2 and degrees of freedom of the fit, as the one
+    attached by FitEfficiency.
+    """
+    eff = BuildEfficiency(result, name)
+    if "fit" in result:
+        fit_func = FitFunction(name + "_fit")
+        for i in range(len(result["fit"])):
+            fit_func.SetParameter(i, result["fit"][i][0])
+            fit_func.SetParError(i, result["fit"][i][1])
+        fit_func.SetChisquare(result.get("chi2", 0.0))
+        fit_func.SetNDF(result.get("ndf", 0))
+        fit_func.SetNumberFitPoints(result.get("n_fit_points", 0))
+        eff.GetListOfFunctions().Add(fit_func)
+    return (eff, BuildClusterGraph(result, clus_name))
+
+
+def WriteResult(result, output_name, eff=None, clus_graph=None, extra_objects=[]):
+    """Writes efficiency, cluster size and the Info directory in the format of Analysis2.0.RunAnalysis."""
+    write_file = TFile("data/" + output_name, "recreate")
+    write_file.cd()
+    for extra_object in extra_objects:
+        extra_object.Write()
+    if eff is None or clus_graph is None:
+        (result_eff, result_graph) = ResultObjects(result)
+        eff = result_eff if eff is None else eff
+        clus_graph = result_graph if clus_graph is None else clus_graph
+    eff.Write()
+    clus_graph.Write()
+
+    thr_range = result["thr_range"]
+    thr_step = round(thr_range[1] - thr_range[0], 6) if len(thr_range) > 1 else 0
+    info = {
+        "source": result.get("source", "allpix"),
+        "angle": result.get("angle", ""),
+        "descr": result.get("descr", ""),
+        "n_events": str(result["n_events"]),
+        "vt50": str(result.get("vt50", "")),
+        "vt50_err": str(result.get("vt50_err", "")),
+        "thr_range": str(round(thr_range[0], 6)) + ":" + str(round(thr_range[-1], 6)) + ":" + str(thr_step),
+    }
+    info["title"] = info["source"] + "," + info["angle"] + "," + info["descr"] + "(" + info["n_events"] + "ev)"
+    for key in ["CT_StS", "CT_StBP"] + list(result.get("settings", {})):
+        if key in result:
+            info[key] = str(result[key])
+
+    info_dir = write_file.mkdir("Info")
+    info_dir.cd()
+    for key in info:
+        info_dir.WriteObject(TString(info[key]), key)
+    write_file.Close()
+
+
+# Background process writing results, see WriteResultAsync
+_writer = []
+
+
+def _WriteResult(result, output_name):
+    extra_objects = InStripObjects(result["in_strip"]) if "in_strip" in result else []
+    WriteResult(result, output_name, extra_objects=extra_objects)
+    return output_name
+
+
+def WriteResultAsync(result, output_name):
+    """Writes a result like WriteResult in a background process and returns a Future of the output name.
+
+    The ROOT objects are rebuilt from the counts and fit of the result, so the caller can keep drawing
+    its own objects meanwhile. Pending writes finish before the interpreter exits.
+    """
+    if not _writer:
+        _writer.append(ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")))
+    return _writer[0].submit(_WriteResult, {key: result[key] for key in result if key != "write"}, output_name)
+
+
+def InStripObjects(in_strip, ctr_width=0.1, edge_width=0.1):
+    """Strip-centre and strip-edge curves named like the test beam references, plus the 2D map.
+
+    The centre region is |position| < ctr_width and the edge region |position| >= 0.5 - edge_width,
+    both in units of pitch.
+    """
+    objects = [BuildInStripMap(in_strip)]
+    regions = {"ctr": (0, ctr_width), "edge": (0.5 - edge_width, 0.5)}
+    for region in regions:
+        region_result = InStripRegion(in_strip, regions[region][0], regions[region][1])
+        eff = BuildEfficiency(region_result, "efficiency_vs_threshold_strip_" + region)
+        FitEfficiency(eff, "erfcFit_" + region)
+        objects.append(eff)
+        objects.append(BuildClusterGraph(region_result, "cluster_size_vs_threshold_strip_" + region))
+    return objects
+
+
+def SampleOrder(input_name, n_entries, stratified=True, n_strata=10, seed=0):
+    """Order in which PreviewAnalysis reads the tree entries, so that every prefix is a random subsample.
+
+    A stratified order takes the same share of every stratum into each prefix. The strata are
+    quantiles of the maximum strip charge if the input has an up to date event index, otherwise
+    consecutive blocks of entries, which evens out changes along the file.
+    """
+    rng = np.random.default_rng(seed)
+    index = EventIndex.LoadIndex(input_name)
+    if index is not None:
+        (entries, values) = (index["entry"], index["max_charge"])
+    else:
+        entries = np.arange(n_entries)
+        values = entries
+    order = rng.permutation(len(entries))
+    if stratified and len(entries) > 0:
+        edges = np.quantile(values, np.linspace(0, 1, n_strata+1)[1:-1])
+        stratum = np.searchsorted(edges, values, side="right")[order]
+        order = order[np.argsort(stratum, kind="stable")]
+        counts = np.bincount(stratum, minlength=n_strata)
+        starts = np.cumsum(counts) - counts
+        # Position of every entry within its stratum as a fraction of the stratum size
+        position = np.arange(len(order)) - np.repeat(starts, counts)
+        fraction = (position + rng.random(len(order))) / np.repeat(counts, counts)
+        order = order[np.argsort(fraction, kind="stable")]
+    return entries[order]
+
+
+def PreviewAnalysis(input_name, source="allpix", CT_StS=0.0, CT_StBP=0.0, thr_range=None, fractions=PREVIEW_FRACTIONS,
+                    stratified=True, seed=0, min_events=500):
+    """Analyses growing subsamples of an input, yielding a refined result after every step.
+
+    Every step decodes only the entries not read before and adds their threshold scan to the
+    previous ones, so stopping the iteration early saves the rest of the decoding.
+
+    Parameters
+    ----------
+    input_name : str
+        Name of the simulation output file in data/raw
+    source : str
+        Simulation source, "allpix" or "athena"
+    CT_StS, CT_StBP : float
+        Strip-to-strip and strip-to-backplane crosstalk fractions
+    thr_range : array
+        Thresholds in fC, ThresholdRange() by default
+    fractions : list
+        Increasing fractions of the entries analysed after each step, the last one normally 1
+    stratified : bool
+        Draw the subsamples stratified (see SampleOrder) rather than purely random
+    seed : int
+        Seed of the subsample order
+    min_events : int
+        Minimum number of entries of the first step
+
+    Yields
+    ------
+    dict
+        Threshold scan counts and fit of the entries read so far, with "fraction" of the entries
+        read and "band", the half-width of the 68% confidence band of the fit at every threshold
+    """
+    if thr_range is None:
+        thr_range = ThresholdRange()
+    (root_file, hit_tree, n_strips) = OpenHitTree(input_name, source)
+    n_entries = hit_tree.GetEntries()
+    root_file.Close()
+    order = SampleOrder(input_name, n_entries, stratified, seed=seed)
+
+    result = None
+    n_read = 0
+    for fraction in fractions:
+        n_next = min(max(int(round(fraction * len(order))), min_events, n_read+1), len(order))
+        if n_next <= n_read:
+            continue
+        events = ReadEvents(input_name, source, index=False, entries=np.sort(order[n_read:n_next]))
+        events = ApplyCrosstalk(events, CT_StS, CT_StBP)
+        result = AddResults(result, ScanThresholds(events, thr_range))
+        n_read = n_next
+
+        eff = BuildEfficiency(result)
+        fit_func = FitEfficiency(eff, option="QR")
+        StoreFit(result, fit_func)
+        result["band"] = FitBand(eff, fit_func, thr_range)
+        result["fraction"] = n_read / max(len(order), 1)
+        print("PREVIEW:", n_read, "of", len(order), "entries (" + str(round(100 * result["fraction"], 1)) + "%),  vt50 =",
+              round(result["vt50"], 3), "+-", round(result["vt50_err"], 3), "fC")
+        yield result
+        if n_read == len(order):
+            return
+
+
+def RunAnalysis(input_name, output_name="", source="allpix", CT_StS=0.0, CT_StBP=0.0, thr_range=None, events=None,
+                in_strip=False, backend="numpy", n_threads=0, async_write=False, preview=False, settings=None):
+    """Vectorized equivalent of Analysis2.0.RunAnalysis with optional crosstalk.
+
+    Parameters
+    ----------
+    input_name : str
+        Name of the simulation output file in data/raw
+    output_name : str
+        Name of the analysed file written to data, no file is written if None
+    source : str
+        Simulation source, "allpix" or "athena"
+    CT_StS, CT_StBP : float
+        Strip-to-strip and strip-to-backplane crosstalk fractions
+    thr_range : array
+        Thresholds in fC, ThresholdRange() by default
+    events : dict
+        Already decoded event store, read from input_name if not passed
+    in_strip : bool
+        Also write efficiency and cluster size for the strip centre and edge from MC truth
+    backend : str
+        "numpy" to scan decoded events in memory, "rdataframe" to scan the tree with a multithreaded
+        RDataFrame event loop (no events or in_strip)
+    n_threads : int
+        Threads of the "rdataframe" backend, 0 for all cores
+    async_write : bool
+        Write the output in the background, result["write"] is then a Future of the output name
+    preview : bool
+        Go through the growing subsamples of PreviewAnalysis up to the full sample (numpy backend, no
+        events or in_strip). Interrupting it with Ctrl-C returns the last preview without writing
+    settings : dict
+        Settings already applied to the passed events, e.g. {"CT_StS": 0.0153, "CT_StBP": 0.0096, "noise": 864};
+        they are stored in the result and the Info directory and noise or overlay extend the description
+
+    Returns
+    -------
+    dict
+        Threshold scan counts together with the fit results
+    """
+    if output_name == "":
+        output_name = AnalysedName(input_name, CT_StS, CT_StBP, settings)
+    if thr_range is None:
+        thr_range = ThresholdRange()
+    if backend == "rdataframe":
+        if events is not None or in_strip or preview:
+            raise ValueError("The rdataframe backend reads the tree itself and has no in-strip analysis or preview.")
+        print("INPUT:", input_name, "\nOUTPUT:", output_name)
+        result = DataFrame.ScanThresholds(input_name, thr_range, source, CT_StS, CT_StBP, n_threads=n_threads)
+        print("CONFIG: Source:", source, ",  Events:", result["n_events"], ",  CT_StS:", CT_StS, ",  CT_StBP:", CT_StBP)
+    elif backend == "numpy" and preview:
+        if events is not None or in_strip:
+            raise ValueError("The preview reads subsamples itself and has no in-strip analysis.")
+        print("INPUT:", input_name, "\nOUTPUT:", output_name)
+        result = None
+        try:
+            for result in PreviewAnalysis(input_name, source, CT_StS, CT_StBP, thr_range):
+                pass
+        except KeyboardInterrupt:
+            print("\nPreview stopped.")
+        if result is None:
+            return None
+    elif backend == "numpy":
+        if events is None:
+            events = ReadEvents(input_name, source, truth=in_strip)
+        print("INPUT:", input_name, "\nOUTPUT:", output_name)
+        config = dict({"CT_StS": CT_StS, "CT_StBP": CT_StBP}, **(settings or {}))
+        print("CONFIG: Source:", source, ",  Events:", events["n_events"], "".join(",  " + key + ": " + str(config[key]) for key in config))
+        events = ApplyCrosstalk(events, CT_StS, CT_StBP)
+        result = ScanThresholds(events, thr_range)
+    else:
+        raise ValueError("Unknown backend: " + str(backend))
+    result["source"] = source
+    result["angle"] = input_name.split("-")[0]
+    result["descr"] = "-".join(input_name.split("_")[0].split("-")[1:])
+    result["CT_StS"] = CT_StS
+    result["CT_StBP"] = CT_StBP
+    if settings:
+        result["descr"] += SettingsTag(settings)
+        result["settings"] = dict(settings)
+        result.update(settings)
+    if preview and result["fraction"] < 1:
+        return result
+
+    eff = BuildEfficiency(result)
+    StoreFit(result, FitEfficiency(eff))
+    if in_strip:
+        result["in_strip"] = ScanInStrip(events, thr_range)
+    if output_name is not None and async_write:
+        result["write"] = WriteResultAsync(result, output_name)
+    elif output_name is not None:
+        extra_objects = InStripObjects(result["in_strip"]) if in_strip else []
+        WriteResult(result, output_name, eff, extra_objects=extra_objects)
+    print("vt50 =", round(result["vt50"], 3), "+-", round(result["vt50_err"], 3), "fC")
+
+    return result
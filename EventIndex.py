@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+import numpy as np
+import tempfile
+import zipfile
+import os
+import sys
+
+# Conversion from fC to electrons
+E_PER_FC = 6242.2
+
+
+def RawPath(input_name):
+    """Path of a simulation output, names are relative to data/raw unless absolute."""
+    return input_name if os.path.isabs(input_name) else "data/raw/" + input_name
+
+
+def IndexPath(input_name):
+    """Path of the summary index stored next to a simulation output."""
+    return RawPath(input_name).split(".root")[0] + "_index.npz"
+
+
+def BuildIndex(events):
+    """Per-event summary of an event store: hit multiplicity, maximum strip charge, total charge
+    and the strip with the maximum charge (-1 for events without hits)."""
+    offsets = events["offsets"]
+    n_hits = np.diff(offsets)
+    event_ids = np.repeat(np.arange(events["n_events"]), n_hits)
+    charges = events["charges"]
+
+    # Hits sorted by event and then by charge, the leading hit of an event is its last one
+    order = np.lexsort((charges, event_ids))
+    has_hits = n_hits > 0
+    lead_hits = order[offsets[1:][has_hits] - 1]
+    max_charge = np.zeros(events["n_events"])
+    max_charge[has_hits] = charges[lead_hits]
+    lead_strip = np.full(events["n_events"], -1, dtype=np.int32)
+    lead_strip[has_hits] = events["strips"][lead_hits]
+
+    return {
+        "n_hits": n_hits.astype(np.int32),
+        "max_charge": max_charge,
+        "total_charge": np.bincount(event_ids, weights=charges, minlength=events["n_events"]),
+        "lead_strip": lead_strip,
+        "entry": events.get("entry", np.arange(events["n_events"])),
+        "n_entries": events.get("n_entries", events["n_events"]),
+    }
+
+
+def IsCurrent(input_name, stat=None):
+    """Whether the stored index of an input was built from its current content, judged by its size and modification time."""
+    path = IndexPath(input_name)
+    if not os.path.exists(path):
+        return False
+    if stat is None:
+        stat = os.stat(RawPath(input_name))
+    try:
+        with np.load(path) as index_file:
+            return int(index_file["source_mtime"]) == stat.st_mtime_ns and int(index_file["source_size"]) == stat.st_size
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return False
+
+
+def WriteIndex(input_name, index):
+    """Stores the index next to its input together with the size and modification time of the input.
+
+    Nothing is written if the stored index is already up to date. The index is written to a temporary
+    file in the same directory and moved in place, so readers never see a partially written index.
+    """
+    stat = os.stat(RawPath(input_name))
+    if IsCurrent(input_name, stat):
+        return
+    path = IndexPath(input_name)
+    (handle, temp_path) = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".index-", suffix=".npz")
+    try:
+        with os.fdopen(handle, "wb") as index_file:
+            np.savez(index_file, source_mtime=stat.st_mtime_ns, source_size=stat.st_size, **index)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def LoadIndex(input_name):
+    """Loads the index of an input, None if there is none or the input changed since it was built."""
+    if not IsCurrent(input_name):
+        return None
+    with np.load(IndexPath(input_name)) as index_file:
+        index = {key: index_file[key] for key in index_file.files}
+    index["n_entries"] = int(index["n_entries"])
+    return index
+
+
+def Select(index, min_hits=1, min_total_charge=0.0, min_max_charge=0.0, strips=None):
+    """Positions in the event store of events passing the selection, charges in fC.
+
+    The result can be passed to Engine.SelectEvents.
+    """
+    selected = index["n_hits"] >= min_hits
+    selected &= index["total_charge"] >= min_total_charge * E_PER_FC
+    selected &= index["max_charge"] >= min_max_charge * E_PER_FC
+    if strips is not None:
+        selected &= np.isin(index["lead_strip"], strips)
+    return np.nonzero(selected)[0]
+
+
+def CountEvents(index, min_hits=1, min_total_charge=0.0, min_max_charge=0.0):
+    """Number of events passing the selection of Select."""
+    return len(Select(index, min_hits, min_total_charge, min_max_charge))
+
+
+def IndexEfficiency(index, thr_range, n_events=None):
+    """Efficiency without crosstalk at any thresholds in fC: an event has a cluster if its
+    maximum strip charge is at least the threshold."""
+    if n_events is None:
+        n_events = len(index["max_charge"])
+    max_charge = np.sort(index["max_charge"][index["n_hits"] > 0])
+    thr_e = np.asarray(thr_range) * E_PER_FC
+    passed = len(max_charge) - np.searchsorted(max_charge, thr_e, side="left")
+    return passed / max(n_events, 1)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) != 1:
+        print("Invalid arguments.\nUsage: python3 EventIndex.py INPUT_FILE")
+    else:
+        index = LoadIndex(args[0])
+        if index is None:
+            print("No up to date index for", args[0] + ", decode it once with Engine.ReadEvents.")
+        else:
+            print("Entries:", index["n_entries"], ",  Events with hits:", CountEvents(index),
+                  ",  Mean multiplicity:", round(float(np.mean(index["n_hits"])), 3),
+                  ",  Median total charge:", round(float(np.median(index["total_charge"])) / E_PER_FC, 3), "fC")
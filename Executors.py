@@ -0,0 +1,423 @@
+#!/usr/bin/python3
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import Telemetry
+import multiprocessing
+import subprocess
+import tempfile
+import shlex
+import shutil
+import re
+import time
+import os
+import sys
+
+# Command submitting a DAG to HTCondor, replaced by FAKE_SUBMIT to run DAGs locally
+CONDOR_SUBMIT = ["condor_submit_dag", "-batch-name", "allpix-sweep"]
+FAKE_SUBMIT = [sys.executable, os.path.abspath(__file__), "fake-submit-dag"]
+
+# Line DAGMan writes to <dag>.dagman.out when the whole DAG is finished
+DAG_EXIT = "EXITING WITH STATUS"
+
+# Query of the DAGMan job and its node jobs, with "CLUSTER" replaced by the DAGMan cluster id
+CONDOR_Q = ["condor_q", "-constraint", "ClusterId == CLUSTER || DAGManJobId == CLUSTER", "-af:t", "ClusterId", "JobStatus", "HoldReason"]
+
+# HTCondor JobStatus values of jobs which do not finish without intervention
+STUCK_STATUS = {"3": "removed", "5": "held"}
+
+# Seconds CondorExecutor waits for a DAG at most, the run time limit of the longest CERN batch flavour
+DAG_TIMEOUT = 7 * 24 * 3600
+
+
+def MakeJob(name, command, workdir, inputs=[], outputs={}, cpus=1, memory=2000, disk=2000, after=[], retries=0, flavour=""):
+    """Describes one sweep job for any executor.
+
+    Parameters
+    ----------
+    name : str
+        Unique job name, also used for its log files
+    command : str or list
+        Shell command or argument list, run in the job working directory
+    workdir : str
+        Directory holding the job inputs, outputs are produced relative to it
+    inputs : list
+        Files of workdir the job reads, transferred to batch nodes
+    outputs : dict
+        {path produced relative to workdir: destination path}, moved to the destination once the job succeeded
+    cpus, memory, disk : int
+        Requested cores, memory and disk in MB
+    after : list
+        Names of jobs that have to succeed first
+    retries : int
+        Reruns of a failed job
+    flavour : str
+        Optional CERN batch job flavour (maximum run time), e.g. "workday"
+    """
+    return {"name": name, "command": command, "workdir": os.path.abspath(workdir), "inputs": list(inputs), "outputs": dict(outputs),
+            "cpus": cpus, "memory": memory, "disk": disk, "after": list(after), "retries": retries, "flavour": flavour}
+
+
+def CheckJobs(jobs):
+    """Raises ValueError for duplicate job names, dependencies on unknown jobs or dependency cycles."""
+    names = [job["name"] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate job names.")
+    for job in jobs:
+        unknown = [name for name in job["after"] if name not in names]
+        if unknown:
+            raise ValueError(job["name"] + " depends on unknown jobs: " + ", ".join(unknown))
+
+    # Jobs are ordered after their dependencies until none is left, or only jobs of cycles
+    ordered = set()
+    while len(ordered) < len(jobs):
+        ready = [job["name"] for job in jobs if job["name"] not in ordered and all(name in ordered for name in job["after"])]
+        if not ready:
+            raise ValueError("Dependency cycle between jobs: " + ", ".join(name for name in names if name not in ordered))
+        ordered.update(ready)
+
+
+def CollectOutputs(job):
+    """Moves the outputs of a finished job to their destinations, False if any is missing."""
+    collected = True
+    for path, destination in job["outputs"].items():
+        source = os.path.join(job["workdir"], path)
+        if not os.path.exists(source):
+            print("Missing output of", job["name"] + ":", source)
+            collected = False
+            continue
+        if os.path.dirname(destination):
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.move(source, destination)
+    return collected
+
+
+def RunJob(job):
+    """Runs one job in its working directory with retries and collects its outputs, executed in a worker process."""
+    shell = isinstance(job["command"], str)
+    for attempt in range(job["retries"] + 1):
+        with open(os.path.join(job["workdir"], job["name"] + ".out"), "w") as out, open(os.path.join(job["workdir"], job["name"] + ".err"), "w") as err:
+            return_code = subprocess.run(job["command"], shell=shell, cwd=job["workdir"], stdout=out, stderr=err).returncode
+        if return_code == 0:
+            return CollectOutputs(job)
+    return False
+
+
+def LocalExecutor(jobs, n_workers=None):
+    """Runs jobs in a local process pool, each as soon as the jobs it depends on succeeded.
+
+    Returns
+    -------
+    dict
+        Status of every job: "done", "failed" or "skipped" (failed dependency)
+    """
+    CheckJobs(jobs)
+    status = dict()
+    running = dict()
+    progress = Telemetry.Progress("Jobs", len(jobs), unit="jobs")
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+        while len(status) < len(jobs):
+            for job in jobs:
+                if job["name"] in status or job["name"] in running.values():
+                    continue
+                dep_status = [status.get(name) for name in job["after"]]
+                if None in dep_status:
+                    continue
+                if "failed" in dep_status or "skipped" in dep_status:
+                    status[job["name"]] = "skipped"
+                else:
+                    print("RUNNING:", job["name"])
+                    running[executor.submit(RunJob, job)] = job["name"]
+            if not running:
+                continue
+            (finished, _) = wait(list(running), timeout=progress["interval"], return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    status[name] = "done" if future.result() else "failed"
+                except Exception as error:
+                    print("Job", name, "raised:", error)
+                    status[name] = "failed"
+                print(status[name].upper() + ":", name)
+            Telemetry.Update(progress, len(status), "running: " + ", ".join(running.values()))
+    Telemetry.Finish(progress, len(status), str(list(status.values()).count("failed")) + " failed")
+    return status
+
+
+def WriteSubmit(job, submit_dir):
+    """Writes the wrapper script and HTCondor submit file of a job, returns the submit file path."""
+    command = job["command"] if isinstance(job["command"], str) else shlex.join(job["command"])
+    script_path = os.path.join(submit_dir, job["name"] + ".sh")
+    with open(script_path, "w") as script:
+        script.write("#!/bin/sh\n" + command + "\n")
+    os.chmod(script_path, 0o755)
+
+    # Outputs are transferred back into initialdir, as top-level entries of their relative paths
+    transfer_outputs = sorted(set(path.split("/")[0] for path in job["outputs"]))
+    lines = [
+        "universe = vanilla",
+        "executable = " + script_path,
+        "initialdir = " + job["workdir"],
+        "log = " + os.path.join(submit_dir, job["name"] + ".log"),
+        "output = " + job["name"] + ".out",
+        "error = " + job["name"] + ".err",
+        "request_cpus = " + str(job["cpus"]),
+        "request_memory = " + str(job["memory"]),
+        "request_disk = " + str(job["disk"] * 1024),
+        "should_transfer_files = YES",
+        "when_to_transfer_output = ON_EXIT",
+        "transfer_input_files = " + ",".join(job["inputs"]),
+        "transfer_output_files = " + ",".join(transfer_outputs),
+    ]
+    if job["flavour"]:
+        lines.append("+JobFlavour = \"" + job["flavour"] + "\"")
+    submit_path = os.path.join(submit_dir, job["name"] + ".sub")
+    with open(submit_path, "w") as submit_file:
+        submit_file.write("\n".join(lines) + "\nqueue\n")
+    return submit_path
+
+
+def WriteDag(jobs, submit_dir, dag_name="sweep.dag"):
+    """Writes submit files of all jobs and the DAG tying them together, returns the DAG path."""
+    CheckJobs(jobs)
+    # Submit files refer to each other and are run from other directories
+    submit_dir = os.path.abspath(submit_dir)
+    os.makedirs(submit_dir, exist_ok=True)
+    lines = []
+    for job in jobs:
+        lines.append("JOB " + job["name"] + " " + WriteSubmit(job, submit_dir))
+        if job["retries"]:
+            lines.append("RETRY " + job["name"] + " " + str(job["retries"]))
+    for job in jobs:
+        if job["after"]:
+            lines.append("PARENT " + " ".join(job["after"]) + " CHILD " + job["name"])
+    dag_path = os.path.join(submit_dir, dag_name)
+    with open(dag_path, "w") as dag_file:
+        dag_file.write("\n".join(lines) + "\n")
+    return dag_path
+
+
+def JobState(log_path):
+    """State of a job from its HTCondor log: "idle", "running" or "terminated", None before submission."""
+    if not os.path.exists(log_path):
+        return None
+    state = "idle"
+    for line in open(log_path):
+        if line.startswith("001 "):
+            state = "running"
+        elif line.startswith("005 "):
+            state = "terminated"
+        elif line.startswith("000 ") or line.startswith("004 ") or line.startswith("012 "):
+            # Submitted, evicted or held jobs wait for a node again
+            state = "idle"
+    return state
+
+
+def ReturnValue(log_path):
+    """Return value of the last termination event in an HTCondor job log, None if the job did not terminate."""
+    if not os.path.exists(log_path):
+        return None
+    return_value = None
+    for line in open(log_path):
+        if "Normal termination (return value" in line:
+            return_value = int(line.split("return value")[1].strip(" )\n"))
+        elif "Abnormal termination" in line:
+            return_value = -1
+    return return_value
+
+
+def DagFinished(dagman_out):
+    """Whether DAGMan wrote its exit line."""
+    return os.path.exists(dagman_out) and DAG_EXIT in open(dagman_out).read()
+
+
+def StuckJobs(cluster, query_command=CONDOR_Q):
+    """Jobs of a submitted DAG which cannot finish on their own, from condor_q.
+
+    Returns
+    -------
+    dict
+        {cluster id: reason} of held and removed jobs, also the DAGMan job if it left the queue;
+        None if the queue could not be read
+    """
+    try:
+        query = subprocess.run([part.replace("CLUSTER", cluster) for part in query_command], capture_output=True, text=True, timeout=120)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if query.returncode != 0:
+        return None
+    stuck = dict()
+    in_queue = set()
+    for line in query.stdout.splitlines():
+        fields = line.split("\t")
+        if len(fields) < 2:
+            continue
+        in_queue.add(fields[0])
+        if fields[1] in STUCK_STATUS:
+            reason = STUCK_STATUS[fields[1]]
+            if len(fields) > 2 and fields[2] not in ("", "undefined"):
+                reason += " (" + fields[2] + ")"
+            stuck[fields[0]] = reason
+    if cluster not in in_queue:
+        stuck[cluster] = "DAGMan job left the queue"
+    return stuck
+
+
+def CondorExecutor(jobs, submit_dir, submit_command=CONDOR_SUBMIT, poll=60, timeout=DAG_TIMEOUT, query_command=CONDOR_Q):
+    """Submits jobs as an HTCondor DAG, waits for it to finish and collects the outputs.
+
+    Parameters
+    ----------
+    jobs : list
+        Jobs of MakeJob, workdirs have to be visible from the submit node (e.g. on AFS)
+    submit_dir : str
+        Directory for the submit files, DAG and job logs
+    submit_command : list
+        DAG submission command, FAKE_SUBMIT runs the DAG locally for testing
+    poll : float
+        Seconds between checks of the DAGMan log
+    timeout : float
+        Seconds to wait for the DAG at most, None to wait without limit
+    query_command : list
+        condor_q command checking that the DAG can still finish, see StuckJobs. Not used if the
+        submission did not report a cluster id (FAKE_SUBMIT)
+
+    Returns
+    -------
+    dict
+        Status of every job: "done", "failed" or "skipped" (not run)
+
+    Raises
+    ------
+    OSError
+        If the DAGMan job or a node job is held or removed, TimeoutError after timeout. The DAG is
+        left in the queue to be inspected, released or removed with condor_rm.
+    """
+    dag_path = WriteDag(jobs, submit_dir)
+    dagman_out = dag_path + ".dagman.out"
+    if os.path.exists(dagman_out):
+        os.remove(dagman_out)
+    submission = subprocess.run(submit_command + [dag_path], check=True, stdout=subprocess.PIPE, text=True)
+    print(submission.stdout, end="")
+    cluster = re.search(r"submitted to cluster (\d+)", submission.stdout)
+    cluster = cluster.group(1) if cluster else None
+    print("Submitted", len(jobs), "jobs in", dag_path)
+    start = time.time()
+    progress = Telemetry.Progress("Condor jobs", len(jobs), unit="jobs", interval=0)
+    while not DagFinished(dagman_out):
+        stuck = StuckJobs(cluster, query_command) if cluster else None
+        # DAGMan may have finished and left the queue since the last check
+        if stuck and not DagFinished(dagman_out):
+            if stuck.get(cluster) == "DAGMan job left the queue":
+                hint = "See " + dagman_out + "."
+            else:
+                hint = "Remove it with condor_rm " + cluster + " or release the held jobs and wait again."
+            raise OSError("DAG " + dag_path + " cannot finish, jobs " + "; ".join(job_id + ": " + reason for (job_id, reason) in sorted(stuck.items()))
+                          + ". " + hint)
+        if timeout is not None and time.time() - start > timeout:
+            raise TimeoutError("DAG " + dag_path + " did not finish in " + str(timeout) + " s" + (", it is still queued as cluster " + cluster if cluster else ""))
+        states = [JobState(os.path.join(submit_dir, job["name"] + ".log")) for job in jobs]
+        Telemetry.Update(progress, states.count("terminated"), str(states.count("idle")) + " idle, " + str(states.count("running")) + " running")
+        time.sleep(poll)
+
+    status = dict()
+    for job in jobs:
+        return_value = ReturnValue(os.path.join(submit_dir, job["name"] + ".log"))
+        if return_value is None:
+            status[job["name"]] = "skipped"
+        elif return_value == 0 and CollectOutputs(job):
+            status[job["name"]] = "done"
+        else:
+            status[job["name"]] = "failed"
+        print(status[job["name"]].upper() + ":", job["name"])
+    Telemetry.Finish(progress, len(jobs), str(list(status.values()).count("failed")) + " failed")
+    return status
+
+
+EXECUTORS = {"local": LocalExecutor, "condor": CondorExecutor}
+
+
+def RunJobs(jobs, executor="local", **options):
+    """Runs jobs with the executor of the given name and its options, returns the status of every job."""
+    if executor not in EXECUTORS:
+        raise ValueError("Unknown executor: " + str(executor))
+    return EXECUTORS[executor](jobs, **options)
+
+
+def ParseSubmit(submit_path):
+    settings = dict()
+    for line in open(submit_path):
+        if "=" in line:
+            (key, value) = line.split("=", 1)
+            settings[key.strip()] = value.strip()
+    return settings
+
+
+def LogEvent(log_path, code, text):
+    with open(log_path, "a") as log_file:
+        log_file.write(code + " (000.000.000) " + time.strftime("%m/%d %H:%M:%S") + " " + text + "\n...\n")
+
+
+def FakeRun(settings):
+    """Runs one submit file like an HTCondor node: inputs and outputs are copied through a scratch directory."""
+    initialdir = settings["initialdir"]
+    LogEvent(settings["log"], "000", "Job submitted from host: <fake>")
+    with tempfile.TemporaryDirectory() as scratch:
+        for path in filter(None, settings.get("transfer_input_files", "").split(",")):
+            shutil.copy(os.path.join(initialdir, path), scratch)
+        LogEvent(settings["log"], "001", "Job executing on host: <fake>")
+        with open(os.path.join(initialdir, settings["output"]), "w") as out, open(os.path.join(initialdir, settings["error"]), "w") as err:
+            return_value = subprocess.run([settings["executable"]], cwd=scratch, stdout=out, stderr=err,
+                                          env=dict(os.environ, _CONDOR_SCRATCH_DIR=scratch)).returncode
+        for path in filter(None, settings.get("transfer_output_files", "").split(",")):
+            source = os.path.join(scratch, path)
+            if os.path.isdir(source):
+                shutil.copytree(source, os.path.join(initialdir, path), dirs_exist_ok=True)
+            elif os.path.exists(source):
+                shutil.copy(source, initialdir)
+    LogEvent(settings["log"], "005", "Job terminated.\n\t(1) Normal termination (return value " + str(return_value) + ")")
+    return return_value
+
+
+def FakeSubmitDag(dag_path):
+    """Stand-in for condor_submit_dag: runs the jobs of a DAG serially in dependency order with their retries
+    and writes the job logs and the DAGMan exit line. Children of failed jobs are not run."""
+    (submits, retries, parents) = (dict(), dict(), dict())
+    for line in open(dag_path):
+        words = line.split()
+        if not words:
+            continue
+        if words[0] == "JOB":
+            submits[words[1]] = words[2]
+            parents.setdefault(words[1], [])
+        elif words[0] == "RETRY":
+            retries[words[1]] = int(words[2])
+        elif words[0] == "PARENT":
+            i_child = words.index("CHILD")
+            for child in words[i_child+1:]:
+                parents.setdefault(child, []).extend(words[1:i_child])
+
+    status = dict()
+    while len(status) < len(submits):
+        ready = [name for name in submits if name not in status and all(parent in status for parent in parents[name])]
+        if not ready:
+            raise ValueError("Dependency cycle in " + dag_path)
+        for name in ready:
+            if any(status[parent] != 0 for parent in parents[name]):
+                status[name] = None
+                continue
+            for attempt in range(retries.get(name, 0) + 1):
+                status[name] = FakeRun(ParseSubmit(submits[name]))
+                if status[name] == 0:
+                    break
+    failed = any(value != 0 for value in status.values())
+    with open(dag_path + ".dagman.out", "w") as dagman_out:
+        dagman_out.write("**** condor_scheduniv_exec (fake) " + DAG_EXIT + " " + str(int(failed)) + "\n")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) != 2 or args[0] != "fake-submit-dag":
+        print("Invalid arguments.\nUsage: python3 Executors.py fake-submit-dag DAG_FILE")
+    else:
+        FakeSubmitDag(args[1])
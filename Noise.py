@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+
+import Engine
+import numpy as np
+import sys
+
+
+# Streams of the random generators of a scan, see NoiseStreams
+NOISE_STREAM = 0
+OFFSET_STREAM = 1
+OVERLAY_STREAM = 2
+
+
+def NoiseStreams(seed, values, stream=NOISE_STREAM):
+    """Independent random generators for every setting value of a scan, reproducible for a given seed.
+
+    Every generator is seeded from the seed, the stream and the value itself, so a setting gets the same
+    numbers whichever other settings are scanned and in whichever order.
+    """
+    return [np.random.default_rng([seed, stream, int(np.float64(float(value) + 0.0).view(np.uint64))]) for value in values]
+
+
+def StripOffsets(n_strips, thr_dispersion, seed=0):
+    """Per-strip threshold offsets in electrons, drawn once per scan from their own stream and shared by all its settings."""
+    return np.random.default_rng([seed, OFFSET_STREAM]).normal(0, thr_dispersion, n_strips)
+
+
+def ApplyNoise(events, noise=0.0, thr_dispersion=0.0, dead_strips=[], noisy_strips=[], rng=None, strip_offsets=None):
+    """Returns the event store with emulated electronics effects of the digitisation.
+
+    Parameters
+    ----------
+    events : dict
+        Event store of a noise-free simulation, see Engine.ReadEvents
+    noise : float
+        Gaussian electronics noise in electrons, added to every strip with charge
+    thr_dispersion : float
+        Sigma of the per-strip threshold offsets in electrons, fixed for all events
+    dead_strips : list
+        Strips which never give a hit
+    noisy_strips : list
+        Strips which give a hit in every event
+    rng : numpy.random.Generator
+        Random generator, see NoiseStreams
+    strip_offsets : numpy.ndarray
+        Per-strip threshold offsets in electrons, see StripOffsets, drawn with thr_dispersion from rng if not given
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    strips = events["strips"]
+    charges = events["charges"].copy()
+
+    if noise > 0:
+        charges += rng.normal(0, noise, len(charges))
+    if strip_offsets is None and thr_dispersion > 0:
+        strip_offsets = rng.normal(0, thr_dispersion, events["n_strips"])
+    if strip_offsets is not None:
+        # Raising the threshold of a strip is equivalent to lowering its charge
+        charges -= strip_offsets[strips]
+
+    event_ids = Engine.EventIds(events)
+    alive = ~np.isin(strips, dead_strips)
+    event_ids = event_ids[alive]
+    strips = strips[alive]
+    charges = charges[alive]
+    if len(noisy_strips) > 0:
+        # Noisy strips are above any threshold
+        noisy_strips = np.asarray(noisy_strips, dtype=np.int32)
+        event_ids = np.concatenate([event_ids, np.repeat(np.arange(events["n_events"]), len(noisy_strips))])
+        strips = np.concatenate([strips, np.tile(noisy_strips, events["n_events"])])
+        charges = np.concatenate([charges, np.full(events["n_events"] * len(noisy_strips), np.inf)])
+
+    return Engine.MergeHits(events, event_ids, strips, charges)
+
+
+def NoiseScan(events, noises, thr_range=None, CT_StS=0.0, CT_StBP=0.0, thr_dispersion=0.0, dead_strips=[], noisy_strips=[], seed=0):
+    """Threshold scans of one noise-free sample for a list of noise settings in electrons.
+
+    Crosstalk is applied before the noise, as it shares the signal and not the noise of the strips.
+    The threshold offsets of the strips are the same for all noise settings, see StripOffsets.
+
+    Returns
+    -------
+    list
+        Engine.ScanThresholds results, one per noise setting
+    """
+    if thr_range is None:
+        thr_range = Engine.ThresholdRange()
+    events = Engine.ApplyCrosstalk(events, CT_StS, CT_StBP)
+    strip_offsets = StripOffsets(events["n_strips"], thr_dispersion, seed) if thr_dispersion > 0 else None
+    results = []
+    for (noise, rng) in zip(noises, NoiseStreams(seed, noises)):
+        noisy_events = ApplyNoise(events, noise, thr_dispersion, dead_strips, noisy_strips, rng, strip_offsets)
+        results.append(Engine.ScanThresholds(noisy_events, thr_range))
+    return results
+
+
+def RunNoiseScan(input_name, noises, source="allpix", CT_StS=0.0, CT_StBP=0.0, thr_dispersion=0.0, dead_strips=[], noisy_strips=[], seed=0):
+    """Analyses one noise-free simulation output for every noise setting and writes an analysed file for each.
+
+    The outputs are named like the input with the noise added, e.g. "0deg-280um-0e-noise864e_analysed.root"
+    (see Engine.SettingsTag), crosstalk, noise, dispersion and strip settings are stored in their Info directory.
+    """
+    events = Engine.ApplyCrosstalk(Engine.ReadEvents(input_name, source), CT_StS, CT_StBP)
+    strip_offsets = StripOffsets(events["n_strips"], thr_dispersion, seed) if thr_dispersion > 0 else None
+    results = []
+    for (noise, rng) in zip(noises, NoiseStreams(seed, noises)):
+        noisy_events = ApplyNoise(events, noise, thr_dispersion, dead_strips, noisy_strips, rng, strip_offsets)
+        settings = {"CT_StS": CT_StS, "CT_StBP": CT_StBP, "noise": noise}
+        if thr_dispersion > 0:
+            settings["thr_dispersion"] = thr_dispersion
+        if len(dead_strips) > 0:
+            settings["dead_strips"] = sorted(set(int(strip) for strip in dead_strips))
+        if len(noisy_strips) > 0:
+            settings["noisy_strips"] = sorted(set(int(strip) for strip in noisy_strips))
+        output_name = input_name.split("_")[0] + Engine.SettingsTag(settings) + "_analysed.root"
+        results.append(Engine.RunAnalysis(input_name, output_name, source, events=noisy_events, settings=settings))
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--source": "allpix", "--side": "0", "--back": "0", "--dispersion": "0", "--seed": "0"}
+    noises = []
+    for i in range(1, len(args)):
+        if args[i-1] in options or args[i] in options:
+            continue
+        noises.append(float(args[i]))
+    for i in range(1, len(args)-1):
+        if args[i] in options:
+            options[args[i]] = args[i+1]
+
+    if len(args) < 2 or len(noises) == 0:
+        print("Invalid arguments.\nUsage: python3 Noise.py INPUT_FILE NOISE [NOISE ...] [--source allpix|athena] [--side CT_StS] [--back CT_StBP] [--dispersion THR_SIGMA] [--seed SEED]")
+    else:
+        results = RunNoiseScan(args[0], noises, options["--source"], float(options["--side"]), float(options["--back"]),
+                               float(options["--dispersion"]), seed=int(options["--seed"]))
+        for (noise, result) in zip(noises, results):
+            print("noise", int(noise), "e:  vt50 =", round(result["vt50"], 3), "+-", round(result["vt50_err"], 3), "fC")
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+from Noise import NoiseStreams, OVERLAY_STREAM
+import Engine
+import numpy as np
+import sys
+
+
+def OverlayEvents(events, n_overlay, n_output=None, poisson=False, rng=None):
+    """Returns an event store of synthetic multi-particle events, each the sum of randomly chosen decoded events.
+
+    Charges of the chosen events are summed strip by strip, so the result feeds Engine.ScanThresholds
+    like a simulation with several particles per event. Per-event arrays such as "track_y" are dropped.
+
+    Parameters
+    ----------
+    events : dict
+        Event store with one particle per event, see Engine.ReadEvents
+    n_overlay : float
+        Particles per synthetic event, or their mean with poisson
+    n_output : int
+        Number of synthetic events, as many as decoded events by default
+    poisson : bool
+        Draw 1 + Poisson(n_overlay - 1) particles per event, the triggering particle plus pile-up
+    rng : numpy.random.Generator
+        Random generator, see Noise.NoiseStreams
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    if n_output is None:
+        n_output = events["n_events"]
+    if poisson:
+        n_particles = 1 + rng.poisson(max(n_overlay - 1, 0), n_output)
+    else:
+        n_particles = np.full(n_output, int(n_overlay), dtype=np.int64)
+    if events["n_events"] == 0 or np.any(n_particles < 1):
+        raise ValueError("Overlays need decoded events and at least one particle per synthetic event.")
+
+    # Source event of every particle and the synthetic event it goes to
+    sources = rng.integers(0, events["n_events"], int(n_particles.sum()))
+    targets = np.repeat(np.arange(n_output, dtype=np.int64), n_particles)
+    chosen = Engine.SelectEvents(events, sources)
+
+    overlay = {key: events[key] for key in events if key not in Engine.EVENT_ARRAYS}
+    overlay["n_events"] = n_output
+    overlay["n_overlay"] = n_overlay
+    return Engine.MergeHits(overlay, np.repeat(targets, np.diff(chosen["offsets"])), chosen["strips"], chosen["charges"])
+
+
+def Occupancy(result, n_strips):
+    """Mean fraction of strips above every threshold of a threshold scan result."""
+    return result["clus_sum"] / max(result["n_events"] * n_strips, 1)
+
+
+def OverlayScan(events, n_overlays, thr_range=None, CT_StS=0.0, CT_StBP=0.0, n_output=None, poisson=False, seed=0):
+    """Threshold scans of one sample overlaid to every number of particles per event in n_overlays.
+
+    Crosstalk is applied before the overlay, so every particle shares its own charge.
+
+    Returns
+    -------
+    list
+        Engine.ScanThresholds results with their "occupancy", one per overlay setting
+    """
+    if thr_range is None:
+        thr_range = Engine.ThresholdRange()
+    events = Engine.ApplyCrosstalk(events, CT_StS, CT_StBP)
+    results = []
+    for (n_overlay, rng) in zip(n_overlays, NoiseStreams(seed, n_overlays, OVERLAY_STREAM)):
+        result = Engine.ScanThresholds(OverlayEvents(events, n_overlay, n_output, poisson, rng), thr_range)
+        result["occupancy"] = Occupancy(result, events["n_strips"])
+        results.append(result)
+    return results
+
+
+def RunOverlayScan(input_name, n_overlays, source="allpix", CT_StS=0.0, CT_StBP=0.0, n_output=None, poisson=False, seed=0):
+    """Analyses one simulation output overlaid to every number of particles per event and writes an analysed file for each.
+
+    The outputs are named like the input with the overlay added, e.g. "0deg-280um-864e-overlay4_analysed.root"
+    or "0deg-280um-864e-overlay2p5poisson_analysed.root" (see Engine.SettingsTag), crosstalk and overlay settings
+    are stored in their Info directory.
+    """
+    events = Engine.ApplyCrosstalk(Engine.ReadEvents(input_name, source), CT_StS, CT_StBP)
+    results = []
+    for (n_overlay, rng) in zip(n_overlays, NoiseStreams(seed, n_overlays, OVERLAY_STREAM)):
+        overlay = OverlayEvents(events, n_overlay, n_output, poisson, rng)
+        settings = {"CT_StS": CT_StS, "CT_StBP": CT_StBP, "overlay": n_overlay, "overlay_poisson": int(poisson)}
+        output_name = input_name.split("_")[0] + Engine.SettingsTag(settings) + "_analysed.root"
+        result = Engine.RunAnalysis(input_name, output_name, source, events=overlay, settings=settings)
+        result["occupancy"] = Occupancy(result, events["n_strips"])
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--source": "allpix", "--side": "0", "--back": "0", "--events": "0", "--seed": "0"}
+    poisson = "--poisson" in args
+    args = [arg for arg in args if arg != "--poisson"]
+    n_overlays = []
+    for i in range(1, len(args)):
+        if args[i-1] in options or args[i] in options:
+            continue
+        n_overlays.append(float(args[i]) if poisson else int(args[i]))
+    for i in range(1, len(args)-1):
+        if args[i] in options:
+            options[args[i]] = args[i+1]
+
+    if len(args) < 2 or len(n_overlays) == 0:
+        print("Invalid arguments.\nUsage: python3 Overlay.py INPUT_FILE N [N ...] [--poisson] [--events N_OUTPUT] [--source allpix|athena] [--side CT_StS] [--back CT_StBP] [--seed SEED]")
+    else:
+        results = RunOverlayScan(args[0], n_overlays, options["--source"], float(options["--side"]), float(options["--back"]),
+                                 int(options["--events"]) or None, poisson, int(options["--seed"]))
+        for (n_overlay, result) in zip(n_overlays, results):
+            thr_index = int(np.argmin(np.abs(result["thr_range"] - 1.0)))
+            print("overlay", n_overlay, ":  vt50 =", round(result["vt50"], 3), "+-", round(result["vt50_err"], 3), "fC,  occupancy at 1 fC =",
+                  round(float(result["occupancy"][thr_index]), 5))
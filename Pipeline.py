@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from Regression import LoadFunctions
+import multiprocessing
+import subprocess
+import hashlib
+import ast
+import json
+import os
+import sys
+
+STATE_PATH = "data/pipeline_state.json"
+
+# Settings of analysis nodes passed to RunAnalysis, with their defaults
+ANALYSIS_SETTINGS = {"source": "allpix", "CT_StS": 0.0, "CT_StBP": 0.0}
+
+
+def NodeInputs(node):
+    """Files a pipeline node reads, relative to the working directory."""
+    if node["kind"] == "command":
+        return list(node.get("inputs", []))
+    if node["kind"] == "analysis":
+        return ["data/raw/" + node["input"]]
+    if node["kind"] == "plot":
+        return ["data/" + name for name in node["files"] + node.get("refs", [])]
+    raise ValueError("Unknown node kind: " + str(node["kind"]))
+
+
+def NodeOutputs(node):
+    """Files a pipeline node writes."""
+    if node["kind"] == "command":
+        return list(node["outputs"])
+    if node["kind"] == "analysis":
+        return ["data/" + node["output"]]
+    if node["kind"] == "plot":
+        return ["results/" + node["plot_name"] + "_eff.pdf", "results/" + node["plot_name"] + "_clus.pdf"]
+    raise ValueError("Unknown node kind: " + str(node["kind"]))
+
+
+def LocalImports(script_path, found=None):
+    """The script and all modules of the working directory it imports, directly or through other local modules."""
+    if found is None:
+        found = []
+    if script_path in found or not os.path.exists(script_path):
+        return found
+    found.append(script_path)
+    for node in ast.walk(ast.parse(open(script_path).read(), script_path)):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            LocalImports(name.split(".")[0] + ".py", found)
+    return found
+
+
+def NodeCode(node):
+    """Scripts whose changes make the outputs of a node stale, including the local modules they import."""
+    if node["kind"] == "analysis":
+        return sorted(LocalImports(node.get("script", "Analysis.py")))
+    if node["kind"] == "plot":
+        return sorted(LocalImports("Plotting.py"))
+    return []
+
+
+def ScriptParameters(script_path, function_name="RunAnalysis"):
+    """Argument names of a function defined in a script, None if the script does not define it."""
+    for node in ast.parse(open(script_path).read(), script_path).body:
+        if isinstance(node, ast.FunctionDef) and node.name == function_name:
+            return [arg.arg for arg in node.args.args + node.args.kwonlyargs]
+    return None
+
+
+def CheckAnalysisNode(node):
+    """Raises a ValueError if the script of an analysis node cannot run it with the node's settings."""
+    script = node.get("script", "Analysis.py")
+    if not os.path.exists(script):
+        raise ValueError(node["name"] + ": script " + script + " not found")
+    parameters = ScriptParameters(script)
+    if parameters is None:
+        raise ValueError(node["name"] + ": " + script + " has no RunAnalysis")
+    unsupported = [key for key in ANALYSIS_SETTINGS if key in node and key not in parameters]
+    if unsupported:
+        raise ValueError(node["name"] + ": RunAnalysis of " + script + " does not take " + ", ".join(unsupported))
+
+
+def LoadPipeline(pipeline_path):
+    """Reads the nodes of a pipeline file and orders them so that every node follows its dependencies.
+
+    Returns
+    -------
+    tuple
+        (nodes by name in build order, {name: names of the nodes producing its inputs})
+    """
+    nodes = json.load(open(pipeline_path))["nodes"]
+    producers = dict()
+    for node in nodes:
+        if node["kind"] == "analysis":
+            CheckAnalysisNode(node)
+        for path in NodeOutputs(node):
+            if path in producers:
+                raise ValueError(path + " is produced by both " + producers[path] + " and " + node["name"])
+            producers[path] = node["name"]
+    deps = {node["name"]: sorted(set(producers[path] for path in NodeInputs(node) if path in producers)) for node in nodes}
+
+    ordered = dict()
+    visiting = set()
+
+    def Visit(node):
+        if node["name"] in ordered:
+            return
+        if node["name"] in visiting:
+            raise ValueError("Dependency cycle at " + node["name"])
+        visiting.add(node["name"])
+        for dep in deps[node["name"]]:
+            Visit(by_name[dep])
+        ordered[node["name"]] = node
+
+    by_name = {node["name"]: node for node in nodes}
+    for node in nodes:
+        Visit(node)
+    return (ordered, deps)
+
+
+def FileHash(path, file_cache):
+    """SHA-256 of a file, reused while its size and modification time are unchanged."""
+    stat = os.stat(path)
+    cached = file_cache.get(path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b""):
+            digest.update(chunk)
+    file_cache[path] = [stat.st_mtime_ns, stat.st_size, digest.hexdigest()]
+    return digest.hexdigest()
+
+
+def RecipeHash(node, file_cache):
+    """Hash of everything a node's outputs depend on: its settings, code and input contents.
+
+    Missing inputs hash to None, so the node is rebuilt once they appear.
+    """
+    recipe = {"node": node, "inputs": {}, "code": {}}
+    for group, paths in [("inputs", NodeInputs(node)), ("code", NodeCode(node))]:
+        for path in paths:
+            recipe[group][path] = FileHash(path, file_cache) if os.path.exists(path) else None
+    return hashlib.sha256(json.dumps(recipe, sort_keys=True).encode()).hexdigest()
+
+
+def IsStale(node, recipe, state):
+    """True if the recipe changed since the last build or an output is missing or was modified."""
+    built = state["nodes"].get(node["name"])
+    if built is None or built["recipe"] != recipe:
+        return True
+    for path in NodeOutputs(node):
+        if not os.path.exists(path) or FileHash(path, state["files"]) != built["outputs"].get(path):
+            return True
+    return False
+
+
+def RunNode(node):
+    """Builds the outputs of one node, executed in a worker process."""
+    if node["kind"] == "command":
+        subprocess.run(node["command"], shell=True, check=True)
+    elif node["kind"] == "analysis":
+        script = node.get("script", "Analysis.py")
+        parameters = ScriptParameters(script)
+        settings = {key: node.get(key, ANALYSIS_SETTINGS[key]) for key in ANALYSIS_SETTINGS if key in parameters}
+        LoadFunctions(script)["RunAnalysis"](node["input"], node["output"], **settings)
+    elif node["kind"] == "plot":
+        plotting = LoadFunctions("Plotting.py")
+        args = (node["files"], node["legend"], node.get("refs", []), node.get("ref_legend", []), node["plot_name"], node.get("header", ""))
+        plotting["PlotEfficiency"](*args, refOption=node.get("ref_option", "time"), plotRatio=node.get("ratio", 0))
+        plotting["PlotClusterSize"](*args)
+    missing = [path for path in NodeOutputs(node) if not os.path.exists(path)]
+    if missing:
+        raise RuntimeError("Outputs not written: " + ", ".join(missing))
+
+
+def LoadState():
+    if os.path.exists(STATE_PATH):
+        return json.load(open(STATE_PATH))
+    return {"nodes": {}, "files": {}}
+
+
+def SaveState(state):
+    with open(STATE_PATH + ".tmp", "w") as state_file:
+        json.dump(state, state_file, indent=1, sort_keys=True)
+    os.replace(STATE_PATH + ".tmp", STATE_PATH)
+
+
+def RunPipeline(pipeline_path, n_workers=None, dry_run=False, force=[]):
+    """Rebuilds the stale nodes of a pipeline, independent nodes in parallel.
+
+    A node is rebuilt when its settings, code or input contents changed or its outputs are missing
+    or modified. Dependents of a rebuilt node are only rebuilt if its outputs changed content.
+
+    Returns
+    -------
+    dict
+        Status of every node: "up to date", "rebuilt", "would rebuild", "failed" or "skipped"
+    """
+    (nodes, deps) = LoadPipeline(pipeline_path)
+    state = LoadState()
+    status = dict()
+    running = dict()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+        while len(status) < len(nodes):
+            for name in nodes:
+                if name in status or name in running.values():
+                    continue
+                dep_status = [status.get(dep) for dep in deps[name]]
+                if None in dep_status:
+                    continue
+                if "failed" in dep_status or "skipped" in dep_status:
+                    status[name] = "skipped"
+                    print("SKIPPED:", name, "(failed dependency)")
+                elif dry_run:
+                    stale = "would rebuild" in dep_status or name in force or IsStale(nodes[name], RecipeHash(nodes[name], state["files"]), state)
+                    status[name] = "would rebuild" if stale else "up to date"
+                    print(status[name].upper() + ":", name)
+                elif name in force or IsStale(nodes[name], RecipeHash(nodes[name], state["files"]), state):
+                    print("BUILDING:", name)
+                    running[executor.submit(RunNode, nodes[name])] = name
+                else:
+                    status[name] = "up to date"
+            if not running:
+                continue
+
+            (finished, _) = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception as error:
+                    status[name] = "failed"
+                    print("FAILED:", name, "-", error)
+                    continue
+                # The recipe is recomputed from the inputs as they were used, outputs hashed fresh
+                state["nodes"][name] = {
+                    "recipe": RecipeHash(nodes[name], state["files"]),
+                    "outputs": {path: FileHash(path, state["files"]) for path in NodeOutputs(nodes[name])},
+                }
+                SaveState(state)
+                status[name] = "rebuilt"
+                print("DONE:", name)
+    if not dry_run:
+        SaveState(state)
+    return status
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--jobs": None, "--force": ""}
+    dry_run = "--dry-run" in args
+    args = [arg for arg in args if arg != "--dry-run"]
+    for option in options:
+        if option in args:
+            i = args.index(option)
+            options[option] = args[i+1]
+            args = args[:i] + args[i+2:]
+
+    if len(args) > 1:
+        print("Invalid arguments.\nUsage: python3 Pipeline.py [PIPELINE_FILE] [--jobs N] [--force NODE,NODE] [--dry-run]")
+    else:
+        n_workers = int(options["--jobs"]) if options["--jobs"] else None
+        force = options["--force"].split(",") if options["--force"] else []
+        status = RunPipeline(args[0] if args else "pipeline.json", n_workers, dry_run, force)
+        counts = dict()
+        for name in status:
+            counts[status[name]] = counts.get(status[name], 0) + 1
+        print(", ".join(str(counts[key]) + " " + key for key in counts))
+        sys.exit(1 if "failed" in counts else 0)
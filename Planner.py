@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+import numpy as np
+import json
+import sys
+
+# Sweep parameters of Run.py: unit appended to the values, rounding step and default range
+PARAMETERS = {
+    "angle": {"unit": "deg", "step": 1, "range": (0, 25)},
+    "noise": {"unit": "e", "step": 10, "range": (600, 1000)},
+    "thickness": {"unit": "um", "step": 5, "range": (250, 320)},
+}
+
+# Primitive polynomials (degree, coefficients) and initial direction numbers of the Sobol dimensions
+# after the first, from the new-joe-kuo-6.21201 table of S. Joe and F. Y. Kuo
+SOBOL_PARAMETERS = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]),
+    (5, 7, [1, 1, 7, 11, 19]),
+]
+
+# Bits of the Sobol points, enough for 2**30 points
+SOBOL_BITS = 30
+
+
+def LatinHypercube(n_points, n_dims, rng, n_candidates=20):
+    """Latin hypercube sample in the unit cube, the one with the largest minimum point distance of n_candidates."""
+    best = None
+    best_distance = -1.0
+    for i in range(n_candidates):
+        sample = (np.argsort(rng.random((n_dims, n_points)), axis=1).T + rng.random((n_points, n_dims))) / n_points
+        distance = np.inf
+        if n_points > 1:
+            differences = sample[:, np.newaxis, :] - sample[np.newaxis, :, :]
+            distances = np.sqrt((differences**2).sum(axis=2))
+            distance = distances[np.triu_indices(n_points, 1)].min()
+        if distance > best_distance:
+            (best, best_distance) = (sample, distance)
+    return best
+
+
+def SobolDirections(n_dims, n_bits=SOBOL_BITS):
+    """Direction numbers of the first n_dims Sobol dimensions as n_bits-bit integers, shaped (n_dims, n_bits)."""
+    if n_dims > len(SOBOL_PARAMETERS) + 1:
+        raise ValueError("Sobol sequences are implemented up to " + str(len(SOBOL_PARAMETERS) + 1) + " dimensions.")
+    directions = np.zeros((n_dims, n_bits), dtype=np.int64)
+    # The first dimension is the van der Corput sequence in base 2
+    directions[0] = [1 << (n_bits - 1 - k) for k in range(n_bits)]
+    for (dim, (degree, coefficients, initial)) in enumerate(SOBOL_PARAMETERS[:n_dims-1], 1):
+        values = [m << (n_bits - 1 - k) for (k, m) in enumerate(initial)]
+        # Recurrence of the primitive polynomial of the dimension
+        for k in range(degree, n_bits):
+            value = values[k-degree] ^ (values[k-degree] >> degree)
+            for j in range(1, degree):
+                if (coefficients >> (degree - 1 - j)) & 1:
+                    value ^= values[k-j]
+            values.append(value)
+        directions[dim] = values[:n_bits]
+    return directions
+
+
+def Sobol(n_points, n_dims, rng):
+    """Sobol sequence in the unit cube with a random digital shift, in Gray code order.
+
+    Sobol points are best balanced for powers of two, other budgets are still fine.
+    """
+    directions = SobolDirections(n_dims)
+    index = np.arange(n_points, dtype=np.int64)
+    gray = index ^ (index >> 1)
+    sample = np.zeros((n_points, n_dims), dtype=np.int64)
+    for bit in range(SOBOL_BITS):
+        sample ^= ((gray >> bit) & 1)[:, np.newaxis] * directions[:, bit]
+    sample ^= rng.integers(0, 1 << SOBOL_BITS, n_dims)
+    return sample / float(1 << SOBOL_BITS)
+
+
+def Grid(n_points, n_dims):
+    """Full grid with the largest number of points per dimension within n_points."""
+    n_per_dim = max(int(np.floor(n_points ** (1 / n_dims) + 1e-9)), 1)
+    axes = [(np.arange(n_per_dim) + 0.5) / n_per_dim] * n_dims
+    return np.array(np.meshgrid(*axes, indexing="ij")).reshape(n_dims, -1).T
+
+
+DESIGNS = {"lhs": LatinHypercube, "sobol": Sobol, "grid": None}
+
+
+def ToPoints(unit_sample, ranges):
+    """Scales a unit-cube sample to the parameter ranges, rounds to the parameter steps and drops duplicates."""
+    points = []
+    for row in unit_sample:
+        point = dict()
+        for (value, name) in zip(row, ranges):
+            (low, high) = ranges[name]
+            step = PARAMETERS[name]["step"]
+            # Rounded to the step, inside the range
+            value = np.round((low + value * (high - low)) / step) * step
+            point[name] = float(min(max(value, np.ceil(low / step) * step), np.floor(high / step) * step))
+        if point not in points:
+            points.append(point)
+    return points
+
+
+def Design(ranges, n_points, method="lhs", seed=0):
+    """Space-filling design of at most n_points simulation points.
+
+    Parameters
+    ----------
+    ranges : dict
+        {parameter: (low, high)} of the varied parameters, see PARAMETERS
+    n_points : int
+        Point budget; points coinciding after rounding to the parameter steps are only simulated once
+    method : str
+        "lhs" (maximin Latin hypercube), "sobol" (digitally shifted Sobol) or "grid" (full grid)
+    seed : int
+        Seed of the random designs
+
+    Returns
+    -------
+    list
+        Points as {parameter: value in the units of PARAMETERS}
+    """
+    if method not in DESIGNS:
+        raise ValueError("Unknown design: " + str(method))
+    unknown = [name for name in ranges if name not in PARAMETERS]
+    if unknown:
+        raise ValueError("Unknown parameters: " + ", ".join(unknown))
+    if method == "grid":
+        return ToPoints(Grid(n_points, len(ranges)), ranges)
+    return ToPoints(DESIGNS[method](n_points, len(ranges), np.random.default_rng(seed)), ranges)
+
+
+def Refine(ranges, points, scores, n_points, n_best=None, shrink=0.5, seed=0):
+    """Coarse-to-fine step: new points around the points with the lowest scores.
+
+    Every selected point gets a box of shrink times the spacing of the existing design around it,
+    filled by a Latin hypercube; points already simulated are not repeated.
+
+    Parameters
+    ----------
+    ranges : dict
+        Ranges of the original design
+    points : list
+        Simulated points
+    scores : list
+        Score of every point, lower is more interesting (e.g. |vt50 - target|), nan for missing results
+    n_points : int
+        Budget of new points
+    n_best : int
+        Number of points to refine around, a quarter of the points by default
+    """
+    rng = np.random.default_rng(seed)
+    scores = np.asarray(scores, dtype=np.float64)
+    valid = np.nonzero(np.isfinite(scores))[0]
+    if len(valid) == 0:
+        raise ValueError("No scored points to refine around.")
+    if n_best is None:
+        n_best = max(len(valid) // 4, 1)
+    best = valid[np.argsort(scores[valid])[:n_best]]
+    n_dims = len(ranges)
+    spacing = {name: shrink * (ranges[name][1] - ranges[name][0]) / max(len(points) ** (1 / n_dims), 1) for name in ranges}
+
+    new_points = []
+    per_point = int(np.ceil(n_points / len(best)))
+    for i in best:
+        box = {name: (max(points[i][name] - spacing[name], ranges[name][0]), min(points[i][name] + spacing[name], ranges[name][1])) for name in ranges}
+        for point in ToPoints(LatinHypercube(per_point, n_dims, rng), box):
+            if point not in points and point not in new_points:
+                new_points.append(point)
+    return new_points[:n_points]
+
+
+def RunNames(point, axis="y"):
+    """Run.py sweep values (angle, noise, thickness) of a point, parameters missing in the point get the defaults of Run.py."""
+    angle = point.get("angle", 0)
+    return (
+        ("0" if angle == 0 else axis + str(int(angle))) + "deg",
+        str(int(point.get("noise", 864))) + "e",
+        str(int(point.get("thickness", 290))) + "um",
+    )
+
+
+def GridPoints(angles, noises, thicknesses):
+    """Run.py sweep values of the full Cartesian product of the value lists."""
+    return [(angle, noise, thickness) for angle in angles for noise in noises for thickness in thicknesses]
+
+
+def SavePlan(plan_path, points, axis="y"):
+    """Stores the points of a design together with their Run.py names."""
+    with open(plan_path, "w") as plan_file:
+        json.dump({"axis": axis, "points": points, "runs": [RunNames(point, axis) for point in points]}, plan_file, indent=1)
+
+
+def LoadPlan(plan_path):
+    """Run.py sweep values (angle, noise, thickness) of a stored plan."""
+    return [tuple(run) for run in json.load(open(plan_path))["runs"]]
+
+
+def ParseRanges(args):
+    """Ranges of --angle, --noise and --thickness given as LOW:HIGH."""
+    ranges = dict()
+    for name in PARAMETERS:
+        if "--" + name in args:
+            (low, high) = args[args.index("--" + name) + 1].split(":")
+            ranges[name] = (float(low), float(high))
+    return ranges
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--method": "lhs", "--budget": "16", "--axis": "y", "--seed": "0", "--out": "plan.json", "--refine": "", "--target": ""}
+    for option in options:
+        if option in args:
+            options[option] = args[args.index(option) + 1]
+    ranges = ParseRanges(args)
+
+    if not ranges and not options["--refine"]:
+        print("Invalid arguments.\nUsage: python3 Planner.py [--angle LOW:HIGH] [--noise LOW:HIGH] [--thickness LOW:HIGH] [--method lhs|sobol|grid] [--budget N] [--axis x|y|z] [--seed SEED] [--out PLAN_FILE]"
+              "\n       python3 Planner.py --refine PLAN_FILE --target vt50=VALUE [--budget N] [--out PLAN_FILE]")
+    elif options["--refine"]:
+        from Trends import TrendTable
+        import glob
+        plan = json.load(open(options["--refine"]))
+        ranges = ParseRanges(args) or {name: PARAMETERS[name]["range"] for name in plan["points"][0]}
+        (column, target) = options["--target"].split("=")
+        rows = {row["name"]: row for row in TrendTable(sorted(glob.glob("data/*_analysed.root")))}
+        scores = []
+        for run in plan["runs"]:
+            row = rows.get("-".join([run[0], run[2], run[1]]))
+            scores.append(abs(row[column] - float(target)) if row and column in row else np.nan)
+        points = Refine(ranges, plan["points"], scores, int(options["--budget"]), seed=int(options["--seed"]))
+        SavePlan(options["--out"], plan["points"] + points, plan["axis"])
+        print(len(points), "new points around", int(np.count_nonzero(np.isfinite(scores))), "analysed points written to", options["--out"])
+    else:
+        points = Design(ranges, int(options["--budget"]), options["--method"], int(options["--seed"]))
+        SavePlan(options["--out"], points, options["--axis"])
+        print(len(points), "points written to", options["--out"])
+        for point in points:
+            print("  " + "  ".join(RunNames(point, options["--axis"])))
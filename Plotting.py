@@ -4,33 +4,27 @@ from ROOT import TFile, TCanvas, TH1D, gStyle, TBrowser, TLegend, TMath, TF1, TG
 from datetime import datetime as date
 from math import ceil, sqrt
 import numpy as np
+from RootArrays import HistArrays
+from Charge import PlotChargeTrend
+from Engine import CT_FINAL
 
 
 def InterpolateHist(hist, x):
     """
     Interpolates between two bins of a histogram "hist", returns x,y position of left and right "point" and the interpolated y value to the corresponding "x" input.
     """
+    (centers, contents, errors) = HistArrays(hist, flow=True)
     xBin = hist.FindBin(x)
-    binWidth = hist.GetBinWidth(hist.GetBin(xBin))
-    # Looking for left bin
-    for i in range(10):
-        currBin = hist.FindBin(x-i*binWidth) 
-        if hist.GetBinContent(currBin) > 0.01:
-            if i == 0:
-                return (0,0,0,0,hist.GetBinContent(currBin), hist.GetBinError(currBin))
-            xL = hist.GetBinCenter(currBin)
-            yL = hist.GetBinContent(currBin)
-            eyL = hist.GetBinError(currBin)
-            break 
-
-    # Looking for right bin
-    for i in range(10):
-        currBin = hist.FindBin(x+i*binWidth) 
-        if hist.GetBinContent(currBin) > 0.01:
-            xR = hist.GetBinCenter(currBin)
-            yR = hist.GetBinContent(currBin)
-            eyR = hist.GetBinError(currBin)
-            break
+    if contents[xBin] > 0.01:
+        return (0,0,0,0,contents[xBin], errors[xBin])
+
+    # Looking for left and right bins within 10 bins
+    leftBins = np.arange(xBin-1, max(xBin-10, -1), -1)
+    rightBins = np.arange(xBin+1, min(xBin+10, len(contents)))
+    leftBin = leftBins[contents[leftBins] > 0.01][0]
+    rightBin = rightBins[contents[rightBins] > 0.01][0]
+    (xL, yL, eyL) = (centers[leftBin], contents[leftBin], errors[leftBin])
+    (xR, yR, eyR) = (centers[rightBin], contents[rightBin], errors[rightBin])
                        
     k = (yR-yL)/(xR-xL)
     q = yR - k*xR       
@@ -471,95 +465,14 @@ def PlotClusterSize (fileNames=0, legendEntries=0, refFileNames=0, refLegendEntr
     # Print and save
     canvas.SaveAs("results/" + plotName + "_clus.pdf")
 
-def MedianCharges():
-    canvas = TCanvas("c1", "c1", 800,600)
-    
-    gStyle.SetOptStat(0)            #hides stat table
-    gStyle.SetOptTitle(0)     
-
-    thick = [25, 50, 100, 150, 200, 250, 270, 280, 290, 300, 310]
-    nOfPoints = len(thick)
-    
-    #Allpix with CT
-    chargesAllpix1 = [0.224, 0.468, 1.197, 1.864, 2.521, 3.193, 3.466, 3.592, 3.733, 3.863, 3.991]
-    errorsAllpix1 = [0.063] + [0.002] * (nOfPoints-1)
-
-    #Allpix no CT
-    chargesAllpix2 = [0.224, 0.504, 1.266, 1.961, 2.654, 3.361, 3.6479, 3.7848, 3.9223, 4.058, 4.206]
-    errorsAllpix2 = [0.057] + [0.002] * (nOfPoints-1)
-
-    #Athena
-    chargesAthena = [0.35, 0.731, 1.364, 1.949, 2.425, 2.809, 2.9257, 2.9877, 3.042, 3.093, 3.141]
-    errorsAthena = [0.079, 0.001, 0.002, 0.002, 0.003, 0.003, 0.007, 0.007, 0.007, 0.007, 0.007]
-
-    graphAllpix1 = TGraphErrors(nOfPoints)
-    graphAllpix2 = TGraphErrors(nOfPoints)
-    graphAthena = TGraphErrors(nOfPoints)
-    
-    for i in range(nOfPoints):
-        graphAllpix1.SetPoint(i, thick[i], chargesAllpix1[i])
-        graphAllpix1.SetPointError(i,0,errorsAllpix1[i])
-        graphAllpix2.SetPoint(i, thick[i], chargesAllpix2[i])
-        graphAllpix2.SetPointError(i,0,errorsAllpix2[i])
-        graphAthena.SetPoint(i, thick[i], chargesAthena[i])
-        graphAthena.SetPointError(i,0,errorsAthena[i])
-
-
-    graphAllpix1.SetMarkerSize(1)
-    graphAllpix1.SetMarkerColor(2)
-    graphAllpix1.SetMarkerStyle(22)
-    graphAllpix1.GetXaxis().SetTitle("Active sensor thickness [#mum]")
-    graphAllpix1.GetYaxis().SetTitle("Median charge [fC]")
-    graphAllpix1.GetHistogram().SetMaximum(4.4)
-    graphAllpix1.GetHistogram().SetMinimum(2.8)
-    graphAllpix1.GetXaxis().SetLimits(260,320)
-    graphAllpix2.GetXaxis().SetLimits(0,330)
-    graphAthena.GetXaxis().SetLimits(0,330)
-
-    graphAllpix2.SetMarkerSize(1)
-    graphAllpix2.SetMarkerColor(1)
-    graphAllpix2.SetMarkerStyle(21)
-
-    graphAthena.SetMarkerSize(1)
-    graphAthena.SetMarkerColor(4)
-    graphAthena.SetMarkerStyle(23)
-    
-
-    graphAllpix1.Draw("AP")
-    graphAllpix2.Draw("sameP")
-    graphAthena.Draw("sameP")
-
-    graphAllpix1Func = TF1("graphAllpix1Func", "[0]*x+[1]", 0, 310)
-    graphAllpix2Func = TF1("graphAllpix2Func", "[0]*x+[1]", 0, 310)
-    graphAthenaFunc = TF1("graphAthenaFunc", "[0]*x+[1]", 240, 320)
-    # graphAthenaFunc = TF1("graphAthenaFunc","[0]*x**2+[1]*x+[2]",0, 310)
-        
-    graphAllpix1Func.SetLineStyle(2)
-    graphAllpix1Func.SetLineColor(2)
-    graphAllpix2Func.SetLineStyle(2)
-    graphAllpix2Func.SetLineColor(1)
-    graphAthenaFunc.SetLineStyle(2)
-    graphAthenaFunc.SetLineColor(4)
-    
-    graphAllpix1.Fit("graphAllpix1Func")
-    graphAllpix2.Fit("graphAllpix2Func")
-    graphAthena.Fit("graphAthenaFunc","r")
-    
-
-    # textSize = 
-    legend = TLegend(0.13, 0.63, 0.33, 0.88)
-    legend.SetBorderSize(0)
-    # legend.SetTextSize(textSize)
-    legend.AddEntry(graphAllpix2, "Allpix, no crosstalk", "p")
-    legend.AddEntry(graphAllpix2Func, "Linear fit", "l")
-    legend.AddEntry(graphAllpix1, "Allpix, crosstalk", "p")
-    legend.AddEntry(graphAllpix1Func, "Linear fit", "l")
-    legend.AddEntry(graphAthena, "Athena", "p")
-    legend.AddEntry(graphAthenaFunc, "Linear fit", "l")
-
-    legend.Draw("same")
-
-    canvas.SaveAs("results/Thickness.pdf")
+def MedianCharges(thick=[25, 50, 100, 150, 200, 250, 270, 280, 290, 300, 310]):
+    """
+    Plots the median charge vs active sensor thickness of the Allpix sweep with and without crosstalk and of the Athena sweep to results/Thickness.pdf, see Charge.PlotChargeTrend. Charges are computed from the simulation outputs "0deg-<thick>um-864e_output.root" and "0deg-<thick>um-athena_output.root" and cached by Charge.SweepCharges.
+    """
+    allpixNames = ["0deg-" + str(t) + "um-864e_output.root" for t in thick]
+    athenaNames = ["0deg-" + str(t) + "um-athena_output.root" for t in thick]
+    sweeps = [(allpixNames, "allpix", 0.0, 0.0), (allpixNames, "allpix") + CT_FINAL, (athenaNames, "athena", 0.0, 0.0)]
+    PlotChargeTrend(sweeps, ["Allpix, no crosstalk", "Allpix, crosstalk", "Athena"], "Thickness")
     
 
 # ------------------------------------------------------------------------------
@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+
+from ROOT import TFile, gROOT
+from concurrent.futures import ProcessPoolExecutor
+import EventIndex
+import multiprocessing
+import glob
+import json
+import os
+import sys
+
+# Objects every raw output of a source needs: trees with their branches and metadata keys, "{detector}"
+# stands for the name of the analysed detector and "{model}" for its model, see Model
+REQUIRED = {
+    "allpix": {"trees": {"PixelCharge": ["{detector}"]}, "keys": ["config/Allpix/number_of_events", "models/{model}/number_of_pixels",
+                                                                  "models/{model}/pixel_size"]},
+    "athena": {"trees": {"SCT_RDOAnalysis/SCT_RDOAna": ["strip_sdo", "charge"]}, "keys": []},
+}
+
+# Monte Carlo truth needed by the in-strip analysis only, checked on request
+TRUTH = {"allpix": {"MCParticle": ["{detector}"]}, "athena": {}}
+
+# Name of the analysed detector in the Allpix geometry
+DETECTOR = "dut"
+
+
+def Lookup(root_file, path):
+    """Object at a path such as "config/Allpix/number_of_events", None if any part is missing.
+
+    The directories are entered one by one: Get with a full path cannot return the std::string
+    values Allpix stores its configuration in.
+    """
+    directory = root_file
+    for name in path.split("/"):
+        if not directory.GetKey(name):
+            return None
+        directory = directory.Get(name)
+    return directory
+
+
+def Model(root_file, detector):
+    """Model of a detector from the detector configuration stored in an Allpix output, or the only stored model, "" if unknown."""
+    model = Lookup(root_file, "detectors/" + detector + "/type")
+    if model is not None:
+        return str(model)
+    models = root_file.Get("models")
+    if models and models.GetListOfKeys().GetSize() == 1:
+        return models.GetListOfKeys().At(0).GetName()
+    return ""
+
+
+def Source(root_file):
+    """Simulation source of an opened raw output from its content, "" if unknown."""
+    if root_file.GetKey("SCT_RDOAnalysis"):
+        return "athena"
+    if root_file.GetKey("config") or root_file.GetKey("PixelCharge"):
+        return "allpix"
+    return ""
+
+
+def CheckFile(input_name, source="", detector=DETECTOR, truth=False):
+    """Checks a raw simulation output from its header and metadata only, without reading events.
+
+    Parameters
+    ----------
+    input_name : str
+        Name of the simulation output in data/raw, or its path
+    source : str
+        "allpix" or "athena", taken from the content by default
+    detector : str
+        Name of the analysed Allpix detector, its model is taken from the detector configuration in the file
+    truth : bool
+        Also requires the Monte Carlo truth of the in-strip analysis
+
+    Returns
+    -------
+    dict
+        "file", "source", "status" ("ok", "warning" or "error"), "problems" (errors first, then warnings),
+        "n_events" (tree entries), "n_configured" (number_of_events of the configuration) and "detectors"
+    """
+    path = EventIndex.RawPath(input_name)
+    report = {"file": input_name, "source": source, "status": "ok", "problems": [], "warnings": [], "n_events": None, "n_configured": None, "detectors": []}
+    if not os.path.exists(path):
+        report["problems"].append("missing")
+    elif os.path.getsize(path) == 0:
+        report["problems"].append("empty file")
+    if report["problems"]:
+        return Summarise(report)
+
+    try:
+        root_file = TFile.Open(path)
+    except OSError:
+        root_file = None
+    if not root_file or root_file.IsZombie():
+        report["problems"].append("not a readable ROOT file")
+        return Summarise(report)
+    if root_file.TestBit(TFile.kRecovered):
+        report["problems"].append("not closed properly, keys recovered (truncated or still being written)")
+    if root_file.GetEND() > os.path.getsize(path):
+        report["problems"].append("truncated: " + str(os.path.getsize(path)) + " of " + str(root_file.GetEND()) + " bytes")
+    if not source:
+        source = report["source"] = Source(root_file)
+    if source not in REQUIRED:
+        report["problems"].append("unknown source" + (": " + source if source else ""))
+        root_file.Close()
+        return Summarise(report)
+
+    placeholders = {"detector": detector, "model": Model(root_file, detector) if source == "allpix" else ""}
+    for key in REQUIRED[source]["keys"]:
+        if "{model}" in key and not placeholders["model"]:
+            report["problems"].append("unknown model of detector " + detector)
+            break
+        key = key.format(**placeholders)
+        if Lookup(root_file, key) is None:
+            report["problems"].append("missing key " + key)
+    for (required, trees) in [(True, REQUIRED[source]["trees"]), (False, TRUTH[source] if truth else {})]:
+        for (tree_name, branches) in trees.items():
+            tree = Lookup(root_file, tree_name)
+            if tree is None:
+                report["problems"].append("missing tree " + tree_name)
+                continue
+            branches = [branch.format(**placeholders) for branch in branches]
+            branch_names = [branch.GetName() for branch in tree.GetListOfBranches()]
+            report["problems"] += ["missing branch " + tree_name + "." + branch for branch in branches if branch not in branch_names]
+            if required:
+                report["n_events"] = int(tree.GetEntries())
+                if source == "allpix":
+                    report["detectors"] = branch_names
+
+    if source == "allpix":
+        detectors = Lookup(root_file, "detectors")
+        if detectors is not None:
+            configured = sorted(key.GetName() for key in detectors.GetListOfKeys())
+            if report["detectors"] and sorted(report["detectors"]) != configured:
+                report["warnings"].append("tree detectors " + ",".join(report["detectors"]) + " differ from configured " + ",".join(configured))
+        n_configured = Lookup(root_file, "config/Allpix/number_of_events")
+        if n_configured is not None:
+            try:
+                report["n_configured"] = int(str(n_configured))
+            except ValueError:
+                report["problems"].append("number_of_events is not a number: " + str(n_configured))
+        if report["n_configured"] is not None and report["n_events"] is not None and report["n_events"] != report["n_configured"]:
+            report["problems"].append(str(report["n_events"]) + " events of " + str(report["n_configured"]) + " configured")
+    if report["n_events"] == 0:
+        report["problems"].append("no events")
+    root_file.Close()
+    return Summarise(report)
+
+
+def Summarise(report):
+    report["status"] = "error" if report["problems"] else "warning" if report["warnings"] else "ok"
+    report["problems"] += report.pop("warnings")
+    return report
+
+
+def _CheckFile(args):
+    # The recovery messages of broken files would interleave between the workers, the report lists them
+    gROOT.ProcessLine("gErrorIgnoreLevel = kBreak;")
+    return CheckFile(*args)
+
+
+def Preflight(inputs, source="", n_workers=None, detector=DETECTOR, truth=False):
+    """Checks raw outputs in parallel worker processes, see CheckFile.
+
+    Returns
+    -------
+    list
+        Reports in the order of inputs
+    """
+    if not inputs:
+        return []
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+        return list(executor.map(_CheckFile, [(input_name, source, detector, truth) for input_name in inputs]))
+
+
+def PrintReport(reports):
+    """Prints one line per input and a summary, returns the number of inputs with errors."""
+    for report in reports:
+        events = "" if report["n_events"] is None else str(report["n_events"]) + (" / " + str(report["n_configured"]) if report["n_configured"] is not None else "")
+        print(report["status"].ljust(8), os.path.basename(report["file"]).ljust(40), (report["source"] or "-").ljust(7), events.ljust(14), "; ".join(report["problems"]))
+    counts = {status: sum(report["status"] == status for report in reports) for status in ["ok", "warning", "error"]}
+    print(len(reports), "files:", counts["ok"], "ok,", counts["warning"], "with warnings,", counts["error"], "with errors.")
+    return counts["error"]
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--source": "", "--pattern": "*_output.root", "--jobs": "0", "--json": "", "--detector": DETECTOR}
+    truth = False
+    paths = []
+    i = 0
+    while i < len(args):
+        if args[i] in options and i+1 < len(args):
+            options[args[i]] = args[i+1]
+            i += 2
+        elif args[i] == "--truth":
+            truth = True
+            i += 1
+        else:
+            paths.append(args[i])
+            i += 1
+    if not paths:
+        paths = ["data/raw"]
+    inputs = sum([sorted(glob.glob(os.path.join(path, options["--pattern"]))) if os.path.isdir(path) else [path] for path in paths], [])
+
+    if not inputs:
+        print("No raw outputs found.\nUsage: python3 Preflight.py [DIR_OR_FILE ...] [--pattern GLOB] [--source allpix|athena] [--detector NAME] [--truth] [--jobs N] [--json REPORT_FILE]")
+        sys.exit(1)
+    reports = Preflight([os.path.abspath(path) for path in inputs], options["--source"], int(options["--jobs"]) or None, options["--detector"], truth)
+    n_errors = PrintReport(reports)
+    if options["--json"]:
+        with open(options["--json"], "w") as report_file:
+            json.dump(reports, report_file, indent=1)
+    sys.exit(1 if n_errors else 0)
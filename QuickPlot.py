@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+
+from ROOT import TFile, TCanvas, TLegend, gStyle, gROOT, gSystem
+from RootArrays import ArraysToGraph
+import Engine
+import sys
+
+
+def ResultTitle(result):
+    """Legend title of a result in the format of the Info title, with the crosstalk if applied."""
+    title = result.get("source", "") + "," + result.get("angle", "") + "," + result.get("descr", "") + "(" + str(result["n_events"]) + "ev)"
+    if result.get("CT_StS", 0) or result.get("CT_StBP", 0):
+        title += " CT " + str(result["CT_StS"]) + "/" + str(result["CT_StBP"])
+    return title
+
+
+def DrawResults(results, output_name, titles=None, ref_file=""):
+    """Plots efficiency and cluster size of analysis results held in memory, as Analysis2.0.DrawEfficiencyCluster
+    does for analysed files.
+
+    Parameters
+    ----------
+    results : list
+        Results of Engine.RunAnalysis
+    output_name : str
+        Name of the produced files in results, "_eff.pdf" and "_clus.pdf" are appended
+    titles : list
+        Legend entries, ResultTitle of every result by default
+    ref_file : str
+        Optional name of the file with reference results in data
+
+    Returns
+    -------
+    list
+        Drawn objects, to keep them alive in interactive sessions
+    """
+    gStyle.SetOptStat(0)
+    if titles is None:
+        titles = [ResultTitle(result) for result in results]
+    objects = [Engine.ResultObjects(results[i], "Efficiency_" + str(i), "Average_cluster_size_" + str(i)) for i in range(len(results))]
+
+    legendHeight = 0.13*len(results)
+    if not ref_file: legendHeight += 0.13
+    legend = TLegend(0.5, 1-legendHeight, 0.85, 0.85)
+    legend.SetTextSize(0.03)
+    legend.SetBorderSize(0)
+
+    canvas_eff = TCanvas("canvas1", "canvas1", 800, 600)
+    for i in range(len(objects)):
+        eff = objects[i][0]
+        eff.Draw("" if i == 0 else "same")
+        eff.SetLineColor(i+1)
+        fit_func = eff.GetListOfFunctions().FindObject("Efficiency_" + str(i) + "_fit")
+        if fit_func:
+            fit_func.SetLineColor(i+1)
+        legend.AddEntry(eff, titles[i], "l")
+    ref_objects = []
+    if ref_file:
+        ref = TFile("data/" + ref_file)
+        eff_ref = ref.Get("efficiency_vs_threshold_time_corrected")
+        eff_ref.SetMarkerStyle(2)
+        eff_ref.SetLineColor(51)
+        eff_ref.SetMarkerColor(51)
+        eff_ref.GetListOfFunctions().FindObject("erfcFit_timing").SetLineColor(51)
+        eff_ref.Draw("PEsame")
+        legend.AddEntry(eff_ref, "test beam", "l")
+        ref_objects = [ref, eff_ref, ref.Get("cluster_size_vs_threshold")]
+    legend.Draw("same")
+    canvas_eff.SaveAs("results/" + output_name + "_eff.pdf")
+
+    canvas_clus = TCanvas("canvas2", "canvas2", 800, 600)
+    for i in range(len(objects)):
+        clus_graph = objects[i][1]
+        clus_graph.Draw("APL" if i == 0 else "PLsame")
+        clus_graph.SetLineColor(i+1)
+    if ref_file:
+        ref_objects[2].SetLineColor(51)
+        ref_objects[2].Draw("same")
+    legend.Draw("same")
+    canvas_clus.SaveAs("results/" + output_name + "_clus.pdf")
+    return [canvas_eff, canvas_clus, legend] + objects + ref_objects
+
+
+def AnalyseAndPlot(jobs, output_name, ref_file="", write=False, prefetch=Engine.PREFETCH_DEPTH):
+    """Analyses a list of inputs or settings and plots them without reading analysed files back.
+
+    Every input is decoded once, so what-if comparisons of one input with different crosstalk
+    only pay for the threshold scans. The next inputs are decoded in the background while the
+    current one is analysed.
+
+    Parameters
+    ----------
+    jobs : list
+        Dicts with "input" and optional "source", "CT_StS", "CT_StBP", "title" and "output"
+    output_name : str
+        Name of the produced plots in results
+    ref_file : str
+        Optional name of the file with reference results in data
+    write : bool
+        Also write the analysed files in the background, jobs without "output" use Engine.AnalysedName,
+        which includes the crosstalk
+    prefetch : int
+        Inputs decoded ahead, see Engine.PrefetchEvents
+
+    Returns
+    -------
+    list
+        Results of Engine.RunAnalysis, with a Future of the output in result["write"] if written
+    """
+    if write:
+        outputs = [job.get("output") or Engine.AnalysedName(job["input"], job.get("CT_StS", 0.0), job.get("CT_StBP", 0.0)) for job in jobs]
+        duplicates = sorted(set(output for output in outputs if outputs.count(output) > 1))
+        if duplicates:
+            raise ValueError("Several jobs would write " + ", ".join(duplicates) + ", give them different outputs.")
+    keys = []
+    for job in jobs:
+        key = (job["input"], job.get("source", "allpix"))
+        if key not in keys:
+            keys.append(key)
+    results = [None] * len(jobs)
+    for (input_name, source, events) in Engine.PrefetchEvents(keys, prefetch):
+        for i in range(len(jobs)):
+            job = jobs[i]
+            if (job["input"], job.get("source", "allpix")) != (input_name, source):
+                continue
+            output = job.get("output", "") if write else None
+            results[i] = Engine.RunAnalysis(input_name, output, source, job.get("CT_StS", 0.0), job.get("CT_StBP", 0.0),
+                                            events=events, async_write=write)
+    titles = [job.get("title", ResultTitle(result)) for (job, result) in zip(jobs, results)]
+    DrawResults(results, output_name, titles, ref_file)
+    return results
+
+
+def DrawPreview(result, output_name, canvas=None):
+    """Draws the efficiency of a PreviewAnalysis step with its fit and the fit confidence band
+    into results/<output_name>_preview.pdf, updating canvas if given."""
+    if canvas is None:
+        canvas = TCanvas("canvas_preview", "canvas_preview", 800, 600)
+    canvas.cd()
+    canvas.Clear()
+    gStyle.SetOptStat(0)
+    (eff, _) = Engine.ResultObjects(result, "Efficiency_preview")
+    eff.SetTitle(result.get("source", "") + " preview, " + str(result["n_events"]) + " events ("
+                 + str(round(100 * result["fraction"], 1)) + "%);Threshold [fC];Efficiency")
+    fit_func = eff.GetListOfFunctions().FindObject("Efficiency_preview_fit")
+    thr_range = result["thr_range"]
+    band = ArraysToGraph(thr_range, [fit_func.Eval(thr) for thr in thr_range], ey=result["band"], name="Efficiency_preview_band")
+    band.SetFillColorAlpha(2, 0.3)
+    band.SetLineColor(2)
+    fit_func.SetLineColor(2)
+    eff.Draw("AP")
+    band.Draw("3same")
+    canvas.Update()
+    canvas.SaveAs("results/" + output_name + "_preview.pdf")
+    return [canvas, eff, band]
+
+
+def Preview(input_name, source="allpix", CT_StS=0.0, CT_StBP=0.0, output_name="", fractions=Engine.PREVIEW_FRACTIONS, stratified=True):
+    """Shows Engine.PreviewAnalysis steps until the full sample is reached or Ctrl-C is pressed.
+
+    Returns
+    -------
+    dict
+        Result of the last completed step
+    """
+    if not output_name:
+        output_name = input_name.split("_")[0]
+    result = None
+    canvas = TCanvas("canvas_preview", "canvas_preview", 800, 600)
+    try:
+        for result in Engine.PreviewAnalysis(input_name, source, CT_StS, CT_StBP, fractions=fractions, stratified=stratified):
+            DrawPreview(result, output_name, canvas)
+            if not gROOT.IsBatch():
+                gSystem.ProcessEvents()
+    except KeyboardInterrupt:
+        print("\nPreview stopped.")
+    return result
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--source": "allpix", "--ref": "", "--ct": "", "--prefetch": str(Engine.PREFETCH_DEPTH)}
+    write = "--write" in args
+    preview = "--preview" in args
+    args = [arg for arg in args if arg not in ["--write", "--preview"]]
+    for option in options:
+        if option in args:
+            i = args.index(option)
+            options[option] = args[i+1]
+            args = args[:i] + args[i+2:]
+
+    if len(args) < 2 or (preview and len(args) != 2):
+        print("Invalid arguments.\nUsage: python3 QuickPlot.py OUTPUT_NAME INPUT_FILE [INPUT_FILE ...] [--source allpix|athena] [--ref REF_FILE] [--ct StS:StBP,StS:StBP] [--write] [--prefetch N]"
+              "\n       python3 QuickPlot.py OUTPUT_NAME INPUT_FILE --preview [--source allpix|athena] [--ct StS:StBP]")
+    elif preview:
+        CT = tuple(float(value) for value in options["--ct"].split(":")) if options["--ct"] else (0.0, 0.0)
+        Preview(args[1], options["--source"], CT[0], CT[1], args[0])
+    else:
+        settings = [tuple(float(value) for value in setting.split(":")) for setting in options["--ct"].split(",")] if options["--ct"] else [(0.0, 0.0)]
+        jobs = [{"input": input_name, "source": options["--source"], "CT_StS": CT[0], "CT_StBP": CT[1]} for input_name in args[1:] for CT in settings]
+        AnalyseAndPlot(jobs, args[0], options["--ref"], write, int(options["--prefetch"]))
@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+
+from ROOT import TFile, TF1, TEfficiency
+from RootArrays import HistContents, HistErrors, AxisEdges, ArraysToHist, GraphArrays
+import Engine
+import numpy as np
+import ctypes
+import ast
+import re
+import os
+import sys
+import glob
+import time
+
+def LoadFunctions(script_path):
+    """Imports, function definitions and constants of a script without running its module level calls."""
+    tree = ast.parse(open(script_path).read(), script_path)
+    tree.body = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef))
+                 or (isinstance(node, ast.Assign) and not any(isinstance(child, ast.Call) for child in ast.walk(node)))]
+    namespace = dict()
+    exec(compile(tree, script_path, "exec"), namespace)
+    return namespace
+
+
+def ParseFitLog(log_name="log_fits.txt"):
+    """Last logged fit parameters of every function in log_fits.txt as {name: [(value, error), ...]}."""
+    fits = dict()
+    name = None
+    for line in open(log_name):
+        fields = line.split()
+        if len(fields) == 2 and fields[0] == "FCT:":
+            name = fields[1]
+            fits[name] = []
+        elif name is not None and len(fields) == 4 and fields[0] == "P" + str(len(fits[name])) + ":" and fields[2] == "+-":
+            fits[name].append((float(fields[1]), float(fields[3])))
+        elif line.startswith("-----") or line.startswith("PLOT:"):
+            name = None
+    return fits
+
+
+def GoldenCase(golden_path):
+    """Input file, source and crosstalk which produced a golden analysed file, following Analysis.py."""
+    name = os.path.basename(golden_path).split("_")[0]
+    source = "athena" if "athena" in name else "allpix"
+    # The cut files of Athena are named after the cut length, "-cut15um" from "-cut15"
+    name = re.sub(r"-cut(\d+)um$", r"-cut\1", name)
+    if name.endswith("-CT"):
+        return (name[:-3] + "_output.root", source, Engine.CT_FINAL)
+    return (name + "_output.root", source, (0.0, 0.0))
+
+
+def ReadGolden(golden_path):
+    """Thresholds, efficiency, average cluster size and fit parameters stored in a golden file.
+
+    Supports files of Analysis.RunAnalysis ("Efficiency - NAME" histogram and "Cluster Size - NAME_pfx"
+    profile, strict threshold) and of Analysis2.0.RunAnalysis (TEfficiency, inclusive threshold).
+    """
+    name = os.path.basename(golden_path).split("_")[0]
+    golden_file = TFile(golden_path)
+    golden = {"name": name}
+    eff = golden_file.Get("Efficiency")
+    if eff and isinstance(eff, TEfficiency):
+        (thr_start, thr_end, thr_step) = [float(value) for value in str(golden_file.Get("Info").Get("thr_range")).split(":")]
+        golden["thr_range"] = Engine.ThresholdRange(thr_start, thr_end, thr_step)
+        golden["inclusive"] = True
+        bins = [eff.FindFixBin(thr) for thr in golden["thr_range"]]
+        golden["eff"] = np.array([eff.GetEfficiency(thr_bin) for thr_bin in bins])
+        clus_graph = golden_file.Get("Average_cluster_size")
+        golden["clus"] = np.array([clus_graph.Eval(thr) for thr in golden["thr_range"]])
+        fit_func = eff.GetListOfFunctions().FindObject("Efficiency_fit")
+        if fit_func:
+            golden["fit"] = [(fit_func.GetParameter(i), fit_func.GetParError(i)) for i in range(4)]
+    else:
+        eff_hist = golden_file.Get("Efficiency - " + name)
+        clus_prof = golden_file.Get("Cluster Size - " + name + "_pfx")
+        contents = HistContents(eff_hist)
+        edges = AxisEdges(eff_hist.GetXaxis())
+        # Thresholds are multiples of 0.1 fC starting at the first filled bin. Thresholds on a bin
+        # edge were filled into either neighbouring bin depending on rounding, take the filled one.
+        thr_all = np.round(np.arange(0, edges[-1], 0.1), 1)
+        bins_low = np.searchsorted(edges, thr_all - 1e-9, side="right") - 1
+        bins_high = np.searchsorted(edges, thr_all + 1e-9, side="right") - 1
+        thr_bins = np.where(contents[bins_high] != 0, bins_high, bins_low)
+        keep = thr_bins >= np.nonzero(contents)[0][0]
+        golden["thr_range"] = thr_all[keep]
+        golden["inclusive"] = False
+        golden["eff"] = np.array(contents[thr_bins[keep]], dtype=np.float64)
+        # The profile was made from a TH2 and averages the cluster size bin centres, not the integers
+        clus_hist = golden_file.Get("Cluster Size - " + name)
+        y_shift = 0.5 * clus_hist.GetYaxis().GetBinWidth(1) if clus_hist else 0.0
+        golden["clus"] = HistContents(clus_prof)[thr_bins[keep]] - y_shift
+        golden["edges"] = np.array(edges)
+        golden["thr_bins"] = thr_bins[keep]
+    golden_file.Close()
+    return golden
+
+
+def FitLegacyHist(result, edges, thr_bins):
+    """Fits the efficiency in the TH1 format of Analysis.RunAnalysis the same way as Plotting.PlotEfficiency."""
+    n = result["n_events"]
+    contents = np.zeros(len(edges)-1)
+    errors = np.zeros(len(edges)-1)
+    contents[thr_bins] = result["passed"] / n
+    errors[thr_bins] = np.sqrt(result["passed"]) / n
+    eff_hist = ArraysToHist(edges, contents, errors, name="regression_eff")
+    fit_func = TF1("regression_fit", Engine.FIT_FORM, 0, 8)
+    fit_func.SetParameters(1, 4, 1, 1)
+    fit_func.SetParLimits(1, 0, 5)
+    fit_func.SetParLimits(2, 0, 2)
+    fit_func.SetParLimits(3, 0, 2)
+    eff_hist.Fit(fit_func, "QR0")
+    return [(fit_func.GetParameter(i), fit_func.GetParError(i)) for i in range(4)]
+
+
+def TimeLegacy(input_name, source, CT, thr_range, n_thr):
+    """Time of the legacy per-event loop of Analysis.RunAnalysis over the first n_thr thresholds,
+    extrapolated to the full threshold range."""
+    legacy = LoadFunctions("Analysis.py")
+    root_file = TFile("data/raw/" + input_name)
+    if source == "athena":
+        hit_tree = root_file.Get("SCT_RDOAnalysis").Get("SCT_RDOAna")
+        n_strips = 1280
+    else:
+        hit_tree = root_file.PixelCharge
+        n_strips = int(str(root_file.models.Get("atlas17_dut").Get("number_of_pixels")).split(" ")[1])
+    start = time.time()
+    for thr in thr_range[:n_thr]:
+        for event in hit_tree:
+            legacy["GetCluster"](event, thr * Engine.E_PER_FC, source, CT[0], CT[1], n_strips)
+    elapsed = time.time() - start
+    root_file.Close()
+    return elapsed * len(thr_range) / min(n_thr, len(thr_range))
+
+
+def CheckGolden(golden_path, eff_tol=2e-3, clus_tol=5e-3, fit_sigma=3.0, fits=None, n_legacy_thr=2):
+    """Runs the engine on the input of a golden file and compares the physics numbers.
+
+    Returns
+    -------
+    dict
+        Largest efficiency and cluster size differences, fit parameter pulls, timings and "ok"
+    """
+    golden = ReadGolden(golden_path)
+    (input_name, source, CT) = GoldenCase(golden_path)
+    report = {"name": golden["name"], "input": input_name}
+    if not os.path.exists("data/raw/" + input_name):
+        report["status"] = "FAILED"
+        report["problem"] = "missing input " + input_name
+        return report
+
+    start = time.time()
+    events = Engine.ReadEvents(input_name, source)
+    result = Engine.ScanThresholds(Engine.ApplyCrosstalk(events, CT[0], CT[1]), golden["thr_range"], golden["inclusive"])
+    report["engine_time"] = time.time() - start
+
+    (clus_mean, clus_err) = Engine.ClusterMeans(result)
+    valid = np.isfinite(clus_mean) & (golden["clus"] > 0)
+    report["eff_diff"] = float(np.max(np.abs(Engine.Efficiency(result) - golden["eff"])))
+    report["clus_diff"] = float(np.max(np.abs(clus_mean[valid] - golden["clus"][valid]))) if valid.any() else 0.0
+    ok = report["eff_diff"] <= eff_tol and report["clus_diff"] <= clus_tol
+
+    # Fit parameters, compared to the file itself or to the log of Plotting.PlotEfficiency
+    reference_fit = golden.get("fit")
+    if reference_fit is None and fits is not None:
+        reference_fit = fits.get(golden["name"])
+    if reference_fit:
+        if "edges" in golden:
+            engine_fit = FitLegacyHist(result, golden["edges"], golden["thr_bins"])
+        else:
+            engine_fit = Engine.StoreFit(result, Engine.FitEfficiency(Engine.BuildEfficiency(result)))["fit"]
+        report["fit_pulls"] = [abs(engine_fit[i][0] - reference_fit[i][0]) / max(engine_fit[i][1], reference_fit[i][1], 1e-3)
+                               for i in range(min(len(engine_fit), len(reference_fit)))]
+        ok = ok and max(report["fit_pulls"]) <= fit_sigma
+
+    if n_legacy_thr > 0:
+        report["legacy_time"] = TimeLegacy(input_name, source, CT, golden["thr_range"], n_legacy_thr)
+        report["speedup"] = report["legacy_time"] / report["engine_time"]
+    report["status"] = "ok" if ok else "FAILED"
+    return report
+
+
+def ParLimits(fit_func, i):
+    """Lower and upper limit of a parameter of a TF1."""
+    (low, high) = (ctypes.c_double(), ctypes.c_double())
+    fit_func.GetParLimits(i, low, high)
+    return (low.value, high.value)
+
+
+def FileContents(path):
+    """Efficiency counts, fit, cluster size points and Info entries of an analysed file of the engine, for comparisons."""
+    root_file = TFile(path)
+    eff = root_file.Get("Efficiency")
+    fit_func = eff.GetListOfFunctions().FindObject("Efficiency_fit")
+    contents = {
+        "passed": HistContents(eff.GetPassedHistogram()).tolist(),
+        "total": HistContents(eff.GetTotalHistogram()).tolist(),
+        "fit": [(fit_func.GetParameter(i), fit_func.GetParError(i)) + ParLimits(fit_func, i) for i in range(fit_func.GetNpar())],
+        "chi2": fit_func.GetChisquare(),
+        "ndf": fit_func.GetNDF(),
+        "n_fit_points": fit_func.GetNumberFitPoints(),
+        "clus": GraphArrays(root_file.Get("Average_cluster_size")),
+        "info": {key.GetName(): str(root_file.Get("Info").Get(key.GetName())) for key in root_file.Get("Info").GetListOfKeys()},
+    }
+    root_file.Close()
+    contents["clus"] = [array.tolist() for array in contents["clus"]]
+    return contents
+
+
+def CheckAsyncWrite(input_name, source, CT=(0.0, 0.0)):
+    """Writes the analysis of an input with Engine.WriteResult and in the background with Engine.WriteResultAsync
+    and compares the two files, which have to be identical."""
+    report = {"name": "async write", "input": input_name}
+    events = Engine.ReadEvents(input_name, source)
+    outputs = {"sync": "regression-sync_analysed.root", "async": "regression-async_analysed.root"}
+    try:
+        Engine.RunAnalysis(input_name, outputs["sync"], source, CT[0], CT[1], events=events)
+        Engine.RunAnalysis(input_name, outputs["async"], source, CT[0], CT[1], events=events, async_write=True)["write"].result()
+        (sync, background) = [FileContents("data/" + outputs[key]) for key in ["sync", "async"]]
+    finally:
+        for output in outputs.values():
+            if os.path.exists("data/" + output):
+                os.remove("data/" + output)
+    differences = [key for key in sync if sync[key] != background[key]]
+    report["status"] = "FAILED" if differences else "ok"
+    if differences:
+        report["problem"] = "differences in " + ", ".join(differences)
+    return report
+
+
+def PrintReport(report):
+    line = report["status"].ljust(14) + report["name"].ljust(36)
+    if "problem" in report:
+        line += "  " + report["problem"]
+    if "eff_diff" in report:
+        line += "  max|d eff|=" + str(round(report["eff_diff"], 5)) + "  max|d clus|=" + str(round(report["clus_diff"], 5))
+    if "fit_pulls" in report:
+        line += "  max fit pull=" + str(round(max(report["fit_pulls"]), 2))
+    if "speedup" in report:
+        line += "  engine " + str(round(report["engine_time"], 1)) + " s, legacy ~" + str(round(report["legacy_time"], 1)) + " s (x" + str(round(report["speedup"], 1)) + ")"
+    print(line)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    n_legacy_thr = 2
+    if "--legacy-thresholds" in args:
+        i = args.index("--legacy-thresholds")
+        n_legacy_thr = int(args[i+1])
+        args = args[:i] + args[i+2:]
+    golden_paths = args if args else sorted(glob.glob("data/thesis/*_analysed.root"))
+
+    fits = ParseFitLog()
+    n_failed = 0
+    for golden_path in golden_paths:
+        report = CheckGolden(golden_path, fits=fits, n_legacy_thr=n_legacy_thr)
+        PrintReport(report)
+        n_failed += report["status"] == "FAILED"
+
+    # Files written in the background have to be the same as written directly
+    cases = [GoldenCase(golden_path) for golden_path in golden_paths]
+    cases = [case for case in cases if os.path.exists("data/raw/" + case[0])]
+    if cases:
+        report = CheckAsyncWrite(*cases[0])
+        PrintReport(report)
+        n_failed += report["status"] == "FAILED"
+    print(len(golden_paths), "golden files,", n_failed, "failed.")
+    sys.exit(1 if n_failed else 0)
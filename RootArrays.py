@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+
+from ROOT import SetOwnership, TH1D, TH2D, TH2, TProfile, TGraphErrors, TGraphAsymmErrors, TEfficiency, TArrayD, TArrayF, TArrayI, TArrayS, TArrayC
+import numpy as np
+import itertools
+
+# Value types of the arrays behind the histogram classes
+ARRAY_TYPES = [(TArrayD, np.float64), (TArrayF, np.float32), (TArrayI, np.int32), (TArrayS, np.int16), (TArrayC, np.int8)]
+
+# Numbers of the temporary projections of profiles, unique names keep them from replacing objects in gDirectory
+_projection_ids = itertools.count()
+
+
+def BufferView(buffer, n, dtype=np.float64):
+    """Numpy view of n values of a C++ array without copying, None for a null pointer."""
+    if not buffer or n == 0:
+        return None
+    return np.frombuffer(buffer, dtype=dtype, count=n)
+
+
+def _Strip(array, hist, flow):
+    """Drops underflow and overflow bins of a flat array of histogram cells unless flow is set."""
+    if isinstance(hist, TH2):
+        array = array.reshape(hist.GetNbinsY()+2, hist.GetNbinsX()+2).T
+        return array if flow else array[1:-1, 1:-1]
+    return array if flow else array[1:-1]
+
+
+def AxisEdges(axis):
+    """Bin edges of a TAxis."""
+    edges = BufferView(axis.GetXbins().GetArray(), axis.GetXbins().GetSize())
+    if edges is not None:
+        return edges
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), axis.GetNbins()+1)
+
+
+def AxisCenters(axis):
+    """Bin centres of a TAxis."""
+    edges = AxisEdges(axis)
+    return 0.5 * (edges[:-1] + edges[1:])
+
+
+def _ProfileMeans(profile, flow):
+    """Bin means and errors of a TProfile as arrays, read through a temporary projection which is deleted afterwards."""
+    projection = profile.ProjectionX(profile.GetName() + "_means_" + str(next(_projection_ids)))
+    projection.SetDirectory(0)
+    SetOwnership(projection, True)
+    arrays = (HistContents(projection, flow).copy(), HistErrors(projection, flow).copy())
+    del projection
+    return arrays
+
+
+def HistContents(hist, flow=False):
+    """Bin contents of a TH1 or TH2 as a view of the histogram memory, shaped (nx,) or (nx, ny).
+
+    TProfile contents are the bin means and therefore a copy.
+    """
+    if isinstance(hist, TProfile):
+        return _ProfileMeans(hist, flow)[0]
+    for (array_type, dtype) in ARRAY_TYPES:
+        if isinstance(hist, array_type):
+            return _Strip(BufferView(hist.GetArray(), hist.GetNcells(), dtype), hist, flow)
+    raise TypeError("Unsupported histogram type: " + hist.ClassName())
+
+
+def HistErrors(hist, flow=False):
+    """Bin errors of a TH1 or TH2, sqrt of the contents if no weights are stored."""
+    if isinstance(hist, TProfile):
+        return _ProfileMeans(hist, flow)[1]
+    sumw2 = BufferView(hist.GetSumw2().GetArray(), hist.GetSumw2().GetSize())
+    if sumw2 is None:
+        return np.sqrt(np.abs(HistContents(hist, flow).astype(np.float64)))
+    return np.sqrt(_Strip(sumw2, hist, flow))
+
+
+def HistArrays(hist, flow=False):
+    """Bin centres, contents and errors of a one dimensional histogram or profile."""
+    edges = AxisEdges(hist.GetXaxis())
+    centres = 0.5 * (edges[:-1] + edges[1:])
+    if flow:
+        # Flow bin centres as returned by TH1::GetBinCenter
+        centres = np.concatenate([[1.5*edges[0] - 0.5*edges[1]], centres, [1.5*edges[-1] - 0.5*edges[-2]]])
+    return (centres, HistContents(hist, flow), HistErrors(hist, flow))
+
+
+def GraphArrays(graph):
+    """Points and errors of a TGraph, TGraphErrors or TGraphAsymmErrors as views.
+
+    Returns (x, y, ex, ey) for symmetric errors and (x, y, exl, exh, eyl, eyh) for asymmetric ones,
+    missing errors are zero.
+    """
+    n = graph.GetN()
+    x = BufferView(graph.GetX(), n)
+    y = BufferView(graph.GetY(), n)
+    if isinstance(graph, TGraphAsymmErrors):
+        errors = [graph.GetEXlow(), graph.GetEXhigh(), graph.GetEYlow(), graph.GetEYhigh()]
+    else:
+        errors = [graph.GetEX(), graph.GetEY()]
+    errors = [BufferView(error, n) for error in errors]
+    errors = [np.zeros(n) if error is None else error for error in errors]
+    return tuple([x, y] + errors)
+
+
+def EfficiencyArrays(eff, level=0.682689492137):
+    """Threshold points, efficiency and its lower and upper Clopper-Pearson errors of a 1D TEfficiency."""
+    passed = HistContents(eff.GetPassedHistogram()).astype(np.float64)
+    total = HistContents(eff.GetTotalHistogram()).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        efficiency = np.where(total > 0, passed / total, 0)
+    (low, high) = ClopperPearson(passed, total, level)
+    return (AxisCenters(eff.GetTotalHistogram().GetXaxis()), efficiency, efficiency - low, high - efficiency)
+
+
+def ClopperPearson(passed, total, level=0.682689492137):
+    """Lower and upper Clopper-Pearson bounds for arrays of passed and total counts."""
+    try:
+        from scipy.stats import beta
+    except ImportError:
+        low = np.array([TEfficiency.ClopperPearson(int(t), int(p), level, False) for (p, t) in zip(passed, total)])
+        high = np.array([TEfficiency.ClopperPearson(int(t), int(p), level, True) for (p, t) in zip(passed, total)])
+        return (low, high)
+    alpha = 0.5 * (1 - level)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        low = np.where(passed > 0, beta.ppf(alpha, passed, total - passed + 1), 0)
+        high = np.where(passed < total, beta.ppf(1 - alpha, passed + 1, total - passed), 1)
+    return (np.nan_to_num(low), np.nan_to_num(high, nan=1.0))
+
+
+def ArraysToHist(edges, contents, errors=None, name="hist", title=""):
+    """Creates a TH1D with the given bin edges, contents and errors in one call each."""
+    edges = np.ascontiguousarray(edges, dtype=np.float64)
+    hist = TH1D(name, title, len(edges)-1, edges)
+    hist.SetDirectory(0)
+    full = np.zeros(hist.GetNcells())
+    full[1:-1] = contents
+    hist.SetContent(full)
+    if errors is not None:
+        full_errors = np.zeros(hist.GetNcells())
+        full_errors[1:-1] = errors
+        hist.SetError(full_errors)
+    hist.SetEntries(float(np.sum(contents)))
+    return hist
+
+
+def ArraysToGraph(x, y, ex=None, ey=None, name="graph", title=""):
+    """Creates a TGraphErrors from arrays of points and errors."""
+    n = len(x)
+    arrays = [x, y, np.zeros(n) if ex is None else ex, np.zeros(n) if ey is None else ey]
+    arrays = [np.ascontiguousarray(array, dtype=np.float64) for array in arrays]
+    graph = TGraphErrors(n, arrays[0], arrays[1], arrays[2], arrays[3])
+    graph.SetNameTitle(name, title if title else name)
+    return graph
+
+
+def FixedBins(x, n_bins, x_low, x_high):
+    """Bin numbers of values in a histogram with equal bins, including underflow and overflow as TAxis::FindFixBin."""
+    x = np.asarray(x, dtype=np.float64)
+    bins = 1 + np.floor(n_bins * (x - x_low) / (x_high - x_low)).astype(np.int64)
+    bins[x < x_low] = 0
+    bins[x >= x_high] = n_bins + 1
+    return bins
+
+
+def CountsToEfficiency(x, passed, total, n_bins, x_low, x_high, name="Efficiency", title="Efficiency;Threshold [fC];Efficiency"):
+    """Creates a TEfficiency with equal bins from passed and total counts at points x in one shot.
+
+    Gives the same object as calling TEfficiency::Fill total times at every point, passed times with True.
+    """
+    bins = FixedBins(x, n_bins, x_low, x_high)
+    hists = []
+    for (suffix, counts) in [("_passed", passed), ("_total", total)]:
+        counts = np.broadcast_to(np.asarray(counts, dtype=np.float64), bins.shape)
+        hist = TH1D(name + suffix, title, n_bins, x_low, x_high)
+        hist.SetDirectory(0)
+        hist.SetContent(np.bincount(bins, weights=counts, minlength=n_bins+2))
+        hist.SetEntries(float(np.sum(counts)))
+        hists.append(hist)
+    eff = TEfficiency(hists[0], hists[1])
+    eff.SetName(name)
+    eff.SetTitle(title)
+    return eff
+
+
+def CountsToEfficiency2D(x_edges, y, passed, total, n_bins_y, y_low, y_high, name="Efficiency", title="Efficiency"):
+    """Creates a 2D TEfficiency from passed and total counts in bins of x at points y with equal bins, see CountsToEfficiency.
+
+    passed is shaped (n_x, len(y)), total either the same or one count per bin of x used at every point y.
+    """
+    x_edges = np.ascontiguousarray(x_edges, dtype=np.float64)
+    n_x = len(x_edges) - 1
+    y_bins = FixedBins(y, n_bins_y, y_low, y_high)
+    hists = []
+    for (suffix, counts) in [("_passed", passed), ("_total", total)]:
+        counts = np.asarray(counts, dtype=np.float64).reshape(n_x, -1)
+        counts = np.broadcast_to(counts, (n_x, len(y_bins)))
+        hist = TH2D(name + suffix, title, n_x, x_edges, n_bins_y, y_low, y_high)
+        hist.SetDirectory(0)
+        # Cells of a TH2 are ordered by y bin, then x bin, both including underflow and overflow
+        cells = np.zeros((n_bins_y+2, n_x))
+        np.add.at(cells, y_bins, counts.T)
+        hist.SetContent(np.pad(cells, ((0, 0), (1, 1))).ravel())
+        hist.SetEntries(float(np.sum(counts)))
+        hists.append(hist)
+    eff = TEfficiency(hists[0], hists[1])
+    eff.SetName(name)
+    eff.SetTitle(title)
+    return eff
+
+
+def ArraysToEfficiency(edges, passed, total, name="Efficiency", title="Efficiency;Threshold [fC];Efficiency"):
+    """Creates a TEfficiency from arrays of passed and total counts per bin."""
+    passed_hist = ArraysToHist(edges, passed, name=name + "_passed", title=title)
+    total_hist = ArraysToHist(edges, total, name=name + "_total", title=title)
+    eff = TEfficiency(passed_hist, total_hist)
+    eff.SetName(name)
+    eff.SetTitle(title)
+    return eff
@@ -1,6 +1,11 @@
-from os import system as cmd
+from datetime import datetime as date
+import Executors
+import Planner
+import Preflight
+import Engine
+import os
 
-def ModifyGeom(angle):
+def ModifyGeom(angle, jobDir):
     if angle[0] == "x":
         orientation = angle.strip("x") + " 0 0"
     elif angle[0] == "y":
@@ -13,74 +18,178 @@ def ModifyGeom(angle):
     for line in geomCont:
         if "orientation" in line:
             geomCont[geomCont.index(line)] = "orientation = " + orientation + "\n"
-    writeFile = open(geomPath + "geom.conf","w")
+    writeFile = open(jobDir + "geom.conf","w")
     writeFile.writelines(geomCont)        
     writeFile.close()  
 
 
-def ModifyConf(noise, nOfEvents):
+def SetGlobal(key, value):
+    """Sets a key of the [Allpix] section of the main configuration, next to number_of_events if new."""
+    keyLines = [line for line in configCont if line.split("=")[0].strip() == key]
+    if keyLines:
+        configCont[configCont.index(keyLines[0])] = key + " = " + value + "\n"
+    else:
+        eventsLine = [line for line in configCont if "number_of_events" in line][0]
+        configCont.insert(configCont.index(eventsLine) + 1, key + " = " + value + "\n")
+
+
+def ModifyConf(noise, nOfEvents, jobDir, seed=0):
     for line in configCont:
         if "electronics_noise" in line:
             configCont[configCont.index(line)] = "electronics_noise = " + noise + "\n"
         if "number_of_events" in line: 
             configCont[configCont.index(line)] = "number_of_events = " + nOfEvents + "\n"
-    writeFile = open(configPath + "cfg.conf","w")
+    if seed:    # batches of the adaptive mode need independent random numbers
+        SetGlobal("random_seed", str(seed))
+    # Every job reads its own model and writes its own output, relative to its configuration
+    SetGlobal("model_paths", '"."')
+    SetGlobal("output_directory", '"output"')
+    writeFile = open(jobDir + "cfg.conf","w")
     writeFile.writelines(configCont)        
     writeFile.close()
     
 
-def ModifyModel(thickness):
+def ModifyModel(thickness, jobDir):
     for line in modelCont:
         if "sensor_thickness" in line:
             modelCont[modelCont.index(line)] = "sensor_thickness = " + thickness + "\n"
-    writeFile = open(modelPath + "atlas17.conf","w")
+    writeFile = open(jobDir + "atlas17.conf","w")
     writeFile.writelines(modelCont)        
     writeFile.close()     
 
 
-def RunSimulation():
+def SimulationJob(angle, noise, thickness, nOfEvents, seed=0, suffix=""):
+    """
+    Writes the configuration of one simulation to its own directory in jobPath and returns it as a job for Executors.RunJobs, whose output is moved to outputPath/<angle>-<thickness>-<noise><suffix>_output.root.
+    """
+    name = angle + "-" + thickness + "-" + noise + suffix
+    jobDir = jobPath + name + "/"
+    os.makedirs(jobDir, exist_ok=True)
+    ModifyGeom(angle, jobDir)
+    ModifyConf(noise, nOfEvents, jobDir, seed)
+    ModifyModel(thickness, jobDir)
     allpixPath = "/afs/cern.ch/user/r/rprivara/Allpix-" + allpixVers
-    cmd(allpixPath + "/bin/allpix -c cfg.conf")
-    print("Running simulation.", end = " ")
-    
+    return Executors.MakeJob(name, [allpixPath + "/bin/allpix", "-c", "cfg.conf"], jobDir, inputs=["cfg.conf", "geom.conf", "atlas17.conf"],
+                             outputs={"output/output.root": outputPath + name + "_output.root"}, memory=requestMemory, flavour=jobFlavour)
+
 
+def RunAdaptive(angle, noise, thickness, pointIndex=0):
+    """
+    Simulates a point in batches of batchEvents, adding the threshold scan of every batch to the previous ones, until the fitted vt50 and efficiency plateau errors reach targetVt50Err and targetPlateauErr or maxEvents were simulated. Batch outputs are kept as <point>-batchN_output.root, the combined analysis is written to data/<point>_analysed.root.
+    Every batch of every point gets its own random seed, from adaptiveSeed, the index of the point in the full sweep or plan and the batch number.
+    """
+    pointName = angle + "-" + thickness + "-" + noise
+    thrRange = Engine.ThresholdRange()
+    result = None
+    nBatches = 0
+    # Seeds of a point do not overlap with the next one, at most maxBatches batches are simulated
+    maxBatches = -(-maxEvents // int(batchEvents))
+    while True:
+        job = SimulationJob(angle, noise, thickness, batchEvents, seed=adaptiveSeed + pointIndex * maxBatches + nBatches, suffix="-batch" + str(nBatches))
+        if Executors.RunJobs([job], executor, **executorOptions)[job["name"]] != "done":
+            print("Simulation of", job["name"], "failed.")
+            return None
+        batchName = list(job["outputs"].values())[0]
+        nBatches += 1
+        check = Preflight.CheckFile(batchName, "allpix", detectorName)
+        if check["status"] == "error":
+            print("Output of", job["name"], "is broken:", "; ".join(check["problems"]))
+            return None
 
-def MoveOutput(angle,noise,thickness):
-    fileName = outputPath + angle + "-" + thickness + "-" + noise + "_output.root"
-    cmd("cp " + outputPath + "output.root " + fileName)
-    print("Moving output.")
+        events = Engine.ApplyCrosstalk(Engine.ReadEvents(batchName, "allpix", index=False), CT_StS, CT_StBP)
+        result = Engine.AddResults(result, Engine.ScanThresholds(events, thrRange))
+        Engine.StoreFit(result, Engine.FitEfficiency(Engine.BuildEfficiency(result), option="QR0"))
+        plateauErr = result["fit"][0][1]
+        print("Batch", nBatches, ": events:", result["n_events"], ",  vt50:", round(result["vt50"], 3), "+-", round(result["vt50_err"], 4), "fC,  plateau:", round(result["fit"][0][0], 4), "+-", round(plateauErr, 4))
+
+        converged = result["vt50_err"] <= targetVt50Err and plateauErr <= targetPlateauErr
+        if converged or result["n_events"] >= maxEvents or nBatches >= maxBatches:
+            break
+
+    result["source"] = "allpix"
+    result["angle"] = angle
+    result["descr"] = thickness + "-" + noise
+    result["CT_StS"] = CT_StS
+    result["CT_StBP"] = CT_StBP
+    Engine.WriteResult(result, pointName + "_analysed.root")
+
+    logFile = open("log_analysis.txt", "a")
+    logFile.writelines("\nOUTPUT:\t" + pointName + "_analysed.root" + "\nINPUT:\t" + pointName + "-batch[0-" + str(nBatches-1) + "]_output.root" + "\nDATE:\t" + str(date.now()) + "\nCONFIG:\t" + "  events=" + str(result["n_events"]) + "  batches=" + str(nBatches) + "  CT_StS=" + str(CT_StS) + "  CT_StBP=" + str(CT_StBP) + "  thrStep=0.1")
+    logFile.writelines("\nPRECISION:\t" + "vt50=" + str(round(result["vt50"], 4)) + "+-" + str(round(result["vt50_err"], 4)) + "  plateau=" + str(round(result["fit"][0][0], 4)) + "+-" + str(round(plateauErr, 4)) + "  converged=" + str(converged))
+    logFile.write("\n-----\n")
+    logFile.close()
+    return result
 
 #-------------------------------------------------------------------------------------------
-allpixVers = "1.3"
-configPath = geomPath = "/afs/cern.ch/user/r/rprivara/tb/"
-modelPath = "/afs/cern.ch/user/r/rprivara/Allpix-" + allpixVers + "/models/"
-outputPath = "/afs/cern.ch/user/r/rprivara/tb/output/"
-
-#configPath = geomPath = "/home/b/pCloudDrive/Work/MgrThesis/Prog/AllPix/testing/"
-#modelPath = "/home/b/pCloudDrive/Work/MgrThesis/Prog/AllPix/testing/"
-
-# open, read and close config files
-configFile = open(configPath + "cfg_def.conf", "r")
-configCont = configFile.readlines()
-configFile.close()
-modelFile = open(modelPath + "atlas17_def.conf", "r")
-modelCont = modelFile.readlines()
-modelFile.close()
-geomFile = open(geomPath + "geom_def.conf", "r")
-geomCont = geomFile.readlines()
-geomFile.close()
-
-angles = ["0deg", "y5deg", "y12deg", "x23deg"]#, "x23deg"]#, "y10deg", "z15deg"]
-noises = ["864e"]#, "700e", "900e"]
-thicknesses = ["290um"]#, "300um", "305um", "310um", "315um"]
-nOfEvents = "50000"
-
-for angle in angles:
-    for noise in noises:
-        for thickness in thicknesses:
-            print("noise:",noise,"thickness:",thickness, "angle:", angle)
-            ModifyGeom(angle)
-            ModifyConf(noise, nOfEvents)
-            ModifyModel(thickness)
-            RunSimulation()
-            MoveOutput(angle, noise, thickness) 
+# The sweep only runs as a script, executor worker processes import this module
+if __name__ == "__main__":
+    allpixVers = "1.3"
+    configPath = geomPath = "/afs/cern.ch/user/r/rprivara/tb/"
+    modelPath = "/afs/cern.ch/user/r/rprivara/Allpix-" + allpixVers + "/models/"
+    outputPath = "/afs/cern.ch/user/r/rprivara/tb/output/"
+    jobPath = "/afs/cern.ch/user/r/rprivara/tb/jobs/"
+    detectorName = "dut"        # detector of geom_def.conf the outputs are checked for, see Preflight.py
+
+    #configPath = geomPath = "/home/b/pCloudDrive/Work/MgrThesis/Prog/AllPix/testing/"
+    #modelPath = "/home/b/pCloudDrive/Work/MgrThesis/Prog/AllPix/testing/"
+
+    # open, read and close config files
+    configFile = open(configPath + "cfg_def.conf", "r")
+    configCont = configFile.readlines()
+    configFile.close()
+    modelFile = open(modelPath + "atlas17_def.conf", "r")
+    modelCont = modelFile.readlines()
+    modelFile.close()
+    geomFile = open(geomPath + "geom_def.conf", "r")
+    geomCont = geomFile.readlines()
+    geomFile.close()
+
+    angles = ["0deg", "y5deg", "y12deg", "x23deg"]#, "x23deg"]#, "y10deg", "z15deg"]
+    noises = ["864e"]#, "700e", "900e"]
+    thicknesses = ["290um"]#, "300um", "305um", "310um", "315um"]
+    nOfEvents = "50000"
+
+    # Sweep plan of Planner.py (e.g. a Latin hypercube over angle, noise and thickness) replacing the
+    # Cartesian product of the lists above, points with an existing output are skipped
+    planPath = ""
+
+    # Adaptive mode: simulate batches until the fit reaches the target precision
+    adaptive = False
+    batchEvents = "5000"
+    maxEvents = 200000
+    targetVt50Err = 0.01        # fC
+    targetPlateauErr = 0.002
+    adaptiveSeed = 1
+    (CT_StS, CT_StBP) = (0.0, 0.0)
+
+    # Executor of the simulations, see Executors.py: "local" runs n_workers jobs at once on this node,
+    # "condor" submits them as one HTCondor DAG from submit_dir
+    executor = "local"
+    executorOptions = {"n_workers": 4}
+    #executor = "condor"
+    #executorOptions = {"submit_dir": jobPath + "condor"}
+    requestMemory = 2000        # MB
+    jobFlavour = "workday"
+
+    # Points keep their index in the full plan, so seeds do not change when a plan is resumed
+    if planPath:
+        points = list(enumerate(Planner.LoadPlan(planPath)))
+        points = [(pointIndex, point) for (pointIndex, point) in points if not os.path.exists(outputPath + point[0] + "-" + point[2] + "-" + point[1] + "_output.root")]
+    else:
+        points = list(enumerate(Planner.GridPoints(angles, noises, thicknesses)))
+
+    jobs = []
+    for (pointIndex, (angle, noise, thickness)) in points:
+        print("noise:",noise,"thickness:",thickness, "angle:", angle)
+        if adaptive:
+            RunAdaptive(angle, noise, thickness, pointIndex)
+            continue
+        jobs.append(SimulationJob(angle, noise, thickness, nOfEvents))
+    if jobs:
+        status = Executors.RunJobs(jobs, executor, **executorOptions)
+        print(sum(value == "done" for value in status.values()), "of", len(jobs), "simulations done.")
+        # Check the new outputs before anything analyses them
+        reports = Preflight.Preflight([list(job["outputs"].values())[0] for job in jobs if status[job["name"]] == "done"], "allpix", detector=detectorName)
+        nBroken = Preflight.PrintReport(reports)
+        if nBroken:
+            raise OSError(str(nBroken) + " simulation outputs failed the preflight check, see the report above.")
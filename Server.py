@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+
+import ROOT
+import Engine
+import EventIndex
+import json
+import os
+import sys
+import io
+import runpy
+import traceback
+import socket
+import socketserver
+import stat
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from Client import SOCKET_PATH
+
+# ROOT stays loaded for the whole lifetime of the server, canvases are never shown
+ROOT.gROOT.SetBatch(True)
+
+SCRIPTS = ["allpixAnalysis.py", "Analysis.py", "Analysis2.0.py", "Plotting.py", "Run.py"]
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Number of decoded inputs kept in memory, the least recently used one is dropped first
+MAX_CACHED_INPUTS = int(os.environ.get("ALLPIX_ANALYSIS_CACHED_INPUTS", "4"))
+
+# Number of analysis results kept in memory, the least recently used one is dropped first
+MAX_CACHED_RESULTS = int(os.environ.get("ALLPIX_ANALYSIS_CACHED_RESULTS", "16"))
+
+# Decoded inputs and analysis results kept in memory between jobs, keyed by file modification time
+event_cache = OrderedDict()
+result_cache = OrderedDict()
+
+
+def GetEvents(input_name, source, truth=False):
+    """Returns decoded events of an input, decoding it only if it is new, has changed or lacks MC truth."""
+    mtime = os.path.getmtime(EventIndex.RawPath(input_name))
+    key = (os.getcwd(), input_name, source)
+    if key not in event_cache or event_cache[key][0] != mtime or (truth and "track_y" not in event_cache[key][1]):
+        print("Decoding", input_name)
+        event_cache[key] = (mtime, Engine.ReadEvents(input_name, source, truth))
+        while len(event_cache) > MAX_CACHED_INPUTS:
+            event_cache.popitem(last=False)
+    event_cache.move_to_end(key)
+    return event_cache[key]
+
+
+def RunScript(job):
+    """Runs one of the analysis or plotting scripts the same way as from the command line."""
+    script = os.path.realpath(job["script"])
+    if script not in [os.path.join(SCRIPT_DIR, name) for name in SCRIPTS]:
+        raise ValueError("Unknown script: " + job["script"] + ", only " + ", ".join(SCRIPTS) + " of " + SCRIPT_DIR + " can be run")
+    argv = sys.argv
+    sys.argv = [script] + job.get("args", [])
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit:
+        pass
+    finally:
+        sys.argv = argv
+        # Drop canvases and files left open by the script
+        ROOT.gROOT.GetListOfCanvases().Delete()
+        ROOT.gROOT.CloseFiles()
+    return None
+
+
+def RunAnalysis(job):
+    """Runs Engine.RunAnalysis on cached events, reusing a cached result for identical settings."""
+    input_name = job["input"]
+    source = job.get("source", "allpix")
+    in_strip = bool(job.get("in_strip", False))
+    (mtime, events) = GetEvents(input_name, source, in_strip)
+    CT_StS = float(job.get("CT_StS", 0.0))
+    CT_StBP = float(job.get("CT_StBP", 0.0))
+    output_name = job.get("output", "") or input_name.split("_")[0] + "_analysed.root"
+
+    key = (os.getcwd(), input_name, source, mtime, CT_StS, CT_StBP, in_strip)
+    if key in result_cache:
+        print("Using cached result for", input_name)
+        result = result_cache[key]
+        extra_objects = Engine.InStripObjects(result["in_strip"]) if in_strip else []
+        Engine.WriteResult(result, output_name, extra_objects=extra_objects)
+    else:
+        result = Engine.RunAnalysis(input_name, output_name, source, CT_StS, CT_StBP, events=events, in_strip=in_strip)
+        result_cache[key] = result
+        while len(result_cache) > MAX_CACHED_RESULTS:
+            result_cache.popitem(last=False)
+    result_cache.move_to_end(key)
+    return {"vt50": result["vt50"], "vt50_err": result["vt50_err"], "n_events": result["n_events"], "output": output_name}
+
+
+def Status(job):
+    return {
+        "pid": os.getpid(),
+        "events": [key[1] + " (" + key[2] + ")" for key in event_cache],
+        "results": len(result_cache),
+    }
+
+
+def Clear(job):
+    event_cache.clear()
+    result_cache.clear()
+    return None
+
+
+JOBS = {
+    "script": RunScript,
+    "analyse": RunAnalysis,
+    "status": Status,
+    "clear": Clear,
+    "ping": lambda job: "pong",
+}
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Handles one job per connection: a JSON line in, a JSON line with the captured output back."""
+
+    def handle(self):
+        reply = {"ok": True, "result": None}
+        output = io.StringIO()
+        try:
+            job = json.loads(self.rfile.readline().decode())
+            if job.get("job") == "shutdown":
+                self.server.running = False
+            else:
+                cwd = os.getcwd()
+                os.chdir(job.get("cwd", cwd))
+                try:
+                    with redirect_stdout(output):
+                        reply["result"] = JOBS[job["job"]](job)
+                finally:
+                    os.chdir(cwd)
+        except Exception:
+            reply["ok"] = False
+            output.write(traceback.format_exc())
+        reply["output"] = output.getvalue()
+        self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+def Serve(socket_path=SOCKET_PATH):
+    """Serves jobs on a Unix socket until a shutdown job is received. Jobs are run one at a time.
+
+    A socket left behind by a stopped server is replaced, a live one or any other file is not touched.
+    """
+    if os.path.exists(socket_path):
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            raise OSError(socket_path + " exists and is not a socket.")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+        else:
+            raise OSError("An analysis server is already listening on " + socket_path + ".")
+        finally:
+            probe.close()
+    server = socketserver.UnixStreamServer(socket_path, JobHandler)
+    server.running = True
+    print("Analysis server listening on", socket_path)
+    try:
+        while server.running:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+    print("Analysis server stopped.")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) == 2 and args[0] == "--socket":
+        Serve(args[1])
+    elif len(args) == 0:
+        Serve()
+    else:
+        print("Invalid arguments.\nUsage: python3 Server.py [--socket PATH]")
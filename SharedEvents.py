@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+import Engine
+import Noise
+import numpy as np
+import multiprocessing
+import sys
+
+# Event store arrays placed in shared memory, the other entries are passed by value
+SHARED_ARRAYS = ["offsets", "strips", "charges"] + Engine.EVENT_ARRAYS
+
+# Shared memory blocks attached by this process, kept alive as long as their views are used
+_attached = dict()
+
+
+def ShareEvents(events):
+    """Copies the arrays of an event store into shared memory blocks.
+
+    Returns
+    -------
+    tuple
+        (picklable handle for AttachEvents, list of SharedMemory blocks to be closed and unlinked
+        by the owner with ReleaseEvents)
+    """
+    handle = {"arrays": dict(), "values": dict()}
+    blocks = []
+    for key in events:
+        if key in SHARED_ARRAYS:
+            array = np.ascontiguousarray(events[key])
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            handle["arrays"][key] = (block.name, array.shape, array.dtype.str)
+            blocks.append(block)
+        else:
+            handle["values"][key] = events[key]
+    return (handle, blocks)
+
+
+def AttachEvents(handle):
+    """Event store whose arrays are read-only views of the shared memory blocks of a handle, without copying."""
+    events = dict(handle["values"])
+    for key, (name, shape, dtype) in handle["arrays"].items():
+        if name not in _attached:
+            try:
+                _attached[name] = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # Before Python 3.13 attaching registers the block again with the resource tracker
+                # shared with the loader, which unregisters it on release
+                _attached[name] = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_attached[name].buf)
+        array.flags.writeable = False
+        events[key] = array
+    return events
+
+
+def ReleaseEvents(blocks):
+    """Frees the shared memory blocks created by ShareEvents."""
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def _AttachWorker(handle, seed):
+    global _worker_events, _worker_seed
+    _worker_events = AttachEvents(handle)
+    _worker_seed = seed
+
+
+def _EvaluateConfig(config):
+    return EvaluateConfig(_worker_events, config, _worker_seed)
+
+
+def ApplyConfig(events, config, seed=0):
+    """Event store with the crosstalk and electronics effects of a configuration applied, events keep their order.
+
+    The configuration may set "CT_StS", "CT_StBP", "noise", "thr_dispersion" (electrons),
+    "dead_strips" and "noisy_strips", as in Noise.NoiseScan.
+    All random numbers derive from the seed of the scan, 0 by default: the noise from the stream of the noise
+    value (Noise.NoiseStreams) and the threshold offsets from the offset stream (Noise.StripOffsets). Configurations
+    with the same noise share their random numbers, and give the same events as Noise.NoiseScan with that seed.
+    """
+    if "seed" in config:
+        raise ValueError("Configurations have no seed of their own, the seed is set for the whole scan.")
+    events = Engine.ApplyCrosstalk(events, config.get("CT_StS", 0.0), config.get("CT_StBP", 0.0))
+    (noise, thr_dispersion) = (config.get("noise", 0.0), config.get("thr_dispersion", 0.0))
+    if noise > 0 or thr_dispersion > 0 or config.get("dead_strips") or config.get("noisy_strips"):
+        strip_offsets = Noise.StripOffsets(events["n_strips"], thr_dispersion, seed) if thr_dispersion > 0 else None
+        events = Noise.ApplyNoise(events, noise, thr_dispersion, config.get("dead_strips", []), config.get("noisy_strips", []),
+                                  Noise.NoiseStreams(seed, [noise])[0], strip_offsets)
+    return events
+
+
+def EvaluateConfig(events, config, seed=0):
+    """Threshold scan and efficiency fit of one configuration of a decoded sample.
+
+    The configuration may set "thr_range" (fC) and the settings of ApplyConfig, seed is the seed of the scan.
+    """
+    thr_range = config.get("thr_range")
+    if thr_range is None:
+        thr_range = Engine.ThresholdRange()
+    result = Engine.ScanThresholds(ApplyConfig(events, config, seed), thr_range)
+    Engine.StoreFit(result, Engine.FitEfficiency(Engine.BuildEfficiency(result), option="QR0"))
+    result["config"] = config
+    return result
+
+
+def ScanConfigurations(input_name, configs, source="allpix", n_workers=None, events=None, seed=0):
+    """Evaluates many configurations of one input in parallel from a single decoded copy of its events.
+
+    The events are decoded once (or taken from events) into shared memory, pool workers attach
+    to it without copying or decoding. The random numbers of all configurations derive from seed, see ApplyConfig.
+
+    Returns
+    -------
+    list
+        EvaluateConfig results in the order of configs
+    """
+    if events is None:
+        events = Engine.ReadEvents(input_name, source)
+    (handle, blocks) = ShareEvents(events)
+    try:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context, initializer=_AttachWorker, initargs=(handle, seed)) as executor:
+            results = list(executor.map(_EvaluateConfig, configs))
+    finally:
+        ReleaseEvents(blocks)
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--source": "allpix", "--jobs": "0", "--side": "0", "--back": "0", "--seed": "0"}
+    for i in range(1, len(args)-1, 2):
+        options[args[i]] = args[i+1]
+    noises = [float(noise) for noise in options.get("--noise", "0").split(",")]
+
+    if len(args) % 2 != 1:
+        print("Invalid arguments.\nUsage: python3 SharedEvents.py INPUT_FILE [--source allpix|athena] [--noise N1,N2,...] [--side CT_StS] [--back CT_StBP] [--jobs N] [--seed SEED]")
+    else:
+        configs = [{"noise": noise, "CT_StS": float(options["--side"]), "CT_StBP": float(options["--back"])} for noise in noises]
+        results = ScanConfigurations(args[0], configs, options["--source"], int(options["--jobs"]) or None, seed=int(options["--seed"]))
+        for result in results:
+            print("noise", int(result["config"]["noise"]), "e:  vt50 =", round(result["vt50"], 3), "+-", round(result["vt50_err"], 3), "fC")
@@ -0,0 +1,308 @@
+#!/usr/bin/python3
+
+from ROOT import TFile, TCanvas, TLegend, gStyle
+from RootArrays import ArraysToGraph
+from Engine import Thickness, NoiseLevel
+import Planner
+import numpy as np
+import math
+import glob
+import os
+import sys
+
+# Configuration columns of the Trends.TrendTable rows the fit parameters are learned from
+FEATURES = ["thickness", "angle_deg", "noise"]
+
+# Planner parameter of every feature, for suggested simulation points
+PLANNER_NAMES = {"thickness": "thickness", "angle_deg": "angle", "noise": "noise"}
+
+# Fit parameters of Engine.FIT_FORM
+PARAMETER_NAMES = ["plateau", "vt50", "width", "skew"]
+
+# Length scales (in units of the feature ranges) and amplitudes tried for every Gaussian process
+LENGTH_SCALES = [0.1, 0.2, 0.4, 0.8, 1.6, 3.2]
+AMPLITUDES = [0.5, 1.0, 2.0]
+
+
+def TrainingData(rows, features=FEATURES):
+    """Configurations, fit parameters and their errors of the rows with a fit and all features.
+
+    Returns
+    -------
+    tuple
+        (x, y, y_err, names) with one row per file in x (features), y and y_err (fit parameters)
+    """
+    (x, y, y_err, names) = ([], [], [], [])
+    for row in rows:
+        row = dict(row)
+        if "noise" not in row:
+            row["noise"] = NoiseLevel(row["name"])
+        if "thickness" not in row:
+            row["thickness"] = Thickness(row["name"])
+        values = [float(row.get(feature, np.nan)) for feature in features]
+        if "fit" not in row or not np.all(np.isfinite(values)):
+            continue
+        x.append(values)
+        y.append([value for (value, error) in row["fit"]])
+        y_err.append([error for (value, error) in row["fit"]])
+        names.append(row["name"])
+    return (np.array(x).reshape(-1, len(features)), np.array(y), np.array(y_err), names)
+
+
+def Kernel(x1, x2, lengths, amplitude):
+    """Squared exponential covariance of two sets of scaled configurations."""
+    distances = (((x1[:, np.newaxis, :] - x2[np.newaxis, :, :]) / lengths)**2).sum(axis=2)
+    return amplitude**2 * np.exp(-0.5 * distances)
+
+
+def Condition(x, noise, lengths, amplitude):
+    """Cholesky factor of the training covariance, None if it is not positive definite."""
+    covariance = Kernel(x, x, lengths, amplitude) + np.diag(noise + 1e-8 * amplitude**2)
+    try:
+        return np.linalg.cholesky(covariance)
+    except np.linalg.LinAlgError:
+        return None
+
+
+def FitProcess(x, y, y_err):
+    """Gaussian process of one fit parameter, with the hyperparameters of the largest marginal likelihood
+    on the LENGTH_SCALES and AMPLITUDES grid. The fit errors are the noise of the observations."""
+    mean = float(np.mean(y))
+    scale = float(np.std(y)) or 1.0
+    target = (y - mean) / scale
+    noise = (np.nan_to_num(y_err, nan=0.0) / scale)**2
+    n_dims = x.shape[1]
+    best = None
+    for lengths in np.array(np.meshgrid(*[LENGTH_SCALES] * n_dims, indexing="ij")).reshape(n_dims, -1).T:
+        for amplitude in AMPLITUDES:
+            chol = Condition(x, noise, lengths, amplitude)
+            if chol is None:
+                continue
+            alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, target))
+            likelihood = -0.5 * target @ alpha - np.log(np.diag(chol)).sum()
+            if best is None or likelihood > best["likelihood"]:
+                best = {"lengths": lengths, "amplitude": amplitude, "chol": chol, "alpha": alpha, "likelihood": float(likelihood)}
+    if best is None:
+        raise ValueError("No Gaussian process fits the training points.")
+    best.update({"x": x, "noise": noise, "mean": mean, "scale": scale})
+    return best
+
+
+def Train(rows, features=FEATURES):
+    """Surrogate of the efficiency fit parameters as smooth functions of the configuration.
+
+    Parameters
+    ----------
+    rows : list
+        Rows of Trends.TrendTable, files without a fit or a feature are skipped
+    features : list
+        Configuration columns; features with the same value in all rows are left out
+
+    Returns
+    -------
+    dict
+        Features, their ranges, the names of the training files and one Gaussian process per fit parameter
+    """
+    (x, y, y_err, names) = TrainingData(rows, features)
+    if len(names) < 2:
+        raise ValueError("The surrogate needs at least two analysed files with a fit, found " + str(len(names)) + ".")
+    varied = np.ptp(x, axis=0) > 0
+    if not np.any(varied):
+        raise ValueError("The analysed files do not differ in any of " + ", ".join(features) + ".")
+    features = [feature for (feature, keep) in zip(features, varied) if keep]
+    x = x[:, varied]
+    (low, high) = (x.min(axis=0), x.max(axis=0))
+    scaled = (x - low) / (high - low)
+    return {"features": features, "low": low, "high": high, "names": names,
+            "processes": [FitProcess(scaled, y[:, i], y_err[:, i]) for i in range(y.shape[1])]}
+
+
+def ScaleConfigs(model, configs):
+    """Configurations as {feature: value} dicts scaled to the feature ranges of the training files."""
+    x = np.array([[float(config[feature]) for feature in model["features"]] for config in configs]).reshape(-1, len(model["features"]))
+    return (x - model["low"]) / (model["high"] - model["low"])
+
+
+def PredictScaled(process, x):
+    """Mean and standard deviation of one Gaussian process at scaled configurations."""
+    cross = Kernel(x, process["x"], process["lengths"], process["amplitude"])
+    return (process["mean"] + process["scale"] * (cross @ process["alpha"]), process["scale"] * Deviation(process, x, cross))
+
+
+def Deviation(process, x, cross=None):
+    """Predictive standard deviation in units of the parameter scale, it only depends on the training configurations."""
+    if cross is None:
+        cross = Kernel(x, process["x"], process["lengths"], process["amplitude"])
+    solved = np.linalg.solve(process["chol"], cross.T)
+    return np.sqrt(np.maximum(process["amplitude"]**2 - (solved**2).sum(axis=0), 0))
+
+
+def Predict(model, configs):
+    """Predicted fit parameters and their standard deviations, arrays of (configurations, parameters)."""
+    x = ScaleConfigs(model, configs)
+    predictions = [PredictScaled(process, x) for process in model["processes"]]
+    return (np.array([mean for (mean, std) in predictions]).T, np.array([std for (mean, std) in predictions]).T)
+
+
+def Erfc(values):
+    try:
+        from scipy.special import erfc
+    except ImportError:
+        return np.frompyfunc(math.erfc, 1, 1)(values).astype(np.float64)
+    return erfc(values)
+
+
+def EfficiencyCurve(parameters, thr_range):
+    """Engine.FIT_FORM evaluated at the thresholds for every row of fit parameters."""
+    (plateau, vt50, width, skew) = [np.asarray(parameters, dtype=np.float64)[..., i, np.newaxis] for i in range(4)]
+    thr = np.asarray(thr_range, dtype=np.float64)
+    return 0.5 * plateau * Erfc((thr - vt50) / (np.sqrt(2) * width) * (1 - 0.6 * np.tanh(skew * (thr - vt50) / np.sqrt(2) * width)))
+
+
+def PredictCurve(model, config, thr_range, n_samples=500, seed=0):
+    """Predicted efficiency curve at one configuration with its 68% band.
+
+    The band comes from curves of fit parameters drawn from the predictive distributions.
+
+    Returns
+    -------
+    tuple
+        (curve of the mean parameters, lower and upper edge of the band, parameters, their standard deviations)
+    """
+    (mean, std) = Predict(model, [config])
+    samples = np.random.default_rng(seed).normal(mean, std, (n_samples, mean.shape[1]))
+    # Keep the width and skew inside the fit limits of Engine.FitEfficiency
+    samples[:, 2:] = np.clip(samples[:, 2:], 1e-6, 2)
+    curves = EfficiencyCurve(samples, thr_range)
+    (low, high) = np.percentile(curves, [15.87, 84.13], axis=0)
+    return (EfficiencyCurve(mean[0], thr_range), low, high, mean[0], std[0])
+
+
+def Suggest(model, ranges, n_points=4, parameters=None, n_candidates=1024, seed=0):
+    """Simulation points where the surrogate is least certain, chosen one by one.
+
+    Every chosen point is added to the training points before the next choice (the predictive variance
+    does not depend on the simulated values), so the suggestions spread over the uncertain regions.
+
+    Parameters
+    ----------
+    ranges : dict
+        {Planner parameter: (low, high)} to search, see Planner.PARAMETERS
+    parameters : list
+        Indices of the fit parameters whose normalised uncertainties are summed, all by default
+    n_candidates : int
+        Size of the Sobol design the points are chosen from
+
+    Returns
+    -------
+    list
+        Points as Planner points, with the summed "uncertainty": predictive standard deviations in units of
+        the spread of each parameter over the training files (normalised uncertainty), see Deviation
+    """
+    if parameters is None:
+        parameters = list(range(len(model["processes"])))
+    missing = [PLANNER_NAMES[feature] for feature in model["features"] if PLANNER_NAMES.get(feature) not in ranges]
+    if missing:
+        raise ValueError("No range for: " + ", ".join(missing))
+    candidates = Planner.Design(ranges, n_candidates, "sobol", seed)
+    configs = [{feature: point[PLANNER_NAMES[feature]] for feature in model["features"]} for point in candidates]
+    x_candidates = ScaleConfigs(model, configs)
+
+    processes = [dict(model["processes"][i]) for i in parameters]
+    suggestions = []
+    for i in range(n_points):
+        uncertainty = sum(Deviation(process, x_candidates) for process in processes)
+        best = int(np.argmax(uncertainty))
+        if uncertainty[best] <= 0:
+            break
+        suggestions.append(dict(candidates[best], uncertainty=float(uncertainty[best])))
+        for process in processes:
+            process["x"] = np.vstack([process["x"], x_candidates[best]])
+            process["noise"] = np.append(process["noise"], 0.0)
+            process["chol"] = Condition(process["x"], process["noise"], process["lengths"], process["amplitude"])
+            if process["chol"] is None:
+                return suggestions
+    return suggestions
+
+
+def DrawCurve(model, config, output_name, thr_range, ref_file=""):
+    """Draws the predicted efficiency with its band into results/<output_name>_surrogate.pdf, with the
+    measured efficiency of an analysed file in data (e.g. test beam) if ref_file is given."""
+    gStyle.SetOptStat(0)
+    (curve, low, high) = PredictCurve(model, config, thr_range)[:3]
+    title = ", ".join(feature + " = " + str(config[feature]) for feature in model["features"])
+    band = ArraysToGraph(thr_range, 0.5 * (low + high), ey=0.5 * (high - low), name="Surrogate_band", title=title + ";Threshold [fC];Efficiency")
+    line = ArraysToGraph(thr_range, curve, name="Surrogate_curve")
+    canvas = TCanvas("canvas_surrogate", "canvas_surrogate", 800, 600)
+    band.SetFillColorAlpha(2, 0.3)
+    band.SetLineColor(2)
+    line.SetLineColor(2)
+    line.SetLineWidth(2)
+    band.Draw("A3")
+    line.Draw("Lsame")
+    legend = TLegend(0.55, 0.75, 0.88, 0.88)
+    legend.SetBorderSize(0)
+    legend.AddEntry(band, "surrogate (68%)", "fl")
+    objects = [canvas, band, line, legend]
+    if ref_file:
+        ref = TFile("data/" + ref_file)
+        eff_ref = ref.Get("Efficiency")
+        eff_ref.SetMarkerStyle(2)
+        eff_ref.Draw("PEsame")
+        legend.AddEntry(eff_ref, os.path.basename(ref_file).split("_")[0], "p")
+        objects += [ref, eff_ref]
+    legend.Draw("same")
+    canvas.SaveAs("results/" + output_name + "_surrogate.pdf")
+    return objects
+
+
+def ParseValues(text):
+    """Configuration from "key=value,key=value", e.g. "thickness=300,angle_deg=5"."""
+    return {key: float(value) for (key, value) in (item.split("=") for item in filter(None, text.split(",")))}
+
+
+if __name__ == "__main__":
+    from Trends import TrendTable
+    import Engine
+    args = sys.argv[1:]
+    options = {"--features": ",".join(FEATURES), "--pattern": "*_analysed.root", "--predict": "", "--plot": "", "--ref": "",
+               "--suggest": "0", "--out": "", "--angle": "", "--noise": "", "--thickness": ""}
+    directories = []
+    i = 0
+    while i < len(args):
+        if args[i] in options and i+1 < len(args):
+            options[args[i]] = args[i+1]
+            i += 2
+        else:
+            directories.append(args[i])
+            i += 1
+    if not directories:
+        directories = ["data"]
+    paths = sorted(sum([glob.glob(os.path.join(directory, options["--pattern"])) for directory in directories], []))
+
+    if not paths or not (options["--predict"] or int(options["--suggest"])):
+        print("Invalid arguments.\nUsage: python3 Surrogate.py [DIR ...] [--pattern GLOB] [--features thickness,angle_deg,noise]"
+              " [--predict KEY=VALUE,... [--plot NAME] [--ref ANALYSED_FILE]]"
+              "\n       [--suggest N [--angle LOW:HIGH] [--noise LOW:HIGH] [--thickness LOW:HIGH] [--out PLAN_FILE]]")
+    else:
+        model = Train(TrendTable(paths), options["--features"].split(","))
+        print("Surrogate of", len(model["names"]), "files over", ", ".join(model["features"]))
+        if options["--predict"]:
+            config = ParseValues(options["--predict"])
+            (mean, std) = Predict(model, [config])
+            for (name, value, error) in zip(PARAMETER_NAMES, mean[0], std[0]):
+                print(" ", name.ljust(8), "=", round(value, 4), "+-", round(error, 4))
+            if options["--plot"]:
+                DrawCurve(model, config, options["--plot"], Engine.ThresholdRange(), options["--ref"])
+        if int(options["--suggest"]):
+            ranges = Planner.ParseRanges(args)
+            for feature in model["features"]:
+                name = PLANNER_NAMES[feature]
+                if name not in ranges:
+                    ranges[name] = Planner.PARAMETERS[name]["range"]
+            points = Suggest(model, ranges, int(options["--suggest"]))
+            print("Most uncertain configurations:")
+            for point in points:
+                print("  " + "  ".join(Planner.RunNames(point)), " normalised uncertainty", round(point.pop("uncertainty"), 3))
+            if options["--out"]:
+                Planner.SavePlan(options["--out"], points)
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+
+import time
+import sys
+import os
+
+# Directory for Prometheus textfile metrics (e.g. the node exporter textfile collector), off if unset
+METRICS_DIR = os.environ.get("ANALYSIS_METRICS_DIR", "")
+
+# Seconds between reports on a terminal and in batch logs
+INTERVAL = 1.0
+LOG_INTERVAL = 30.0
+
+
+def Progress(task, total=0, unit="events", bytes_read=None, worker="", interval=None):
+    """Starts tracking the progress of a task, see Update.
+
+    Parameters
+    ----------
+    task : str
+        Name of the task, shown and used as metrics label
+    total : int
+        Number of units of the task, 0 if unknown (no ETA)
+    unit : str
+        Name of the units, e.g. "events", "thresholds" or "jobs"
+    bytes_read : callable
+        Optional function returning the bytes read so far, only called when reporting
+    worker : str
+        Name of the worker process, reports of workers are prefixed with it and get their own metrics file
+    interval : float
+        Seconds between reports, INTERVAL on a terminal and LOG_INTERVAL otherwise by default
+    """
+    now = time.monotonic()
+    if interval is None:
+        interval = INTERVAL if sys.stdout.isatty() else LOG_INTERVAL
+    return {"task": task, "total": total, "unit": unit, "bytes_read": bytes_read, "worker": worker, "interval": interval,
+            "start": now, "next": now + interval, "last": (now, 0), "done": 0, "status": ""}
+
+
+def Update(progress, done, status=""):
+    """Records done units and reports rate and ETA if the report interval passed.
+
+    Cheap enough to be called for every event, nothing but a clock read happens between reports.
+    """
+    now = time.monotonic()
+    if now < progress["next"]:
+        return
+    progress["done"] = done
+    progress["status"] = status
+    Report(progress, now)
+
+
+def Finish(progress, done=None, status=""):
+    """Reports the final count, total time and mean rate of a task."""
+    if done is not None:
+        progress["done"] = done
+    progress["status"] = status
+    Report(progress, time.monotonic(), finished=True)
+
+
+def Rates(progress, now):
+    """Units and bytes per second since the last report, and ETA in seconds from the mean rate (None if unknown)."""
+    (last_time, last_done) = progress["last"]
+    rate = (progress["done"] - last_done) / max(now - last_time, 1e-9)
+    elapsed = max(now - progress["start"], 1e-9)
+    n_bytes = progress["bytes_read"]() if progress["bytes_read"] else None
+    byte_rate = None if n_bytes is None else (n_bytes - progress.get("last_bytes", 0)) / max(now - last_time, 1e-9)
+    eta = None
+    if progress["total"] and progress["done"] > 0:
+        eta = (progress["total"] - progress["done"]) / (progress["done"] / elapsed)
+    return (rate, byte_rate, n_bytes, eta)
+
+
+def FormatTime(seconds):
+    seconds = int(round(seconds))
+    return str(seconds // 3600) + ":" + str(seconds // 60 % 60).zfill(2) + ":" + str(seconds % 60).zfill(2)
+
+
+def Report(progress, now, finished=False):
+    (rate, byte_rate, n_bytes, eta) = Rates(progress, now)
+    elapsed = now - progress["start"]
+    line = progress["task"] + ": " + str(progress["done"])
+    if progress["total"]:
+        line += "/" + str(progress["total"]) + " " + progress["unit"] + " (" + str(round(100 * progress["done"] / progress["total"], 1)) + "%)"
+    else:
+        line += " " + progress["unit"]
+    if finished:
+        line += " in " + FormatTime(elapsed) + ", " + str(round(progress["done"] / max(elapsed, 1e-9), 1)) + " " + progress["unit"] + "/s"
+        if n_bytes is not None:
+            line += ", " + str(round(n_bytes / 1024**2, 2)) + " MB read"
+    else:
+        line += ", " + str(round(rate, 1)) + " " + progress["unit"] + "/s"
+        if byte_rate is not None:
+            line += ", " + str(round(byte_rate / 1024**2, 2)) + " MB/s"
+        if eta is not None:
+            line += ", ETA " + FormatTime(eta)
+    if progress["status"]:
+        line += ", " + progress["status"]
+    if progress["worker"]:
+        print("[" + progress["worker"] + "] " + line)
+    elif sys.stdout.isatty():
+        # Pad to overwrite a longer previous line
+        print("\r" + line.ljust(progress.get("width", 0)), end="\n" if finished else "", flush=True)
+        progress["width"] = len(line)
+    else:
+        print(line, flush=True)
+
+    if METRICS_DIR:
+        WriteMetrics(progress, rate, byte_rate, n_bytes, eta, finished)
+    progress["last"] = (now, progress["done"])
+    progress["last_bytes"] = n_bytes or 0
+    progress["next"] = now + progress["interval"]
+
+
+def MetricsPath(progress):
+    name = "".join(char if char.isalnum() or char in "-_" else "_" for char in progress["task"] + "-" + (progress["worker"] or str(os.getpid())))
+    return os.path.join(METRICS_DIR, name + ".prom")
+
+
+def WriteMetrics(progress, rate, byte_rate, n_bytes, eta, finished):
+    """Writes the state of a task in the Prometheus textfile format, replacing the file atomically."""
+    labels = '{task="' + progress["task"] + '",worker="' + (progress["worker"] or str(os.getpid())) + '",unit="' + progress["unit"] + '"}'
+    metrics = [
+        ("analysis_processed_total", "counter", "Units processed so far", progress["done"]),
+        ("analysis_task_units", "gauge", "Units of the task, 0 if unknown", progress["total"]),
+        ("analysis_rate", "gauge", "Units processed per second since the last report", rate),
+        ("analysis_eta_seconds", "gauge", "Estimated seconds to completion, -1 if unknown", -1 if eta is None else eta),
+        ("analysis_finished", "gauge", "1 once the task finished", int(finished)),
+        ("analysis_last_update_timestamp_seconds", "gauge", "Unix time of the last report", time.time()),
+    ]
+    if n_bytes is not None:
+        metrics.append(("analysis_bytes_read_total", "counter", "Bytes read from the input so far", n_bytes))
+        metrics.append(("analysis_bytes_rate", "gauge", "Bytes read per second since the last report", byte_rate))
+    lines = []
+    for (name, kind, description, value) in metrics:
+        lines += ["# HELP " + name + " " + description, "# TYPE " + name + " " + kind, name + labels + " " + repr(float(value))]
+    path = MetricsPath(progress)
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(path + ".tmp", "w") as metrics_file:
+            metrics_file.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+    except OSError as error:
+        print("Could not write metrics to", path + ":", error)
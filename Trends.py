@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+
+from ROOT import TFile, TF1, TCanvas, TLegend, gStyle
+from RootArrays import ArraysToGraph
+from Regression import ParseFitLog
+from Engine import CT_FINAL, Thickness, NoiseLevel
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import multiprocessing
+import hashlib
+import glob
+import json
+import os
+import sys
+
+CACHE_PATH = "data/trends_cache.json"
+
+# Axis titles of the trend variables
+TITLES = {
+    "thickness": "Active sensor thickness [#mum]",
+    "noise": "Noise [e]",
+    "angle_deg": "Incidence angle [#circ]",
+    "CT_StS": "Strip-to-strip crosstalk",
+    "CT_StBP": "Strip-to-backplane crosstalk",
+    "n_events": "Events",
+    "vt50": "V_{t50} [fC]",
+    "plateau": "Efficiency plateau",
+}
+
+
+def Angle(angle):
+    """Rotation axis and angle in degrees of a name part such as "0deg", "y5deg" or "x23deg"."""
+    axis = angle.rstrip("0123456789.deg")
+    try:
+        return (axis, float(angle[len(axis):].replace("deg", "")))
+    except ValueError:
+        return (axis, np.nan)
+
+
+def ReadMetadata(path):
+    """Info directory and efficiency fit of one analysed file as a table row, None for other files.
+
+    Files of Analysis2.0 and Engine have an Info directory and the fit attached to the efficiency,
+    files of Analysis.py only the efficiency histogram; their fit is taken from log_fits.txt later.
+    """
+    root_file = TFile(path)
+    if not root_file or root_file.IsZombie():
+        return None
+    name = os.path.basename(path).split("_")[0]
+    row = {"file": path, "name": name}
+    info = root_file.Get("Info")
+    if info:
+        row["format"] = "info"
+        for key in info.GetListOfKeys():
+            row[key.GetName()] = str(info.Get(key.GetName()))
+        eff = root_file.Get("Efficiency")
+        functions = eff.GetListOfFunctions() if eff and hasattr(eff, "GetListOfFunctions") else []
+        fit_func = [function for function in functions if isinstance(function, TF1)]
+        if fit_func:
+            row["fit"] = [(fit_func[0].GetParameter(i), fit_func[0].GetParError(i)) for i in range(fit_func[0].GetNpar())]
+            row["chi2"] = fit_func[0].GetChisquare()
+            row["ndf"] = fit_func[0].GetNDF()
+    elif root_file.Get("Efficiency - " + name):
+        row["format"] = "legacy"
+        row["source"] = "athena" if "athena" in name else "allpix"
+        row["angle"] = name.split("-")[0]
+        row["descr"] = "-".join(name.split("-")[1:])
+    else:
+        root_file.Close()
+        return None
+    root_file.Close()
+
+    if "CT_StS" not in row:
+        (row["CT_StS"], row["CT_StBP"]) = CT_FINAL if name.endswith("-CT") else (0.0, 0.0)
+    for key in ["CT_StS", "CT_StBP"]:
+        row[key] = float(row[key])
+    (row["axis"], row["angle_deg"]) = Angle(row.get("angle", ""))
+    if "fit" in row:
+        row["vt50"] = row["fit"][1][0]
+        row["vt50_err"] = row["fit"][1][1]
+        row["plateau"] = row["fit"][0][0]
+        row["plateau_err"] = row["fit"][0][1]
+    return row
+
+
+def FileHash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def TrendTable(paths, n_workers=None, log_name="log_fits.txt"):
+    """Metadata rows of all analysed files, read in parallel and cached in CACHE_PATH.
+
+    A cached row is reused while the size and modification time of its file are unchanged, or
+    its content hash still matches if they changed.
+    """
+    cache = dict()
+    if os.path.exists(CACHE_PATH):
+        with open(CACHE_PATH) as cache_file:
+            cache = json.load(cache_file)
+
+    missing = []
+    for path in paths:
+        stat = os.stat(path)
+        entry = cache.get(path)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            continue
+        file_hash = FileHash(path)
+        if entry and entry["sha256"] == file_hash:
+            (entry["mtime_ns"], entry["size"]) = (stat.st_mtime_ns, stat.st_size)
+            continue
+        cache[path] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": file_hash, "row": None}
+        missing.append(path)
+
+    if missing:
+        print("Reading", len(missing), "of", len(paths), "files.")
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+            for path, row in zip(missing, executor.map(ReadMetadata, missing)):
+                cache[path]["row"] = row
+    with open(CACHE_PATH, "w") as cache_file:
+        json.dump(cache, cache_file, indent=1)
+
+    # Fits of files without a stored fit from the log of Plotting.PlotEfficiency
+    fits = ParseFitLog(log_name) if os.path.exists(log_name) else dict()
+    rows = []
+    for path in paths:
+        row = cache[path]["row"]
+        if row is None:
+            continue
+        row = dict(row)
+        # Columns from the file name, also for rows cached before they were added. The noise includes
+        # the simulated noise, Info/noise of Noise.py outputs only the emulated part.
+        row["thickness"] = Thickness(row["name"])
+        row["noise"] = NoiseLevel(row["name"])
+        if "fit" not in row and row["name"] in fits and len(fits[row["name"]]) > 1:
+            row["fit"] = fits[row["name"]]
+            (row["vt50"], row["vt50_err"]) = row["fit"][1]
+            (row["plateau"], row["plateau_err"]) = row["fit"][0]
+        rows.append(row)
+    return rows
+
+
+def PlotTrend(rows, x="thickness", y="vt50", group="source", plotName="trend"):
+    """Plots a fit parameter vs a configuration variable, one series per value of group.
+
+    Parameters
+    ----------
+    rows : list
+        Rows of TrendTable
+    x : str
+        "thickness", "angle_deg", "CT_StS", "CT_StBP" or any other numeric column
+    y : str
+        "vt50", "plateau" or any other column with a "_err" column
+    group : str
+        Column splitting the rows into series, e.g. "source" or "descr"
+    plotName : str
+        Name of the produced file in results
+    """
+    canvas = TCanvas("c1", "c1", 800, 600)
+    gStyle.SetOptStat(0)
+    gStyle.SetOptTitle(0)
+    color = [1, 2, 4, 6, 9, 8, 28, 30]
+    markerStyle = [21, 22, 23, 33, 34, 28, 27, 32]
+
+    rows = [row for row in rows if np.isfinite(float(row.get(x, np.nan))) and np.isfinite(float(row.get(y, np.nan)))]
+    groups = sorted(set(str(row.get(group, "")) for row in rows))
+    legend = TLegend(0.13, 0.88 - 0.06*len(groups), 0.45, 0.88)
+    legend.SetBorderSize(0)
+    graphs = []
+    for i in range(len(groups)):
+        series = sorted([row for row in rows if str(row.get(group, "")) == groups[i]], key=lambda row: float(row[x]))
+        graphs.append(ArraysToGraph([row[x] for row in series], [row[y] for row in series],
+                                    ey=[row.get(y + "_err", 0.0) for row in series], name=plotName + "_" + str(i)))
+        graphs[i].SetMarkerSize(1)
+        graphs[i].SetMarkerColor(color[i % len(color)])
+        graphs[i].SetLineColor(color[i % len(color)])
+        graphs[i].SetMarkerStyle(markerStyle[i % len(markerStyle)])
+        if i == 0:
+            values = [row[y] for row in rows]
+            graphs[i].GetXaxis().SetTitle(TITLES.get(x, x))
+            graphs[i].GetYaxis().SetTitle(TITLES.get(y, y))
+            graphs[i].GetXaxis().SetLimits(min(float(row[x]) for row in rows) * 0.9 - 1e-3, max(float(row[x]) for row in rows) * 1.1 + 1e-3)
+            graphs[i].GetHistogram().SetMinimum(min(values) - 0.1 * abs(min(values)))
+            graphs[i].GetHistogram().SetMaximum(max(values) + 0.1 * abs(max(values)))
+            graphs[i].Draw("APL")
+        else:
+            graphs[i].Draw("samePL")
+        legend.AddEntry(graphs[i], groups[i], "p")
+
+    legend.Draw("same")
+    canvas.SaveAs("results/" + plotName + ".pdf")
+    return graphs
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--x": "thickness", "--y": "vt50", "--by": "source", "--plot": "", "--pattern": "*_analysed.root", "--jobs": "0"}
+    directories = []
+    i = 0
+    while i < len(args):
+        if args[i] in options and i+1 < len(args):
+            options[args[i]] = args[i+1]
+            i += 2
+        else:
+            directories.append(args[i])
+            i += 1
+    if not directories:
+        directories = ["data", "data/thesis"]
+
+    paths = sorted(sum([glob.glob(os.path.join(directory, options["--pattern"])) for directory in directories], []))
+    if not paths:
+        print("No analysed files found.\nUsage: python3 Trends.py [DIR ...] [--pattern GLOB] [--x thickness|angle_deg|CT_StS] [--y vt50|plateau] [--by source] [--plot NAME] [--jobs N]")
+    else:
+        rows = TrendTable(paths, int(options["--jobs"]) or None)
+        for row in rows:
+            vt50 = str(round(row["vt50"], 3)) + " +- " + str(round(row["vt50_err"], 3)) if "vt50" in row else "-"
+            print(row["name"].ljust(36), row["source"].ljust(8), str(row["thickness"]).ljust(7), str(row["angle_deg"]).ljust(6),
+                  str(row["CT_StS"]).ljust(7), "vt50 =", vt50)
+        if options["--plot"]:
+            PlotTrend(rows, options["--x"], options["--y"], options["--by"], options["--plot"])
@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+
+from ROOT import TFile
+from RootArrays import GraphArrays
+from scipy.optimize import minimize
+from datetime import datetime as date
+import Engine
+import numpy as np
+import sys
+
+# Names of the reference efficiency graphs, as in Plotting.PlotEfficiency
+REF_HISTS = {
+    "time": "efficiency_vs_threshold_time_corrected",
+    "center": "efficiency_vs_threshold_strip_ctr",
+    "edge": "efficiency_vs_threshold_strip_edge",
+}
+
+
+def LoadReference(ref_file_name, ref_option="time"):
+    """Reads test beam efficiency and cluster size points from a reference file in data.
+
+    Returns
+    -------
+    dict
+        Arrays "eff_x", "eff", "eff_err", "clus_x", "clus", "clus_err"
+    """
+    ref_file = TFile("data/" + ref_file_name)
+    reference = dict()
+    for (key, hist_name) in [("eff", REF_HISTS[ref_option]), ("clus", "cluster_size_vs_threshold")]:
+        arrays = GraphArrays(ref_file.Get(hist_name))
+        reference[key + "_x"] = np.array(arrays[0])
+        reference[key] = np.array(arrays[1])
+        # Symmetrise asymmetric errors
+        reference[key + "_err"] = np.array(arrays[3]) if len(arrays) == 4 else 0.5 * (np.array(arrays[4]) + np.array(arrays[5]))
+    ref_file.Close()
+    return reference
+
+
+def Chi2(events, reference, CT_StS, CT_StBP, use_clus=True):
+    """Efficiency and cluster size chi2 of a crosstalk setting against the reference.
+
+    The simulation is evaluated directly at the reference thresholds, its statistical errors
+    are added in quadrature to the reference errors.
+    """
+    thr_range = np.unique(np.concatenate([reference["eff_x"], reference["clus_x"]]))
+    result = Engine.ScanThresholds(Engine.ApplyCrosstalk(events, CT_StS, CT_StBP), thr_range)
+
+    eff = Engine.Efficiency(result)
+    eff_err = np.sqrt(np.maximum(eff * (1 - eff), 1 / result["n_events"]) / result["n_events"])
+    i_eff = np.searchsorted(thr_range, reference["eff_x"])
+    chi2 = np.sum((eff[i_eff] - reference["eff"])**2 / (eff_err[i_eff]**2 + reference["eff_err"]**2))
+    n_points = len(i_eff)
+
+    if use_clus:
+        (clus_mean, clus_err) = Engine.ClusterMeans(result)
+        i_clus = np.searchsorted(thr_range, reference["clus_x"])
+        clus_var = clus_err[i_clus]**2 + reference["clus_err"]**2
+        valid = np.isfinite(clus_mean[i_clus]) & np.isfinite(clus_var) & (clus_var > 0)
+        chi2 += np.sum((clus_mean[i_clus][valid] - reference["clus"][valid])**2 / clus_var[valid])
+        n_points += int(np.count_nonzero(valid))
+
+    return (chi2, n_points)
+
+
+def Hessian(function, x, step):
+    """Finite difference Hessian of a function of a few parameters."""
+    n = len(x)
+    hessian = np.zeros((n, n))
+    f0 = function(x)
+    for i in range(n):
+        for j in range(i, n):
+            (ei, ej) = (np.eye(n)[i] * step[i], np.eye(n)[j] * step[j])
+            if i == j:
+                hessian[i, i] = (function(x + ei) - 2*f0 + function(x - ei)) / step[i]**2
+            else:
+                hessian[i, j] = (function(x + ei + ej) - function(x + ei - ej) - function(x - ei + ej) + function(x - ei - ej)) / (4 * step[i] * step[j])
+                hessian[j, i] = hessian[i, j]
+    return hessian
+
+
+def TuneCrosstalk(events, reference, start=(0.015, 0.01), bounds=(0.0, 0.1), use_clus=True, step=0.002):
+    """Finds the crosstalk fractions minimising the chi2 against test beam data with Nelder-Mead.
+
+    Uncertainties correspond to a chi2 increase of 1, from the curvature of the chi2 at the minimum.
+    The finite difference step should be large enough to smooth out the discreteness of cluster counts.
+    No uncertainties are given if the minimum lies within one step of a bound or the curvature is not
+    positive definite; "status" tells which.
+
+    Returns
+    -------
+    dict
+        Best-fit "CT_StS", "CT_StBP", their errors, correlation "rho", "chi2", "n_points", "n_evals" and "status"
+        ("ok", "at bound: <parameters>" or "chi2 not convex at the minimum")
+    """
+    n_evals = [0]
+
+    def Objective(params):
+        n_evals[0] += 1
+        # Penalise fractions outside of the allowed range instead of evaluating them
+        if min(params) < bounds[0] or max(params) > bounds[1]:
+            return 1e12
+        return Chi2(events, reference, params[0], params[1], use_clus)[0]
+
+    fit = minimize(Objective, np.array(start, dtype=np.float64), method="Nelder-Mead",
+                   options={"xatol": 1e-5, "fatol": 1e-3, "initial_simplex": [start, (start[0] + 0.01, start[1]), (start[0], start[1] + 0.01)]})
+    best = fit.x
+    (chi2, n_points) = Chi2(events, reference, best[0], best[1], use_clus)
+
+    errors = np.array([np.nan, np.nan])
+    rho = np.nan
+    at_bound = [name for (name, value) in zip(["CT_StS", "CT_StBP"], best) if value - step < bounds[0] or value + step > bounds[1]]
+    if at_bound:
+        # The curvature would need points outside of the allowed range
+        status = "at bound: " + ", ".join(at_bound)
+    else:
+        hessian = Hessian(Objective, best, [step, step])
+        try:
+            np.linalg.cholesky(hessian)
+            covariance = 2 * np.linalg.inv(hessian)
+            errors = np.sqrt(np.diag(covariance))
+            rho = covariance[0, 1] / (errors[0] * errors[1])
+            status = "ok"
+        except np.linalg.LinAlgError:
+            status = "chi2 not convex at the minimum"
+
+    return {
+        "CT_StS": best[0],
+        "CT_StS_err": errors[0],
+        "CT_StBP": best[1],
+        "CT_StBP_err": errors[1],
+        "rho": rho,
+        "chi2": chi2,
+        "n_points": n_points,
+        "n_evals": n_evals[0],
+        "status": status,
+    }
+
+
+def LogTuning(input_name, ref_file_name, tuning, log_name="log_tuning.txt"):
+    """Appends the tuning result to log_name, kept apart from the fit log log_fits.txt."""
+    with open(log_name, "a") as logFile:
+        logFile.write("\nTUNING:\t\t\t\t" + input_name + " to " + ref_file_name)
+        logFile.write("\nDATE:\t\t\t\t" + str(date.now()))
+        logFile.write("\n\t\tChi2:\t\t" + str(round(tuning["chi2"], 2)))
+        logFile.write("\n\t\tNDF:\t\t" + str(tuning["n_points"] - 2))
+        logFile.write("\n\t\tCT_StS:\t\t" + str(round(tuning["CT_StS"], 5)) + " +- " + str(round(tuning["CT_StS_err"], 5)))
+        logFile.write("\n\t\tCT_StBP:\t" + str(round(tuning["CT_StBP"], 5)) + " +- " + str(round(tuning["CT_StBP_err"], 5)))
+        logFile.write("\n\t\tCorrelation:\t" + str(round(tuning["rho"], 3)))
+        logFile.write("\n\t\tStatus:\t\t" + tuning["status"])
+        logFile.write("\n-----\n")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {"--source": "allpix", "--option": "time"}
+    valid = len(args) >= 2 and len(args) % 2 == 0 and all(args[i] in options for i in range(2, len(args), 2))
+    if valid:
+        for i in range(2, len(args), 2):
+            options[args[i]] = args[i+1]
+        valid = options["--source"] in ["allpix", "athena"] and options["--option"] in REF_HISTS
+    if not valid:
+        print("Invalid arguments.\nUsage: python3 Tuning.py INPUT_FILE REF_FILE [--source allpix|athena] [--option time|center|edge]")
+    else:
+        events = Engine.ReadEvents(args[0], options["--source"], truth=options["--option"] != "time")
+        if options["--option"] != "time":
+            # Restrict the simulation to the same in-strip region as the reference
+            position = np.abs(Engine.InStripPosition(events))
+            keep = position < 0.1 if options["--option"] == "center" else position >= 0.4
+            events = Engine.SelectEvents(events, np.nonzero(keep)[0])
+        tuning = TuneCrosstalk(events, LoadReference(args[1], options["--option"]))
+        print("CT_StS  =", round(tuning["CT_StS"], 5), "+-", round(tuning["CT_StS_err"], 5))
+        print("CT_StBP =", round(tuning["CT_StBP"], 5), "+-", round(tuning["CT_StBP_err"], 5))
+        print("chi2/ndf =", round(tuning["chi2"], 1), "/", tuning["n_points"] - 2, "  evaluations:", tuning["n_evals"])
+        if tuning["status"] != "ok":
+            print("No uncertainties,", tuning["status"])
+        LogTuning(args[0], args[1], tuning)